@@ -0,0 +1,156 @@
+"""Pre-aggregated operation counters for the analytics endpoints.
+
+Instead of running a ``count_documents`` scan per figure, every operation
+the audit log writes is also counted here: a total plus one counter per
+value of the collection's dimension (``operation_type`` or ``category``),
+and the same again per minute and per hour bucket. Counts accumulate in
+memory and are persisted with ``$inc`` each time the audit log flushes, so
+several server processes can share the same summary documents:
+
+* ``analytics_summary``: one document per collection, ``_id`` is the
+  collection name, ``{"total": n, "by": {value: n}}``.
+* ``analytics_buckets``: one document per collection, granularity and
+  bucket start, with the same ``total`` / ``by`` fields.
+
+Reading a summary is then a single ``find_one``.
+
+Records written before counting started are added to the summaries once
+by ``bootstrap``. Whichever process creates a summary document first
+stamps it with ``counted_from``, the timestamp of the oldest record it
+counted, and bootstrap adds up the records older than that. The
+``bootstrapped`` field marks a summary as seeded, so that bootstrapping is
+done once even when several processes start at the same time. Records
+still queued in another process when the summary is created are counted
+by both, so the boundary is only exact to within one audit flush.
+
+A record carrying ``conversion_count`` (a client's usage report covering
+that many local conversions) counts that many times.
+"""
+import logging
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# The field each collection's counters are broken down by
+DIMENSIONS = {
+    "pdf_operations": "operation_type",
+    "image_operations": "operation_type",
+    "conversion_operations": "category",
+}
+
+GRANULARITIES = {
+    "minute": lambda ts: ts.replace(second=0, microsecond=0),
+    "hour": lambda ts: ts.replace(minute=0, second=0, microsecond=0),
+}
+
+
+def _field(value: Any) -> str:
+    # Counter names become field paths, which may not contain '.' or start with '$'
+    return str(value).replace('.', '_').lstrip('$') or '_'
+
+
+class OperationCounters:
+    def __init__(self):
+        # Deltas not yet persisted, keyed by (collection, granularity, bucket start);
+        # granularity and start are None for the all-time summary
+        self._pending: Dict[Tuple[str, Optional[str], Optional[datetime]], Counter] = defaultdict(Counter)
+        # Timestamp of the oldest record in the pending deltas, per collection
+        self._earliest: Dict[str, datetime] = {}
+
+    def count(self, collection: str, document: Dict[str, Any]) -> None:
+        """Count one written operation record"""
+        dimension = DIMENSIONS.get(collection)
+        if dimension is None:
+            return
+        value = _field(document.get(dimension))
+        timestamp = document.get("timestamp") or datetime.utcnow()
+        weight = document.get("conversion_count") or 1
+        self._earliest[collection] = min(timestamp, self._earliest.get(collection, timestamp))
+
+        keys = [(collection, None, None)]
+        keys += [(collection, name, floor(timestamp)) for name, floor in GRANULARITIES.items()]
+        for key in keys:
+            self._pending[key]["total"] += weight
+            self._pending[key][f"by.{value}"] += weight
+
+    async def persist(self, database) -> None:
+        """Apply the pending deltas to the summary documents with $inc"""
+        pending, self._pending = self._pending, defaultdict(Counter)
+        earliest, self._earliest = self._earliest, {}
+        for key, deltas in pending.items():
+            collection, granularity, start = key
+            try:
+                if granularity is None:
+                    await database.analytics_summary.update_one(
+                        {"_id": collection},
+                        {"$inc": dict(deltas), "$setOnInsert": {"counted_from": earliest[collection]}},
+                        upsert=True,
+                    )
+                else:
+                    await database.analytics_buckets.update_one(
+                        {"_id": f"{collection}:{granularity}:{start.isoformat()}"},
+                        {
+                            "$inc": dict(deltas),
+                            "$setOnInsert": {"collection": collection, "granularity": granularity, "start": start},
+                        },
+                        upsert=True,
+                    )
+            except Exception as e:
+                # Keep the deltas so the next flush retries them
+                self._pending[key].update(deltas)
+                if granularity is None:
+                    self._earliest[collection] = min(
+                        earliest[collection], self._earliest.get(collection, earliest[collection])
+                    )
+                logger.error(f"Error persisting analytics counters for {collection}: {str(e)}")
+
+    async def bootstrap(self, database) -> None:
+        """Add the records written before counting started to the summaries (once)"""
+        for collection, dimension in DIMENSIONS.items():
+            # Records from now on are counted as they are written, unless
+            # another process has already started counting
+            await database.analytics_summary.update_one(
+                {"_id": collection}, {"$setOnInsert": {"counted_from": datetime.utcnow()}}, upsert=True
+            )
+            summary = await database.analytics_summary.find_one({"_id": collection})
+            # Summaries without counted_from predate the marker and were seeded on creation
+            if summary is None or summary.get("bootstrapped") or "counted_from" not in summary:
+                continue
+            uncounted = {"$or": [
+                {"timestamp": {"$lt": summary["counted_from"]}},
+                {"timestamp": {"$exists": False}},
+            ]}
+            deltas = Counter()
+            weight = {"$ifNull": ["$conversion_count", 1]}
+            pipeline = [{"$match": uncounted}, {"$group": {"_id": f"${dimension}", "n": {"$sum": weight}}}]
+            async for row in database[collection].aggregate(pipeline):
+                deltas["total"] += row["n"]
+                deltas[f"by.{_field(row['_id'])}"] += row["n"]
+            # Matches nothing if another server process seeded it first
+            await database.analytics_summary.update_one(
+                {"_id": collection, "bootstrapped": {"$exists": False}},
+                {"$inc": {"total": 0, **deltas}, "$set": {"bootstrapped": True}},
+            )
+
+    async def summary(self, database, collection: str) -> Dict[str, Any]:
+        """Persisted totals plus this process's not yet persisted deltas"""
+        document = await database.analytics_summary.find_one({"_id": collection}) or {}
+        total = document.get("total", 0)
+        by = dict(document.get("by", {}))
+        for name, delta in self._pending.get((collection, None, None), Counter()).items():
+            if name == "total":
+                total += delta
+            else:
+                value = name[len("by."):]
+                by[value] = by.get(value, 0) + delta
+        return {"total": total, "by": by}
+
+    async def buckets(self, database, collection: str, granularity: str, limit: int) -> List[Dict[str, Any]]:
+        """The most recent time buckets, newest first"""
+        cursor = database.analytics_buckets.find(
+            {"collection": collection, "granularity": granularity},
+            {"_id": 0, "start": 1, "total": 1, "by": 1},
+        ).sort("start", -1).limit(limit)
+        return await cursor.to_list(limit)
@@ -0,0 +1,225 @@
+"""Cached ZIP archive of a directory tree, rebuilt incrementally.
+
+``ProjectArchive`` keeps one ZIP of ``root`` on disk. Each request first
+scans the tree (at most once per ``rescan_interval``) and compares path,
+mtime and size of every file against the current archive. If nothing
+changed the archive is served as is; otherwise a new one is written in
+which unchanged entries are copied over as raw compressed bytes and only
+new or modified files are deflated again.
+
+The ZIP structures are written by hand because ``zipfile`` cannot copy an
+already-compressed entry from one archive into another. Only the classic
+(non-ZIP64) format is produced, which limits the tree to 65535 files and
+4 GiB.
+"""
+import hashlib
+import os
+import struct
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+CHUNK_SIZE = 1024 * 1024
+ZIP_LIMIT = 0xFFFFFFFF
+
+
+@dataclass
+class ArchiveEntry:
+    name: str
+    mtime_ns: int
+    size: int
+    mode: int
+    crc32: int = 0
+    compressed_size: int = 0
+    header_offset: int = 0
+    data_offset: int = 0
+
+
+def _dos_datetime(mtime_ns: int) -> Tuple[int, int]:
+    year, month, day, hour, minute, second = time.localtime(mtime_ns / 1e9)[:6]
+    if year < 1980:
+        year, month, day, hour, minute, second = 1980, 1, 1, 0, 0, 0
+    return (
+        (hour << 11) | (minute << 5) | (second // 2),
+        ((year - 1980) << 9) | (month << 5) | day,
+    )
+
+
+def _local_header(entry: ArchiveEntry, name: bytes) -> bytes:
+    dos_time, dos_date = _dos_datetime(entry.mtime_ns)
+    return struct.pack(
+        '<IHHHHHIIIHH', 0x04034b50, 20, 0x800, 8, dos_time, dos_date,
+        entry.crc32, entry.compressed_size, entry.size, len(name), 0,
+    ) + name
+
+
+def _central_header(entry: ArchiveEntry, name: bytes) -> bytes:
+    dos_time, dos_date = _dos_datetime(entry.mtime_ns)
+    return struct.pack(
+        '<IHHHHHHIIIHHHHHII', 0x02014b50, (3 << 8) | 20, 20, 0x800, 8, dos_time, dos_date,
+        entry.crc32, entry.compressed_size, entry.size, len(name), 0, 0, 0, 0,
+        (entry.mode & 0xFFFF) << 16, entry.header_offset,
+    ) + name
+
+
+class ProjectArchive:
+    def __init__(
+        self,
+        root: str,
+        cache_dir: str,
+        exclude: Iterable[str] = (),
+        exclude_names: Iterable[str] = ("__pycache__",),
+        rescan_interval: float = 1.0,
+    ):
+        self.root = os.path.abspath(root)
+        self.cache_dir = cache_dir
+        self.exclude = {os.path.abspath(path) for path in exclude} | {os.path.abspath(cache_dir)}
+        self.exclude_names = set(exclude_names)
+        self.rescan_interval = rescan_interval
+
+        self.path: Optional[str] = None
+        self.etag: Optional[str] = None
+        self._entries: Dict[str, ArchiveEntry] = {}
+        self._lock = threading.Lock()
+        self._scanned_at = 0.0
+        self.rebuilds = 0
+        self.recompressed = 0
+        self.reused = 0
+
+    def scan(self) -> List[ArchiveEntry]:
+        """Current files of the tree, in archive order"""
+        entries = []
+        for directory, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = sorted(
+                name for name in dirnames
+                if name not in self.exclude_names and os.path.join(directory, name) not in self.exclude
+            )
+            for filename in sorted(filenames):
+                path = os.path.join(directory, filename)
+                if path in self.exclude:
+                    continue
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                name = os.path.relpath(path, self.root).replace(os.sep, '/')
+                entries.append(ArchiveEntry(name, stat.st_mtime_ns, stat.st_size, stat.st_mode))
+        return entries
+
+    @staticmethod
+    def _signature(entries: List[ArchiveEntry]) -> str:
+        digest = hashlib.sha256()
+        for entry in entries:
+            digest.update(f"{entry.name}\0{entry.mtime_ns}\0{entry.size}\n".encode())
+        return digest.hexdigest()[:32]
+
+    def current(self) -> Tuple[str, str]:
+        """Return (path, etag) of an archive matching the tree, rebuilding if needed"""
+        with self._lock:
+            if self.path is not None and time.monotonic() - self._scanned_at < self.rescan_interval:
+                return self.path, self.etag
+
+            entries = self.scan()
+            self._scanned_at = time.monotonic()
+            etag = self._signature(entries)
+            if etag != self.etag or self.path is None or not os.path.exists(self.path):
+                self._build(entries, etag)
+            return self.path, self.etag
+
+    def _build(self, entries: List[ArchiveEntry], etag: str) -> None:
+        if len(entries) >= 0xFFFF:
+            raise ValueError("Too many files for a ZIP archive without ZIP64")
+        os.makedirs(self.cache_dir, exist_ok=True)
+        target = os.path.join(self.cache_dir, f"project-{etag}.zip")
+        partial = f"{target}.partial"
+
+        previous = None
+        if self.path is not None and os.path.exists(self.path):
+            previous = open(self.path, 'rb')
+        try:
+            with open(partial, 'wb') as output:
+                for entry in entries:
+                    old = self._entries.get(entry.name)
+                    if previous is not None and old is not None and (old.mtime_ns, old.size) == (entry.mtime_ns, entry.size):
+                        self._copy_entry(previous, old, entry, output)
+                        self.reused += 1
+                    else:
+                        self._deflate_entry(entry, output)
+                        self.recompressed += 1
+
+                central_offset = output.tell()
+                for entry in entries:
+                    output.write(_central_header(entry, entry.name.encode()))
+                central_size = output.tell() - central_offset
+                if central_offset + central_size >= ZIP_LIMIT:
+                    raise ValueError("Archive too large for a ZIP without ZIP64")
+                output.write(struct.pack(
+                    '<IHHHHIIH', 0x06054b50, 0, 0, len(entries), len(entries),
+                    central_size, central_offset, 0,
+                ))
+        finally:
+            if previous is not None:
+                previous.close()
+        os.replace(partial, target)
+
+        old_path = self.path
+        self.path, self.etag = target, etag
+        self._entries = {entry.name: entry for entry in entries}
+        self.rebuilds += 1
+        if old_path is not None and old_path != target:
+            # Responses still streaming the old archive keep their open handle
+            try:
+                os.remove(old_path)
+            except FileNotFoundError:
+                pass
+
+    def _copy_entry(self, source, old: ArchiveEntry, entry: ArchiveEntry, output) -> None:
+        """Copy an unchanged entry's compressed bytes without recompressing them"""
+        entry.crc32, entry.compressed_size = old.crc32, old.compressed_size
+        entry.header_offset = output.tell()
+        output.write(_local_header(entry, entry.name.encode()))
+        entry.data_offset = output.tell()
+        source.seek(old.data_offset)
+        remaining = old.compressed_size
+        while remaining:
+            chunk = source.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                raise ValueError(f"Cached archive is truncated at {entry.name}")
+            output.write(chunk)
+            remaining -= len(chunk)
+
+    def _deflate_entry(self, entry: ArchiveEntry, output) -> None:
+        name = entry.name.encode()
+        entry.header_offset = output.tell()
+        output.write(_local_header(entry, name))  # Sizes and CRC are patched below
+        entry.data_offset = output.tell()
+
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        crc32 = 0
+        size = 0
+        with open(os.path.join(self.root, entry.name), 'rb') as source:
+            for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                crc32 = zlib.crc32(chunk, crc32)
+                size += len(chunk)
+                output.write(compressor.compress(chunk))
+        output.write(compressor.flush())
+
+        # The file may have changed since the scan; record what was actually read
+        entry.crc32, entry.size = crc32, size
+        entry.compressed_size = output.tell() - entry.data_offset
+        if entry.size >= ZIP_LIMIT or entry.compressed_size >= ZIP_LIMIT:
+            raise ValueError(f"{entry.name} is too large for a ZIP without ZIP64")
+        end = output.tell()
+        output.seek(entry.header_offset)
+        output.write(_local_header(entry, name))
+        output.seek(end)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "rebuilds": self.rebuilds,
+            "entries_recompressed": self.recompressed,
+            "entries_reused": self.reused,
+            "size": os.path.getsize(self.path) if self.path and os.path.exists(self.path) else 0,
+        }
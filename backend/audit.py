@@ -0,0 +1,161 @@
+"""Background writer for operation audit records.
+
+Handlers call ``AuditLog.record`` to queue a ``PDFOperation``,
+``ImageOperation`` or ``ConversionOperation`` and return to the user
+straight away; a background task writes queued records with one
+``insert_many`` per collection whenever ``batch_size`` records are waiting
+or ``flush_interval`` seconds have passed. The queue is bounded: when the
+database cannot keep up, new records are dropped and counted rather than
+growing memory or slowing requests down.
+
+If given ``OperationCounters``, every record that was written is also
+counted, and the counters are persisted as part of each flush.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import defaultdict, deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+import metrics
+from analytics import OperationCounters
+
+logger = logging.getLogger(__name__)
+
+
+def _inserted(error: Exception, documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # An unordered insert_many that partly failed (pymongo's BulkWriteError)
+    # lists the indexes of the documents it rejected; other errors wrote none
+    details = getattr(error, "details", None)
+    if not isinstance(details, dict) or "writeErrors" not in details:
+        return []
+    rejected = {write_error["index"] for write_error in details["writeErrors"]}
+    return [document for index, document in enumerate(documents) if index not in rejected]
+
+
+class AuditLog:
+    def __init__(
+        self,
+        get_database: Callable[[], Any],
+        max_queue: int = 10000,
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        counters: Optional[OperationCounters] = None,
+        stop_timeout: float = 10.0,
+    ):
+        self.get_database = get_database
+        self.counters = counters
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.stop_timeout = stop_timeout
+
+        self._queue: Deque[Tuple[str, Dict[str, Any]]] = deque()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._counters = {"recorded": 0, "written": 0, "dropped": 0, "failed": 0, "flushes": 0}
+
+    @classmethod
+    def from_env(cls, get_database: Callable[[], Any], counters: Optional[OperationCounters] = None) -> "AuditLog":
+        """Build an audit log from the AUDIT_* environment variables"""
+        return cls(
+            get_database,
+            counters=counters,
+            max_queue=int(os.environ.get('AUDIT_MAX_QUEUE', 10000)),
+            batch_size=int(os.environ.get('AUDIT_BATCH_SIZE', 500)),
+            flush_interval=float(os.environ.get('AUDIT_FLUSH_INTERVAL', 1.0)),
+            stop_timeout=float(os.environ.get('AUDIT_STOP_TIMEOUT', 10.0)),
+        )
+
+    def record(self, collection: str, operation: BaseModel) -> bool:
+        """Queue a record for writing; returns False if it had to be dropped"""
+        if len(self._queue) >= self.max_queue:
+            self._counters["dropped"] += 1
+            return False
+        document = operation.dict()
+        self._queue.append((collection, document))
+        self._counters["recorded"] += 1
+        if len(self._queue) >= self.batch_size:
+            self._wakeup.set()
+        return True
+
+    def start(self) -> None:
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the background task and write everything still queued
+
+        The task is asked to finish its current flush and drain the queue;
+        it is only cancelled if that takes longer than ``stop_timeout``, and
+        a cancelled flush puts its unwritten records back in the queue.
+        """
+        self._stopping = True
+        self._wakeup.set()
+        if self._task is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(self._task), self.stop_timeout)
+            except asyncio.TimeoutError:
+                self._task.cancel()
+                try:
+                    await self._task
+                except asyncio.CancelledError:
+                    pass
+            self._task = None
+        while self._queue:
+            await self.flush()
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            while self._queue:
+                await self.flush()
+
+    async def flush(self) -> None:
+        """Write up to one batch of queued records"""
+        batch = defaultdict(list)
+        for _ in range(min(self.batch_size, len(self._queue))):
+            collection, document = self._queue.popleft()
+            batch[collection].append(document)
+
+        database = self.get_database()
+        unwritten = list(batch.items())
+        try:
+            while unwritten:
+                collection, documents = unwritten[0]
+                started = time.perf_counter()
+                try:
+                    await database[collection].insert_many(documents, ordered=False)
+                    metrics.DB_WRITE_SECONDS.observe(time.perf_counter() - started, collection=collection)
+                    written = documents
+                except Exception as e:
+                    written = _inserted(e, documents)
+                    self._counters["failed"] += len(documents) - len(written)
+                    logger.error(f"Error writing {len(documents)} audit records to {collection}: {str(e)}")
+                self._counters["written"] += len(written)
+                if self.counters is not None:
+                    for document in written:
+                        self.counters.count(collection, document)
+                unwritten.pop(0)
+        except asyncio.CancelledError:
+            # Back to the front of the queue for stop() to write; the insert
+            # that was interrupted may have landed, so this can duplicate
+            # records but never loses them
+            for collection, documents in reversed(unwritten):
+                self._queue.extendleft((collection, document) for document in reversed(documents))
+            raise
+        if self.counters is not None:
+            await self.counters.persist(database)
+        self._counters["flushes"] += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {**self._counters, "queue_depth": len(self._queue), "max_queue": self.max_queue}
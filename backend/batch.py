@@ -0,0 +1,178 @@
+"""Batch jobs over many input files, streamed back as one ZIP.
+
+A batch request carries either several uploaded files or a single ZIP of
+them. ``batch_sources`` turns either form into ``BatchSource`` items whose
+content is only read when the item is about to be processed, ``run_batch``
+processes them with a bounded number in flight and yields each result as
+soon as it finishes, and ``ZipStream`` turns those results into ZIP bytes
+entry by entry, so the response starts flowing with the first finished
+file and the archive is never held in memory as a whole.
+"""
+import asyncio
+import posixpath
+import zipfile
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+ZIP_CONTENT_TYPES = ("application/zip", "application/x-zip-compressed")
+
+
+class BatchError(ValueError):
+    """Raised when a batch as a whole is unacceptable (mapped to HTTP 400)."""
+
+
+class BatchSource(NamedTuple):
+    name: str
+    load: Callable[[], bytes]  # Blocking; call from a thread
+
+
+class _Buffer:
+    """Write-only sink that hands out what was written since the last take()"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def take(self) -> bytes:
+        data, self._chunks = b"".join(self._chunks), []
+        return data
+
+
+class ZipStream:
+    """Build a ZIP incrementally; each call returns the bytes it produced.
+
+    The sink cannot seek, so ZipFile writes data descriptors and every byte
+    is final as soon as it is returned. Entries are stored uncompressed by
+    default because encoded images do not deflate any further.
+    """
+
+    def __init__(self):
+        self._buffer = _Buffer()
+        self._archive = zipfile.ZipFile(self._buffer, "w", zipfile.ZIP_STORED)
+        self._names: Set[str] = set()
+
+    def add(self, name: str, data: bytes, compress: bool = False, reserved: bool = False) -> Tuple[str, bytes]:
+        """Add an entry under a unique version of name; returns (name used, ZIP bytes)
+
+        ``reserved`` writes a name claimed earlier through unique_name as is.
+        """
+        if not reserved:
+            name = self.unique_name(name)
+        self._archive.writestr(name, data, zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED)
+        return name, self._buffer.take()
+
+    def close(self) -> bytes:
+        """Finish the archive and return the central directory"""
+        self._archive.close()
+        return self._buffer.take()
+
+    def unique_name(self, name: str) -> str:
+        """Claim name, or name_2, name_3... if it is taken"""
+        stem, ext = posixpath.splitext(name)
+        candidate, counter = name, 1
+        while candidate in self._names:
+            counter += 1
+            candidate = f"{stem}_{counter}{ext}"
+        self._names.add(candidate)
+        return candidate
+
+
+def _safe_name(name: str) -> str:
+    # Archive members may carry absolute paths or '..'; keep the plain relative part
+    parts = [part for part in name.replace("\\", "/").split("/") if part not in ("", ".", "..")]
+    return "/".join(parts) or "unnamed"
+
+
+def _is_junk(name: str) -> bool:
+    return name.startswith("__MACOSX/") or posixpath.basename(name).startswith(".")
+
+
+def is_zip_upload(filename: Optional[str], content_type: Optional[str]) -> bool:
+    return content_type in ZIP_CONTENT_TYPES or (filename or "").lower().endswith(".zip")
+
+
+def _read_file(path: str) -> Callable[[], bytes]:
+    def load() -> bytes:
+        with open(path, "rb") as f:
+            return f.read()
+    return load
+
+
+def _read_member(archive: zipfile.ZipFile, info: zipfile.ZipInfo, max_bytes: int) -> Callable[[], bytes]:
+    def load() -> bytes:
+        # file_size comes from the archive itself, so the read is capped as well
+        with archive.open(info) as member:
+            data = member.read(max_bytes + 1)
+        if len(data) > max_bytes:
+            raise BatchError(f"File exceeds the limit of {max_bytes} bytes")
+        return data
+    return load
+
+
+def batch_sources(
+    uploads: Iterable[Tuple[str, str]],
+    archive: Optional[zipfile.ZipFile],
+    max_files: int,
+    max_entry_bytes: int,
+) -> List[BatchSource]:
+    """List the files of a batch, from spooled uploads or from an opened ZIP.
+
+    ``uploads`` are (filename, path) pairs of the spooled uploads; when
+    ``archive`` is given its members are used instead. Directories,
+    ``__MACOSX`` metadata and hidden files inside a ZIP are skipped.
+    """
+    if archive is not None:
+        sources = [
+            BatchSource(_safe_name(info.filename), _read_member(archive, info, max_entry_bytes))
+            for info in archive.infolist()
+            if not info.is_dir() and not _is_junk(info.filename)
+        ]
+    else:
+        sources = [BatchSource(_safe_name(posixpath.basename(filename or "")), _read_file(path))
+                   for filename, path in uploads]
+
+    if not sources:
+        raise BatchError("No files to process")
+    if len(sources) > max_files:
+        raise BatchError(f"At most {max_files} files can be processed in one batch")
+    return sources
+
+
+async def run_batch(
+    items: Iterable[Any],
+    process: Callable[[Any], Awaitable[Any]],
+    concurrency: int,
+) -> AsyncIterator[Tuple[Any, Any, Optional[Exception]]]:
+    """Run process(item) with at most ``concurrency`` in flight.
+
+    Yields (item, result, error) in completion order; a failing item yields
+    its exception instead of stopping the batch. Closing the iterator early
+    cancels whatever is still running.
+    """
+    pending: Dict[asyncio.Task, Any] = {}
+    remaining = iter(items)
+
+    def fill() -> None:
+        while len(pending) < concurrency:
+            item = next(remaining, None)
+            if item is None:
+                return
+            pending[asyncio.ensure_future(process(item))] = item
+
+    fill()
+    try:
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                item = pending.pop(task)
+                error = task.exception()
+                yield item, None if error is not None else task.result(), error
+            fill()
+    finally:
+        for task in pending:
+            task.cancel()
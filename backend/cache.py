@@ -0,0 +1,257 @@
+"""Content-addressed cache for transform results.
+
+Results are keyed by the SHA-256 of the inputs plus the operation and its
+parameters, so re-submitting the same file with the same options never
+recomputes it. There are two tiers:
+
+* memory: an LRU bounded by entry count and total bytes; results larger
+  than ``max_entry_bytes`` never enter it.
+* disk (optional, enabled by giving a directory): one file per result plus
+  a small JSON sidecar, evicted least-recently-used first once the tier
+  holds more than ``disk_max_bytes``. It survives restarts; files left
+  behind by an interrupted write are removed when the index is loaded.
+
+Each process keeps its own index of the disk tier, so when several server
+workers share a directory, ``disk_max_bytes`` is enforced per worker and
+the directory can grow to about workers x ``disk_max_bytes``: size
+``RESULT_CACHE_DISK_BYTES`` for that. A worker also picks up the entries
+of the others only on its next start.
+
+All methods are thread-safe and may block on disk I/O, so callers on the
+event loop should run them in the thread pool.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+# Temporary files untouched for this long belong to a write that died
+STALE_PARTIAL_SECONDS = 600
+
+
+@dataclass
+class CacheEntry:
+    media_type: str
+    size: int
+    data: Optional[bytes] = None  # Set for memory hits
+    path: Optional[str] = None  # Set for disk hits
+    headers: Dict[str, str] = field(default_factory=dict)  # Replayed on hits
+
+
+class ResultCache:
+    def __init__(
+        self,
+        max_entries: int = 256,
+        max_memory_bytes: int = 64 * 1024 * 1024,
+        max_entry_bytes: int = 8 * 1024 * 1024,
+        disk_dir: Optional[str] = None,
+        disk_max_bytes: int = 1024 * 1024 * 1024,
+    ):
+        self.max_entries = max_entries
+        self.max_memory_bytes = max_memory_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._memory_bytes = 0
+        self._disk: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._disk_bytes = 0
+        self._counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "memory_evictions": 0,
+            "disk_evictions": 0,
+        }
+
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._load_disk_index()
+
+    @classmethod
+    def from_env(cls) -> "ResultCache":
+        """Build a cache from the RESULT_CACHE_* environment variables"""
+        return cls(
+            max_entries=int(os.environ.get('RESULT_CACHE_ENTRIES', 256)),
+            max_memory_bytes=int(os.environ.get('RESULT_CACHE_MEMORY_BYTES', 64 * 1024 * 1024)),
+            max_entry_bytes=int(os.environ.get('RESULT_CACHE_ENTRY_BYTES', 8 * 1024 * 1024)),
+            disk_dir=os.environ.get('RESULT_CACHE_DIR') or None,
+            disk_max_bytes=int(os.environ.get('RESULT_CACHE_DISK_BYTES', 1024 * 1024 * 1024)),
+        )
+
+    @staticmethod
+    def key(operation: str, input_digests: List[str], params: Optional[Dict[str, Any]] = None) -> str:
+        """Build the cache key for an operation over inputs with the given SHA-256 digests"""
+        material = json.dumps([operation, input_digests, params or {}], sort_keys=True)
+        return hashlib.sha256(material.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self._counters["memory_hits"] += 1
+                return entry
+
+            entry = self._disk.get(key)
+            if entry is None:
+                self._counters["misses"] += 1
+                return None
+            self._disk.move_to_end(key)
+            self._counters["disk_hits"] += 1
+
+        try:
+            # Record the access so LRU order survives a restart
+            os.utime(entry.path)
+            if entry.size <= self.max_entry_bytes:
+                # Promote small results so the next hit is served from memory
+                with open(entry.path, 'rb') as f:
+                    data = f.read()
+                entry = CacheEntry(entry.media_type, len(data), data=data, headers=entry.headers)
+                self._store_memory(key, entry)
+        except FileNotFoundError:
+            # Removed behind our back (e.g. by another process sharing the directory)
+            with self._lock:
+                if self._disk.pop(key, None) is not None:
+                    self._disk_bytes -= entry.size
+            return None
+        return entry
+
+    def put(
+        self,
+        key: str,
+        media_type: str,
+        data: Optional[bytes] = None,
+        path: Optional[str] = None,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> None:
+        """Store a result given either as bytes or as a file that the caller keeps owning"""
+        size = len(data) if data is not None else os.path.getsize(path)
+        headers = headers or {}
+        with self._lock:
+            self._counters["stores"] += 1
+
+        if size <= self.max_entry_bytes:
+            if data is None:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            self._store_memory(key, CacheEntry(media_type, size, data=data, headers=headers))
+        if self.disk_dir:
+            self._store_disk(key, media_type, size, data, path, headers)
+
+    def _store_memory(self, key: str, entry: CacheEntry) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            previous = self._memory.pop(key, None)
+            if previous is not None:
+                self._memory_bytes -= previous.size
+            self._memory[key] = entry
+            self._memory_bytes += entry.size
+            while self._memory and (
+                len(self._memory) > self.max_entries or self._memory_bytes > self.max_memory_bytes
+            ):
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= evicted.size
+                self._counters["memory_evictions"] += 1
+
+    def _store_disk(
+        self,
+        key: str,
+        media_type: str,
+        size: int,
+        data: Optional[bytes],
+        path: Optional[str],
+        headers: Dict[str, str],
+    ) -> None:
+        if size > self.disk_max_bytes:
+            return
+        target = os.path.join(self.disk_dir, key)
+        # Unique names, so workers storing the same key do not write into
+        # each other's files. The metadata goes in place first: a crash in
+        # between leaves metadata without data, which the next load removes
+        fd, partial = tempfile.mkstemp(prefix=f"{key}.", suffix=".partial", dir=self.disk_dir)
+        with os.fdopen(fd, 'wb') as f:
+            if data is not None:
+                f.write(data)
+        if data is None:
+            shutil.copyfile(path, partial)
+        fd, partial_meta = tempfile.mkstemp(prefix=f"{key}.json.", suffix=".partial", dir=self.disk_dir)
+        with os.fdopen(fd, 'w') as f:
+            json.dump({"media_type": media_type, "size": size, "headers": headers}, f)
+        os.replace(partial_meta, f"{target}.json")
+        os.replace(partial, target)
+
+        with self._lock:
+            previous = self._disk.pop(key, None)
+            if previous is not None:
+                self._disk_bytes -= previous.size
+            self._disk[key] = CacheEntry(media_type, size, path=target, headers=headers)
+            self._disk_bytes += size
+            evicted = []
+            while self._disk and self._disk_bytes > self.disk_max_bytes:
+                evicted_key, entry = self._disk.popitem(last=False)
+                self._disk_bytes -= entry.size
+                self._counters["disk_evictions"] += 1
+                evicted.append(evicted_key)
+        for evicted_key in evicted:
+            self._remove_disk_files(evicted_key)
+
+    def _remove_disk_files(self, key: str) -> None:
+        for name in (key, f"{key}.json"):
+            try:
+                os.remove(os.path.join(self.disk_dir, name))
+            except FileNotFoundError:
+                pass
+
+    def _load_disk_index(self) -> None:
+        entries = []
+        names = set(os.listdir(self.disk_dir))
+        for name in names:
+            path = os.path.join(self.disk_dir, name)
+            try:
+                if name.endswith('.partial'):
+                    # Unless another worker is still writing it
+                    if os.path.getmtime(path) < time.time() - STALE_PARTIAL_SECONDS:
+                        os.remove(path)
+                elif not name.endswith('.json') and f"{name}.json" not in names:
+                    os.remove(path)  # Data whose metadata was never written
+            except OSError:
+                pass
+            if not name.endswith('.json'):
+                continue
+            key = name[:-len('.json')]
+            path = os.path.join(self.disk_dir, key)
+            try:
+                with open(f"{path}.json") as f:
+                    meta = json.load(f)
+                entries.append((os.path.getmtime(path), key, meta))
+            except (OSError, ValueError):
+                self._remove_disk_files(key)
+        for _, key, meta in sorted(entries):
+            self._disk[key] = CacheEntry(
+                meta["media_type"], meta["size"], path=os.path.join(self.disk_dir, key), headers=meta.get("headers", {})
+            )
+            self._disk_bytes += meta["size"]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self._counters["memory_hits"] + self._counters["disk_hits"]
+            lookups = hits + self._counters["misses"]
+            return {
+                **self._counters,
+                "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+            }
@@ -0,0 +1,198 @@
+"""Unit conversion registry, compiled once at import time.
+
+Every unit is described by how it maps onto its category's base unit
+(meter, kilogram, celsius). At import the registry composes those into a
+flat table holding one transform per (category, from_unit, to_unit) pair,
+so a conversion is a single dictionary lookup plus one multiply-add no
+matter how many units or countries are registered.
+
+The registry is also published as a JSON document (``REGISTRY_JSON``,
+pre-gzipped as ``REGISTRY_GZIP``) so clients can convert locally; its
+``version`` is a hash of the content and changes whenever a unit does.
+"""
+import gzip
+import hashlib
+import json
+from itertools import product
+from typing import Dict, FrozenSet, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+class ConversionError(ValueError):
+    """Raised for an unknown category, country or unit."""
+
+
+class Transform(NamedTuple):
+    """``(value + pre_offset) * scale + post_offset``
+
+    Keeping the offsets on either side of the scale reproduces the textbook
+    formulas exactly, e.g. (F - 32) * 5/9 rather than F * 5/9 - 17.77...,
+    which would turn 212 F into 99.99999999999999 C.
+    """
+    pre_offset: float
+    scale: float
+    post_offset: float
+
+    def apply(self, value):
+        # Works on floats and NumPy arrays alike
+        return (value + self.pre_offset) * self.scale + self.post_offset
+
+
+def per_base(factor: float) -> Tuple[float, float]:
+    """A unit with ``factor`` of it in one base unit (e.g. 3.28084 feet per meter)"""
+    return 0.0, factor
+
+
+# Each unit as (offset, units per base unit): base = (value + offset) / per_base
+UNITS: Dict[str, Dict[str, Tuple[float, float]]] = {
+    "length": {
+        "meter": per_base(1),
+        "feet": per_base(3.28084),
+        "inch": per_base(39.3701),
+        "yard": per_base(1.09361),
+        "mile": per_base(0.000621371),
+        "centimeter": per_base(100),
+        "kilometer": per_base(0.001),
+    },
+    "weight": {
+        "kilogram": per_base(1),
+        "pound": per_base(2.20462),
+        "ounce": per_base(35.274),
+        "ton": per_base(0.001),
+        "gram": per_base(1000),
+        "tonne": per_base(0.001),
+    },
+    "temperature": {
+        "celsius": (0.0, 1.0),
+        "fahrenheit": (-32.0, 9 / 5),
+        "kelvin": (-273.15, 1.0),
+    },
+}
+
+# Units offered per country; categories not listed here are the same everywhere
+COUNTRY_UNITS: Dict[str, Dict[str, Tuple[str, ...]]] = {
+    "length": {
+        "US": ("meter", "feet", "inch", "yard", "mile"),
+        "IN": ("meter", "feet", "inch", "centimeter", "kilometer"),
+        "CA": ("meter", "feet", "inch", "kilometer", "centimeter"),
+        "AU": ("meter", "feet", "inch", "mile", "kilometer"),
+    },
+    "weight": {
+        "US": ("kilogram", "pound", "ounce", "ton"),
+        "IN": ("kilogram", "pound", "gram", "tonne"),
+        "CA": ("kilogram", "pound", "gram", "tonne"),
+        "AU": ("kilogram", "pound", "gram", "tonne"),
+    },
+}
+
+
+def _compose(source: Tuple[float, float], target: Tuple[float, float]) -> Transform:
+    source_offset, source_per_base = source
+    target_offset, target_per_base = target
+    if source == target:
+        return Transform(0.0, 1.0, 0.0)
+    return Transform(source_offset, target_per_base / source_per_base, -target_offset)
+
+
+def _compile():
+    transforms = {}
+    for category, units in UNITS.items():
+        for (from_unit, source), (to_unit, target) in product(units.items(), repeat=2):
+            transforms[(category, from_unit, to_unit)] = _compose(source, target)
+
+    allowed = {
+        (category, country): frozenset(unit_names)
+        for category, countries in COUNTRY_UNITS.items()
+        for country, unit_names in countries.items()
+    }
+    return transforms, allowed
+
+
+# (category, from_unit, to_unit) -> Transform, and (category, country) -> units
+TRANSFORMS, ALLOWED_UNITS = _compile()
+
+REGISTRY_FORMULA = "to_value = (value + from[0]) * (to[1] / from[1]) - to[0], value itself if from == to"
+
+
+def _registry_document() -> Dict:
+    categories = {}
+    for category, units in UNITS.items():
+        spec = {"units": {name: [offset, units_per_base] for name, (offset, units_per_base) in units.items()}}
+        if category in COUNTRY_UNITS:
+            spec["countries"] = {country: list(names) for country, names in COUNTRY_UNITS[category].items()}
+        categories[category] = spec
+    content = json.dumps({"formula": REGISTRY_FORMULA, "categories": categories}, sort_keys=True)
+    version = hashlib.sha256(content.encode()).hexdigest()[:16]
+    return {"version": version, "formula": REGISTRY_FORMULA, "categories": categories}
+
+
+# The published registry: units as [offset, units per base unit], and the
+# units offered per country for the categories that restrict them
+REGISTRY = _registry_document()
+REGISTRY_VERSION = REGISTRY["version"]
+REGISTRY_JSON = json.dumps(REGISTRY, separators=(",", ":")).encode()
+REGISTRY_GZIP = gzip.compress(REGISTRY_JSON, compresslevel=9, mtime=0)
+
+
+def resolve(category: str, from_unit: str, to_unit: str, country: str) -> Transform:
+    """Look up the transform for a conversion, validating it for the country"""
+    if category not in UNITS:
+        raise ConversionError("Invalid category or country")
+
+    allowed: Optional[FrozenSet[str]] = None
+    if category in COUNTRY_UNITS:
+        allowed = ALLOWED_UNITS.get((category, country))
+        if allowed is None:
+            raise ConversionError("Invalid category or country")
+
+    transform = TRANSFORMS.get((category, from_unit, to_unit))
+    if transform is None or (allowed is not None and (from_unit not in allowed or to_unit not in allowed)):
+        raise ConversionError("Invalid units for this category/country")
+    return transform
+
+
+def convert(category: str, from_unit: str, to_unit: str, value: float, country: str = "US") -> float:
+    """Convert a single value"""
+    return resolve(category, from_unit, to_unit, country).apply(value)
+
+
+def convert_values(category: str, from_unit: str, to_unit: str, values, country: str = "US") -> np.ndarray:
+    """Convert a sequence of values in one vectorized pass"""
+    transform = resolve(category, from_unit, to_unit, country)
+    try:
+        array = np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        raise ConversionError("Values must be numbers")
+    if array.ndim != 1:
+        raise ConversionError("Values must be a flat list of numbers")
+    return transform.apply(array)
+
+
+TABLE_COLUMNS = ["category", "from_unit", "to_unit", "country", "value"]
+
+
+def convert_table(frame: pd.DataFrame) -> Tuple[np.ndarray, List[Tuple[str, str, str, str, int]]]:
+    """Convert a table of conversions, one row per value.
+
+    Rows are grouped by (category, from_unit, to_unit, country) and each
+    group is converted with one array operation. Returns the converted
+    values in row order and the groups with their row counts.
+    """
+    missing = [column for column in TABLE_COLUMNS if column not in frame.columns]
+    if missing:
+        raise ConversionError(f"Missing columns: {', '.join(missing)}")
+    try:
+        values = pd.to_numeric(frame["value"]).to_numpy(dtype=np.float64)
+    except (TypeError, ValueError):
+        raise ConversionError("Values must be numbers")
+
+    converted = np.empty_like(values)
+    groups = []
+    keys = frame[TABLE_COLUMNS[:4]].astype(str)
+    for key, index in keys.groupby(TABLE_COLUMNS[:4], sort=False).indices.items():
+        category, from_unit, to_unit, country = key
+        converted[index] = resolve(category, from_unit, to_unit, country).apply(values[index])
+        groups.append((category, from_unit, to_unit, country, len(index)))
+    return converted, groups
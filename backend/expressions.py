@@ -0,0 +1,221 @@
+"""Safe arithmetic expressions for the scientific calculator.
+
+An expression such as ``sin(pi/4) + log(100) * x^2`` is parsed with the
+``ast`` module and every node is checked against a whitelist: numbers,
+the constants and functions in ``CONSTANTS`` and ``FUNCTIONS``, the
+variable ``x``, arithmetic operators and plain function calls. Anything
+else (attributes, subscripts, keywords, strings, lambdas, ...) is
+rejected before the tree is compiled, so evaluating the code object with
+no builtins cannot reach anything beyond those names. ``^`` means power,
+as on a calculator, not XOR.
+
+Compiled expressions are kept in an LRU keyed by the expression text, so
+re-evaluating or re-plotting an expression skips parsing and checking.
+The functions are NumPy ufuncs, which makes one evaluation over an
+array of x values as cheap as one pass of vectorized arithmetic: plotting
+100k points is a single call, not 100k evaluations.
+
+As in the calculator pages, ``log`` is base 10 and trigonometric functions
+take radians; ``ln`` is the natural logarithm.
+"""
+import ast
+import functools
+import io
+import math
+import tokenize
+from typing import Dict, FrozenSet, Optional
+
+import numpy as np
+
+MAX_EXPRESSION_LENGTH = 500
+MAX_NODES = 200
+MAX_POINTS = 1_000_000
+COMPILE_CACHE_SIZE = 1024
+
+VARIABLE = "x"
+
+CONSTANTS = {
+    "pi": np.float64(math.pi),
+    "e": np.float64(math.e),
+    "tau": np.float64(math.tau),
+}
+
+# Numbers in the expression are wrapped in a call to this, because
+# compile() only takes plain floats and those raise on 1/0 or overflow
+_NUMBER = "_number"
+
+FUNCTIONS = {
+    "sin": np.sin,
+    "cos": np.cos,
+    "tan": np.tan,
+    "asin": np.arcsin,
+    "acos": np.arccos,
+    "atan": np.arctan,
+    "sinh": np.sinh,
+    "cosh": np.cosh,
+    "tanh": np.tanh,
+    "exp": np.exp,
+    "sqrt": np.sqrt,
+    "cbrt": np.cbrt,
+    "abs": np.abs,
+    "log": np.log10,
+    "log10": np.log10,
+    "log2": np.log2,
+    "ln": np.log,
+    "floor": np.floor,
+    "ceil": np.ceil,
+    "round": np.round,
+    "min": np.minimum,
+    "max": np.maximum,
+}
+
+# Number of arguments each function takes
+ARITY = {name: 2 if name in ("min", "max") else 1 for name in FUNCTIONS}
+
+OPERATORS = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.Mod, ast.FloorDiv, ast.UAdd, ast.USub)
+
+
+class ExpressionError(ValueError):
+    """Raised for expressions that cannot be parsed or are not allowed."""
+
+
+def _power_operators(text: str) -> str:
+    # ``^`` becomes ``**`` at the token level, before parsing, so that it
+    # gets the precedence and right associativity of a power: -2^2 is -4
+    # and 2^3^2 is 512, not XOR's (-2)^2 and (2^3)^2
+    tokens = tokenize.generate_tokens(io.StringIO(text).readline)
+    return tokenize.untokenize(
+        token._replace(string="**") if token.type == tokenize.OP and token.string == "^" else token
+        for token in tokens
+    )
+
+
+class _Checker(ast.NodeTransformer):
+    """Rejects every node outside the whitelist"""
+
+    def __init__(self):
+        self.nodes = 0
+        self.names = set()
+
+    def visit(self, node):
+        self.nodes += 1
+        if self.nodes > MAX_NODES:
+            raise ExpressionError(f"Expression is too complex (more than {MAX_NODES} parts)")
+        return super().visit(node)
+
+    def visit_Expression(self, node):
+        return self.generic_visit(node)
+
+    def visit_BinOp(self, node):
+        if not isinstance(node.op, OPERATORS):
+            raise ExpressionError(f"Operator {type(node.op).__name__} is not allowed")
+        return self.generic_visit(node)
+
+    def visit_UnaryOp(self, node):
+        if not isinstance(node.op, OPERATORS):
+            raise ExpressionError(f"Operator {type(node.op).__name__} is not allowed")
+        return self.generic_visit(node)
+
+    def visit_Constant(self, node):
+        if isinstance(node.value, bool) or not isinstance(node.value, (int, float)):
+            raise ExpressionError(f"Only numbers are allowed, not {node.value!r}")
+        # NumPy floats: huge powers overflow to inf instead of building huge
+        # integers, and 1/0 is inf rather than an exception
+        number = ast.Call(ast.Name(_NUMBER, ast.Load()), [ast.Constant(float(node.value))], [])
+        return ast.copy_location(number, node)
+
+    def visit_Name(self, node):
+        if node.id != VARIABLE and node.id not in CONSTANTS:
+            raise ExpressionError(f"Unknown name '{node.id}'")
+        self.names.add(node.id)
+        return node
+
+    def visit_Call(self, node):
+        if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS:
+            name = node.func.id if isinstance(node.func, ast.Name) else ast.unparse(node.func)
+            raise ExpressionError(f"Unknown function '{name}'")
+        if node.keywords or len(node.args) != ARITY[node.func.id]:
+            raise ExpressionError(f"{node.func.id}() takes {ARITY[node.func.id]} argument(s)")
+        self.nodes += 1  # The function name, not visited below
+        node.args = [self.visit(arg) for arg in node.args]
+        return node
+
+    def generic_visit(self, node):
+        if not isinstance(node, (ast.Expression, ast.BinOp, ast.UnaryOp, ast.operator, ast.unaryop)):
+            raise ExpressionError(f"{type(node).__name__} is not allowed in an expression")
+        return super().generic_visit(node)
+
+
+class CompiledExpression:
+    def __init__(self, text: str, code, names: FrozenSet[str]):
+        self.text = text
+        self.code = code
+        self.names = names
+
+    @property
+    def uses_variable(self) -> bool:
+        return VARIABLE in self.names
+
+    def evaluate(self, x=None):
+        """The value for a scalar x, or an array of values for an array of x"""
+        if self.uses_variable and x is None:
+            raise ExpressionError(f"Expression uses '{VARIABLE}' but no value was given for it")
+        if x is not None:
+            x = np.asarray(x, dtype=np.float64)
+            if x.size > MAX_POINTS:
+                raise ExpressionError(f"At most {MAX_POINTS} values of {VARIABLE}, got {x.size}")
+        namespace = {"__builtins__": {}, _NUMBER: np.float64, **CONSTANTS, **FUNCTIONS, VARIABLE: x}
+        # Out-of-domain points (log(-1), 1/0) become nan / inf, as in JavaScript
+        with np.errstate(all="ignore"):
+            result = eval(self.code, namespace)
+            if x is not None and x.ndim:
+                return np.broadcast_to(np.asarray(result, dtype=np.float64), x.shape)
+            return float(result)
+
+
+@functools.lru_cache(maxsize=COMPILE_CACHE_SIZE)
+def compile_expression(text: str) -> CompiledExpression:
+    """Parse, check and compile an expression; cached by its text"""
+    if len(text) > MAX_EXPRESSION_LENGTH:
+        raise ExpressionError(f"Expression is longer than {MAX_EXPRESSION_LENGTH} characters")
+    if not text.strip():
+        raise ExpressionError("Expression is empty")
+    try:
+        tree = ast.parse(_power_operators(text.strip()), mode="eval")
+    except tokenize.TokenError as e:
+        raise ExpressionError(f"Invalid expression: {e.args[0]}")
+    except (SyntaxError, RecursionError, MemoryError) as e:
+        raise ExpressionError(f"Invalid expression: {getattr(e, 'msg', None) or type(e).__name__}")
+    checker = _Checker()
+    tree = ast.fix_missing_locations(checker.visit(tree))
+    return CompiledExpression(text, compile(tree, "<expression>", "eval"), frozenset(checker.names))
+
+
+def evaluate(text: str, x: Optional[float] = None) -> float:
+    return compile_expression(text).evaluate(x)
+
+
+def plot(text: str, start: float, stop: float, points: int) -> Dict:
+    """``points`` evenly spaced x values from start to stop and the expression's value at each"""
+    if not 2 <= points <= MAX_POINTS:
+        raise ExpressionError(f"Points must be between 2 and {MAX_POINTS}")
+    if not (math.isfinite(start) and math.isfinite(stop)) or start >= stop:
+        raise ExpressionError("Start and stop must be finite, with start before stop")
+    compiled = compile_expression(text)
+    x = np.linspace(start, stop, points)
+    return {"expression": text, "x": x.tolist(), "y": finite_or_none(compiled.evaluate(x))}
+
+
+def finite_or_none(values: np.ndarray) -> list:
+    """Array values as a JSON-ready list, with nan and inf as None"""
+    values = np.asarray(values, dtype=np.float64)
+    listed = values.tolist()
+    if np.isfinite(values).all():
+        return listed
+    return [value if math.isfinite(value) else None for value in listed]
+
+
+def stats() -> Dict[str, int]:
+    """Hit/miss counters and occupancy of the compiled-expression cache"""
+    info = compile_expression.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "entries": info.currsize, "max_entries": info.maxsize}
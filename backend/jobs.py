@@ -0,0 +1,321 @@
+"""Asynchronous jobs for long-running PDF and image work.
+
+Submitting a job returns its id straight away; the work runs in the
+background on the worker pool and the client polls the job or follows its
+events until it has finished, then downloads the result.
+
+Every job gets its own directory under ``directory`` holding its inputs,
+its output and ``progress.json``, which the worker process rewrites as it
+goes (see ``processing._Progress``). Inputs are deleted when the job ends.
+Results are kept for ``ttl`` seconds after the job finishes, and the
+results of the oldest finished jobs are expired early whenever all results
+together exceed ``max_bytes``.
+
+Job state lives in memory, so it is per server process and does not
+survive a restart; finished jobs are still written to the operation
+collections through the audit log like any other request.
+"""
+import asyncio
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+EXPIRED = "expired"
+FINISHED = (SUCCEEDED, FAILED, CANCELLED, EXPIRED)
+
+
+class JobLimitReached(Exception):
+    """Raised when too many jobs are queued or running (mapped to HTTP 429)."""
+
+
+class Job:
+    def __init__(self, job_id: str, kind: str, directory: str):
+        self.id = job_id
+        self.kind = kind
+        self.directory = directory
+        self.status = QUEUED
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.error: Optional[str] = None
+        self.progress: Dict[str, Any] = {"stage": QUEUED, "pages_processed": 0, "pages_total": None}
+        self.result_path: Optional[str] = None
+        self.output_path: Optional[str] = None  # Where the job writes while running
+        self.media_type: Optional[str] = None
+        self.filename: Optional[str] = None
+        self.size = 0
+        self.details: Dict[str, Any] = {}  # Whatever the work reports about its result
+        self.task: Optional[asyncio.Task] = None
+
+    def path(self, name: str) -> str:
+        """A file inside the job's directory"""
+        return os.path.join(self.directory, name)
+
+    @property
+    def progress_path(self) -> str:
+        return self.path("progress.json")
+
+    def refresh(self) -> None:
+        """Pick up the progress the worker process has published"""
+        if self.status != RUNNING:
+            return
+        try:
+            with open(self.progress_path) as f:
+                self.progress.update(json.load(f))
+        except (FileNotFoundError, ValueError):
+            pass
+
+    def bytes_written(self) -> int:
+        if self.status == RUNNING and self.output_path:
+            try:
+                return os.path.getsize(self.output_path)
+            except FileNotFoundError:
+                return 0
+        return self.size
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "progress": {**self.progress, "bytes_written": self.bytes_written()},
+            "error": self.error,
+            "filename": self.filename,
+            "media_type": self.media_type,
+            "size": self.size if self.status == SUCCEEDED else None,
+            "details": self.details,
+        }
+
+
+# What a job's work returns: (result path, media type, download filename)
+JobWork = Callable[[Job], Awaitable[Tuple[str, str, str]]]
+
+
+class JobStore:
+    def __init__(
+        self,
+        directory: str,
+        ttl: float = 3600.0,
+        max_bytes: int = 2 * 1024 * 1024 * 1024,
+        max_active: int = 100,
+        max_running: int = 2,
+        job_timeout: float = 3600.0,
+        sweep_interval: float = 60.0,
+    ):
+        self.directory = directory
+        self.job_timeout = job_timeout
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_active = max_active
+        self.sweep_interval = sweep_interval
+
+        self._jobs: Dict[str, Job] = {}
+        self._running = asyncio.Semaphore(max_running)
+        self._max_running = max_running
+        self._sweeper: Optional[asyncio.Task] = None
+        self._counters = {"submitted": 0, "succeeded": 0, "failed": 0, "cancelled": 0, "expired": 0}
+
+    @classmethod
+    def from_env(cls, default_dir: str, max_running: int) -> "JobStore":
+        """Build a job store from the JOB_* environment variables"""
+        return cls(
+            os.environ.get('JOB_RESULT_DIR') or default_dir,
+            ttl=float(os.environ.get('JOB_RESULT_TTL', 3600)),
+            max_bytes=int(os.environ.get('JOB_RESULT_MAX_BYTES', 2 * 1024 * 1024 * 1024)),
+            max_active=int(os.environ.get('JOB_MAX_ACTIVE', 100)),
+            max_running=int(os.environ.get('JOB_MAX_RUNNING') or max_running),
+            job_timeout=float(os.environ.get('JOB_TIMEOUT', 3600)),
+        )
+
+    def create(self, kind: str) -> Job:
+        """Register a new queued job and create its directory"""
+        active = sum(1 for job in self._jobs.values() if job.status in (QUEUED, RUNNING))
+        if active >= self.max_active:
+            raise JobLimitReached(f"Too many jobs in progress (limit {self.max_active})")
+        job_id = uuid.uuid4().hex
+        job = Job(job_id, kind, os.path.join(self.directory, job_id))
+        os.makedirs(job.directory)
+        self._jobs[job_id] = job
+        return job
+
+    def discard(self, job: Job) -> None:
+        """Forget a job that was created but never started"""
+        self._jobs.pop(job.id, None)
+        shutil.rmtree(job.directory, ignore_errors=True)
+
+    def start(self, job: Job, work: JobWork, on_success: Optional[Callable[[Job], None]] = None) -> None:
+        """Run ``work`` in the background once a running slot is free"""
+        self._counters["submitted"] += 1
+        job.task = asyncio.create_task(self._execute(job, work, on_success))
+
+    def get(self, job_id: str) -> Optional[Job]:
+        job = self._jobs.get(job_id)
+        if job is not None:
+            job.refresh()
+        return job
+
+    async def cancel(self, job: Job) -> None:
+        """Cancel a job if it has not finished and delete its files.
+
+        A job already handed to a worker process keeps that process busy
+        until it ends, but its result is thrown away.
+        """
+        if job.task is not None and not job.task.done():
+            job.task.cancel()
+            try:
+                await job.task
+            except asyncio.CancelledError:
+                pass
+        if job.status not in FINISHED:
+            await self._finish(job, CANCELLED)
+        self._jobs.pop(job.id, None)
+        shutil.rmtree(job.directory, ignore_errors=True)
+
+    async def watch(self, job: Job, interval: float = 0.5) -> AsyncIterator[Dict[str, Any]]:
+        """Yield the job's state whenever it changes, until it has finished"""
+        last = None
+        while True:
+            job.refresh()
+            state = job.to_dict()
+            if state != last:
+                yield state
+                last = state
+            if job.status in FINISHED:
+                return
+            await asyncio.sleep(interval)
+
+    async def _execute(self, job: Job, work: JobWork, on_success: Optional[Callable[[Job], None]]) -> None:
+        async with self._running:
+            job.status = RUNNING
+            job.started_at = time.time()
+            job.progress["stage"] = RUNNING
+            try:
+                result_path, media_type, filename = await work(job)
+                job.refresh()
+                job.size = await run_in_threadpool(os.path.getsize, result_path)
+                job.result_path, job.media_type, job.filename = result_path, media_type, filename
+                if on_success is not None:
+                    on_success(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Not served, and removed with the inputs
+                job.result_path = None
+                job.error = str(e) or type(e).__name__
+                logger.error(f"Job {job.id} failed: {job.error}")
+                await self._finish(job, FAILED)
+                return
+        await self._finish(job, SUCCEEDED)
+        self._enforce_budget()
+
+    async def _finish(self, job: Job, status: str) -> None:
+        job.status = status
+        job.finished_at = time.time()
+        job.progress["stage"] = status
+        self._counters[status] += 1
+        await run_in_threadpool(self._remove_inputs, job)
+
+    @staticmethod
+    def _remove_inputs(job: Job) -> None:
+        # Inputs and partial outputs are no longer needed; only the result stays
+        for name in os.listdir(job.directory) if os.path.isdir(job.directory) else ():
+            path = job.path(name)
+            if path != job.result_path:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _expire(self, job: Job) -> None:
+        if job.result_path is not None:
+            try:
+                os.remove(job.result_path)
+            except FileNotFoundError:
+                pass
+        job.result_path = None
+        job.status = EXPIRED
+        job.progress["stage"] = EXPIRED
+        self._counters[EXPIRED] += 1
+
+    def _results(self) -> List[Job]:
+        """Jobs holding a result on disk, oldest first"""
+        return sorted(
+            (job for job in self._jobs.values() if job.status == SUCCEEDED),
+            key=lambda job: job.finished_at,
+        )
+
+    def _enforce_budget(self) -> None:
+        results = self._results()
+        total = sum(job.size for job in results)
+        for job in results:
+            if total <= self.max_bytes:
+                break
+            total -= job.size
+            self._expire(job)
+
+    def sweep(self) -> None:
+        """Expire results past their TTL and forget jobs that ended over a TTL ago"""
+        now = time.time()
+        for job in list(self._jobs.values()):
+            if job.finished_at is None or now - job.finished_at < self.ttl:
+                continue
+            if job.status == SUCCEEDED:
+                self._expire(job)
+            # Expired jobs stay visible for one more TTL so pollers learn what happened
+            if now - job.finished_at >= 2 * self.ttl:
+                self._jobs.pop(job.id, None)
+                shutil.rmtree(job.directory, ignore_errors=True)
+
+    def start_sweeper(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep_forever())
+
+    async def stop(self) -> None:
+        """Stop the sweeper and cancel unfinished jobs"""
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+        for job in list(self._jobs.values()):
+            if job.status not in FINISHED:
+                await self.cancel(job)
+
+    async def _sweep_forever(self) -> None:
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"Error sweeping job results: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        by_status: Dict[str, int] = {}
+        for job in self._jobs.values():
+            by_status[job.status] = by_status.get(job.status, 0) + 1
+        return {
+            **self._counters,
+            "jobs": by_status,
+            "result_bytes": sum(job.size for job in self._results()),
+            "max_bytes": self.max_bytes,
+            "max_running": self._max_running,
+        }
@@ -0,0 +1,376 @@
+"""Request and stage metrics, exposed in the Prometheus text format.
+
+``MetricsMiddleware`` times every request and counts the bytes read from
+the request body and sent in the response, labelled by route template
+(``/api/jobs/{job_id}``, never the concrete path) so the number of series
+stays bounded. Handlers and the helpers they call mark their stages with
+``stage("upload")``, ``stage("worker")``, ``stage("db_write")`` and so on;
+each stage is observed under the route of the request it belongs to and
+also listed in the response's ``Server-Timing`` header.
+
+Transforms run in worker processes, whose registries are never scraped.
+There ``stage()`` and ``count()`` go to a per-job collector instead:
+``measured`` runs the job and returns the collected stage timings and
+page/pixel counts along with the result, and the pool hands them to
+``record_worker`` in the server process.
+
+With METRICS_PROFILE_INTERVAL set (in seconds), ``SamplingProfiler``
+samples the stacks of every server thread at that interval and serves
+them as folded stacks, the input format of flamegraph.pl and speedscope.
+"""
+import bisect
+import contextvars
+import os
+import sys
+import threading
+import time
+from collections import Counter as _StackCounter
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+PREFIX = "mobile_tools_"
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+SIZE_BUCKETS = tuple(1024 * 4 ** exponent for exponent in range(11))  # 1 KiB .. 1 GiB
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = PREFIX + name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return super().render() + [
+            f"{self.name}{_labels(self.label_names, key)} {_number(value)}" for key, value in values
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DURATION_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: count per bucket (the last one is +Inf), sum
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[index] += 1
+            total[0] += value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted((key, (list(counts), total[0])) for key, (counts, total) in self._values.items())
+        lines = super().render()
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = _labels(self.label_names, key, f'le="{_number(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, help, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DURATION_BUCKETS) -> Histogram:
+        metric = Histogram(name, help, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self, gauges: Optional[Dict[str, Dict[str, Any]]] = None) -> str:
+        """The exposition text; ``gauges`` adds the numeric fields of component stats() dicts"""
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for component, stats in (gauges or {}).items():
+            for field, value in sorted(stats.items()):
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                name = f"{PREFIX}{component}_{field}"
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.counter("http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_duration_seconds", "Time from request start to the last response byte", ("method", "route")
+)
+REQUEST_BYTES = REGISTRY.histogram(
+    "http_request_size_bytes", "Request body bytes received", ("route",), SIZE_BUCKETS
+)
+RESPONSE_BYTES = REGISTRY.histogram(
+    "http_response_size_bytes", "Response body bytes sent", ("route",), SIZE_BUCKETS
+)
+STAGE_SECONDS = REGISTRY.histogram(
+    "stage_duration_seconds", "Time spent in each stage of handling a request", ("route", "stage")
+)
+WORKER_SECONDS = REGISTRY.histogram(
+    "worker_job_duration_seconds", "Time a transform ran inside its worker process", ("operation",)
+)
+PAGES = REGISTRY.counter("pages_processed_total", "PDF pages read or written by transforms", ("operation",))
+PIXELS = REGISTRY.counter("pixels_processed_total", "Image pixels decoded by transforms", ("operation",))
+DB_WRITE_SECONDS = REGISTRY.histogram(
+    "db_write_duration_seconds", "Time of each batched database write", ("collection",)
+)
+
+_UNITS = {"pages": PAGES, "pixels": PIXELS}
+
+
+class _RequestTiming:
+    """Stages seen while handling one request, for labels and Server-Timing"""
+
+    def __init__(self, scope: Dict[str, Any]):
+        self.scope = scope
+        self.stages: List[Tuple[str, float]] = []
+
+    @property
+    def route(self) -> str:
+        route = self.scope.get("route")
+        return getattr(route, "path", None) or "unmatched"
+
+
+_request: contextvars.ContextVar[Optional[_RequestTiming]] = contextvars.ContextVar("metrics_request", default=None)
+
+# Set only inside worker processes, for the job currently running
+_collector: Optional[Dict[str, Dict[str, float]]] = None
+
+
+def current_route() -> str:
+    request = _request.get()
+    return request.route if request is not None else "background"
+
+
+def record_stage(name: str, seconds: float) -> None:
+    if _collector is not None:
+        stages = _collector["stages"]
+        stages[name] = stages.get(name, 0.0) + seconds
+        return
+    request = _request.get()
+    STAGE_SECONDS.observe(seconds, route=current_route(), stage=name)
+    if request is not None:
+        request.stages.append((name, seconds))
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time the enclosed block as one stage of the current request or worker job"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - started)
+
+
+def count(unit: str, amount: int) -> None:
+    """Count pages or pixels processed by the current request or worker job"""
+    if _collector is not None:
+        counts = _collector["counts"]
+        counts[unit] = counts.get(unit, 0) + amount
+        return
+    _UNITS[unit].inc(amount, operation=current_route())
+
+
+def measured(fn, *args) -> Tuple[Any, Dict[str, Any]]:
+    """Run fn(*args) in a worker process; returns its result and what it measured"""
+    global _collector
+    _collector = collected = {"stages": {}, "counts": {}}
+    started = time.perf_counter()
+    try:
+        result = fn(*args)
+    finally:
+        _collector = None
+    collected["seconds"] = time.perf_counter() - started
+    return result, collected
+
+
+def record_worker(operation: str, collected: Dict[str, Any]) -> None:
+    """Fold what a worker job measured into the server's metrics"""
+    WORKER_SECONDS.observe(collected["seconds"], operation=operation)
+    for name, seconds in collected["stages"].items():
+        record_stage(name, seconds)
+    for unit, amount in collected["counts"].items():
+        _UNITS[unit].inc(amount, operation=operation)
+
+
+def _server_timing(stages: List[Tuple[str, float]]) -> bytes:
+    totals: Dict[str, float] = {}
+    for name, seconds in stages:
+        totals[name] = totals.get(name, 0.0) + seconds
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in totals.items()).encode("latin-1")
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording duration, status and body sizes of each HTTP request"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request = _RequestTiming(scope)
+        token = _request.set(request)
+        started = time.perf_counter()
+        received = sent = 0
+        status = 500
+
+        async def counting_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            nonlocal sent, status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if request.stages:
+                    message = {**message, "headers": [
+                        *message.get("headers", []), (b"server-timing", _server_timing(request.stages))
+                    ]}
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            _request.reset(token)
+            route = request.route
+            REQUESTS.inc(method=scope["method"], route=route, status=str(status))
+            REQUEST_SECONDS.observe(time.perf_counter() - started, method=scope["method"], route=route)
+            REQUEST_BYTES.observe(received, route=route)
+            RESPONSE_BYTES.observe(sent, route=route)
+
+
+class SamplingProfiler:
+    """Samples every thread's Python stack at a fixed interval from a daemon thread.
+
+    Stacks are aggregated as folded lines ("thread;outer;...;inner count").
+    At most ``max_stacks`` distinct stacks are kept; samples of further new
+    stacks are counted as dropped.
+    """
+
+    def __init__(self, interval: float, max_stacks: int = 20000):
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self._stacks: _StackCounter = _StackCounter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.samples = 0
+        self.dropped = 0
+
+    @classmethod
+    def from_env(cls) -> Optional["SamplingProfiler"]:
+        """A profiler if METRICS_PROFILE_INTERVAL is set, otherwise None"""
+        interval = os.environ.get('METRICS_PROFILE_INTERVAL')
+        if not interval or float(interval) <= 0:
+            return None
+        return cls(float(interval), max_stacks=int(os.environ.get('METRICS_PROFILE_MAX_STACKS', 20000)))
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+                    frame = frame.f_back
+                frames.append(names.get(ident, str(ident)))
+                self._add(";".join(reversed(frames)))
+
+    def _add(self, stack: str) -> None:
+        with self._lock:
+            self.samples += 1
+            if stack in self._stacks or len(self._stacks) < self.max_stacks:
+                self._stacks[stack] += 1
+            else:
+                self.dropped += 1
+
+    def folded(self, reset: bool = False) -> str:
+        """The samples so far as folded stacks, most frequent first"""
+        with self._lock:
+            lines = [f"{stack} {samples}" for stack, samples in self._stacks.most_common()]
+            if reset:
+                self._stacks.clear()
+                self.samples = self.dropped = 0
+        return "\n".join(lines) + "\n"
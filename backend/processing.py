@@ -0,0 +1,843 @@
+"""CPU-bound PDF and image transforms.
+
+Everything in this module runs inside the worker processes managed by
+``workers.WorkerPool``, so functions must be top-level, take and return
+picklable values, and never touch the event loop or the database.
+
+Each transform marks its decode, transform and encode stages and counts
+the pages or pixels it handled through ``metrics``; the worker pool sends
+those measurements back with the result.
+"""
+import hashlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import time
+import zipfile
+import zlib
+from contextlib import ExitStack
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple, Union
+
+from PyPDF2 import PdfWriter, PdfReader
+from PyPDF2.errors import PdfReadError
+from PyPDF2.generic import (
+    ArrayObject, DictionaryObject, EncodedStreamObject, IndirectObject, NameObject, NullObject, StreamObject
+)
+from PIL import Image, ImageOps, JpegImagePlugin
+
+import metrics
+
+
+class ProcessingError(Exception):
+    """Raised for problems with the caller's input (mapped to HTTP 400)."""
+
+
+class _Progress:
+    """Publishes a job's page count to a small JSON file the server polls.
+
+    Updates are written at most every ``interval`` seconds, each one
+    atomically through a rename, so a reader never sees a partial file.
+    Without a path it does nothing.
+    """
+
+    def __init__(self, path: Optional[str], pages_total: int, interval: float = 0.25):
+        self.path = path
+        self.pages_total = pages_total
+        self.pages_processed = 0
+        self.interval = interval
+        self._written_at = 0.0
+
+    def advance(self, pages: int = 1, stage: str = 'processing') -> None:
+        self.pages_processed += pages
+        if time.monotonic() - self._written_at >= self.interval:
+            self.publish(stage)
+
+    def publish(self, stage: str) -> None:
+        if self.path is None:
+            return
+        partial = f"{self.path}.partial"
+        with open(partial, 'w') as f:
+            json.dump({
+                'stage': stage,
+                'pages_processed': self.pages_processed,
+                'pages_total': self.pages_total,
+            }, f)
+        os.replace(partial, self.path)
+        self._written_at = time.monotonic()
+
+
+# PDF transforms
+# Readers are given open file objects rather than paths: PdfReader slurps a
+# path into a BytesIO, while a file object is only read as objects are needed.
+def merge_pdfs(
+    input_paths: List[str],
+    output_path: str,
+    progress_path: Optional[str] = None,
+    share_resources: bool = False,
+    compress: bool = False,
+) -> Dict[str, int]:
+    """Merge the given PDF files, in order, into output_path.
+
+    ``share_resources`` writes identical objects (fonts, images, form
+    XObjects, their descriptors and resource dictionaries) once instead of
+    once per input; ``compress`` deflates streams stored uncompressed.
+    Returns the page count, the number of objects shared and the bytes
+    saved by both.
+    """
+    pdf_writer = PdfWriter()
+    with ExitStack() as stack:
+        with metrics.stage('decode'):
+            pdf_readers = [PdfReader(stack.enter_context(open(input_path, 'rb'))) for input_path in input_paths]
+            progress = _Progress(progress_path, sum(len(pdf_reader.pages) for pdf_reader in pdf_readers))
+            for pdf_reader in pdf_readers:
+                for page in pdf_reader.pages:
+                    pdf_writer.add_page(page)
+                    progress.advance()
+
+        bytes_saved = objects_shared = 0
+        with metrics.stage('transform'):
+            if share_resources:
+                progress.publish('deduplicating')
+                objects_shared, bytes_saved = _share_identical_objects(pdf_writer)
+            if compress:
+                progress.publish('compressing')
+                bytes_saved += _compress_streams(pdf_writer)
+
+        progress.publish('writing')
+        with metrics.stage('encode'), open(output_path, 'wb') as output_stream:
+            pdf_writer.write(output_stream)
+    progress.publish('done')
+    metrics.count('pages', len(pdf_writer.pages))
+    return {
+        "page_count": len(pdf_writer.pages),
+        "objects_shared": objects_shared,
+        "bytes_saved": bytes_saved,
+    }
+
+
+# Resource sharing. PdfWriter copies each reader's objects separately, so a
+# font or image used by several inputs ends up in the output several times.
+# Objects are compared by their serialized form; after each round of merging
+# duplicates, objects that referred to them serialize identically too (a
+# font whose font file was shared, then the resources using that font), so
+# rounds repeat until nothing changes. PyPDF2 3.0.1 cannot renumber objects
+# or write object streams, so a duplicate's slot is left holding ``null``.
+_UNSHAREABLE_TYPES = ('/Page', '/Pages', '/Catalog', '/Annot')
+
+
+def _shareable(pdf_writer: PdfWriter, index: int, obj: Any) -> bool:
+    if isinstance(obj, ArrayObject):
+        return True
+    if not isinstance(obj, DictionaryObject):
+        return False
+    # Pages, tree nodes and annotations must stay distinct objects
+    return (
+        obj.get('/Type') not in _UNSHAREABLE_TYPES
+        and '/Parent' not in obj
+        and index + 1 != pdf_writer._info.idnum
+    )
+
+
+def _retarget(obj: Any, replacements: Dict[int, IndirectObject]) -> None:
+    """Point references to replaced objects at the copy being kept, in place"""
+    if not isinstance(obj, (DictionaryObject, ArrayObject)):
+        return
+    for key, value in list(obj.items()):
+        if isinstance(value, IndirectObject):
+            if value.idnum in replacements:
+                obj[key] = replacements[value.idnum]
+        else:
+            _retarget(value, replacements)
+
+
+def _share_identical_objects(pdf_writer: PdfWriter) -> Tuple[int, int]:
+    """Replace duplicate objects with references to one copy; returns (objects, bytes) saved"""
+    objects = pdf_writer._objects
+    shared = saved = 0
+    while True:
+        first_by_digest: Dict[bytes, int] = {}
+        replacements: Dict[int, IndirectObject] = {}
+        for index, obj in enumerate(objects):
+            if not _shareable(pdf_writer, index, obj):
+                continue
+            serialized = io.BytesIO()
+            obj.write_to_stream(serialized, None)
+            digest = hashlib.sha256(serialized.getvalue()).digest()
+            if digest in first_by_digest:
+                replacements[index + 1] = IndirectObject(first_by_digest[digest], 0, pdf_writer)
+                saved += serialized.tell()
+            else:
+                first_by_digest[digest] = index + 1
+        if not replacements:
+            return shared, saved
+
+        for idnum in replacements:
+            objects[idnum - 1] = NullObject()
+        for obj in objects:
+            _retarget(obj, replacements)
+        shared += len(replacements)
+
+
+_FLATE_FILTER = b'/Filter /FlateDecode\n'
+
+
+def _compress_streams(pdf_writer: PdfWriter) -> int:
+    """Deflate every stream stored without a filter; returns the bytes saved"""
+    saved = 0
+    objects = pdf_writer._objects
+    for index, obj in enumerate(objects):
+        if not isinstance(obj, StreamObject) or '/Filter' in obj:
+            continue
+        data = obj.get_data()
+        compressed = zlib.compress(data)
+        if len(compressed) + len(_FLATE_FILTER) >= len(data):
+            continue
+        encoded = EncodedStreamObject()
+        encoded.update({key: value for key, value in obj.items() if key != '/Length'})
+        encoded[NameObject('/Filter')] = NameObject('/FlateDecode')
+        encoded._data = compressed
+        encoded.indirect_reference = obj.indirect_reference
+        objects[index] = encoded
+        saved += len(data) - len(compressed) - len(_FLATE_FILTER)
+    return saved
+
+
+def extract_pdf_page(input_path: str, page_number: int, output_path: str) -> None:
+    """Write a single page (1-based) of a PDF to output_path as a new PDF"""
+    with open(input_path, 'rb') as input_stream:
+        with metrics.stage('decode'):
+            pdf_reader = PdfReader(input_stream)
+            page_count = len(pdf_reader.pages)
+            if page_number < 1 or page_number > page_count:
+                raise ProcessingError(
+                    f"Page number {page_number} is invalid. PDF has {page_count} pages."
+                )
+
+            pdf_writer = PdfWriter()
+            pdf_writer.add_page(pdf_reader.pages[page_number - 1])  # Convert to 0-based index
+
+        with metrics.stage('encode'), open(output_path, 'wb') as output_stream:
+            pdf_writer.write(output_stream)
+    metrics.count('pages', 1)
+
+
+def pdf_info(source: Union[str, bytes]) -> Dict[str, Any]:
+    """Page count, size and document info of a PDF file (path) or small PDF (bytes).
+
+    Only the trailer, the cross-reference table and the objects it leads to
+    (catalog, page tree root, info dictionary) are read, so the cost does not
+    grow with the size of the file. ``len(reader.pages)`` is avoided on
+    purpose: it walks the whole page tree.
+    """
+    with ExitStack() as stack:
+        if isinstance(source, bytes):
+            stream = io.BytesIO(source)
+        else:
+            stream = stack.enter_context(open(source, 'rb'))
+        file_size = stream.seek(0, io.SEEK_END)
+        try:
+            with metrics.stage('decode'):
+                pdf_reader = PdfReader(stream)
+            encrypted = pdf_reader.is_encrypted
+            # An empty user password opens files that only restrict permissions
+            if encrypted and not pdf_reader.decrypt(''):
+                return {
+                    "page_count": None,
+                    "file_size": file_size,
+                    "pdf_version": pdf_reader.pdf_header[len('%PDF-'):],
+                    "encrypted": True,
+                    "metadata": {},
+                }
+            page_count = int(pdf_reader.trailer['/Root']['/Pages']['/Count'])
+            metadata = {key: str(value) for key, value in (pdf_reader.metadata or {}).items()}
+        except (PdfReadError, KeyError, TypeError, ValueError) as e:
+            raise ProcessingError(f"Could not read PDF: {str(e)}")
+
+        return {
+            "page_count": page_count,
+            "file_size": file_size,
+            "pdf_version": pdf_reader.pdf_header[len('%PDF-'):],
+            "encrypted": encrypted,
+            "metadata": metadata,
+        }
+
+
+def parse_page_ranges(spec: str, page_count: int) -> List[Tuple[int, int]]:
+    """Parse a page selection such as "1-3,7,10-" into inclusive 1-based ranges"""
+    spec = spec.strip().lower()
+    if spec in ('', 'all'):
+        return [(1, page_count)]
+
+    ranges = []
+    for part in spec.split(','):
+        part = part.strip()
+        try:
+            if '-' in part:
+                start, end = part.split('-', 1)
+                start = int(start) if start.strip() else 1
+                end = int(end) if end.strip() else page_count
+            else:
+                start = end = int(part)
+        except ValueError:
+            raise ProcessingError(f"Invalid page range '{part}'")
+        if start < 1 or end > page_count or start > end:
+            raise ProcessingError(
+                f"Page range '{part}' is invalid. PDF has {page_count} pages."
+            )
+        ranges.append((start, end))
+    return ranges
+
+
+class _AppendOnly:
+    """File wrapper without seek/tell, so ZipFile writes strictly sequentially.
+
+    ZipFile normally seeks back to patch each entry's header; on an
+    unseekable stream it uses data descriptors instead, which means the
+    bytes on disk are final as soon as they are written and the server can
+    stream the archive while it is still being built.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def write(self, data):
+        written = self._stream.write(data)
+        self._stream.flush()
+        return written
+
+    def flush(self):
+        self._stream.flush()
+
+
+def split_pdf(input_path: str, pages: str, mode: str, output_path: str, progress_path: Optional[str] = None) -> int:
+    """Split a PDF into a ZIP of parts, parsing the input only once.
+
+    ``mode`` is 'pages' for one PDF per selected page or 'ranges' for one
+    PDF per range in ``pages``. Returns the number of parts written.
+    """
+    with open(input_path, 'rb') as input_stream:
+        with metrics.stage('decode'):
+            pdf_reader = PdfReader(input_stream)
+            ranges = parse_page_ranges(pages, len(pdf_reader.pages))
+        if mode == 'pages':
+            ranges = [(n, n) for start, end in ranges for n in range(start, end + 1)]
+        progress = _Progress(progress_path, sum(end - start + 1 for start, end in ranges))
+
+        with open(output_path, 'wb') as output_stream, \
+                zipfile.ZipFile(_AppendOnly(output_stream), 'w', zipfile.ZIP_DEFLATED) as archive:
+            for start, end in ranges:
+                with metrics.stage('transform'):
+                    pdf_writer = PdfWriter()
+                    for index in range(start - 1, end):
+                        pdf_writer.add_page(pdf_reader.pages[index])
+
+                # Only the current part is ever held in memory
+                with metrics.stage('encode'):
+                    part_stream = io.BytesIO()
+                    pdf_writer.write(part_stream)
+                    name = f"page_{start}.pdf" if start == end else f"pages_{start}-{end}.pdf"
+                    archive.writestr(name, part_stream.getvalue())
+                progress.advance(end - start + 1)
+    progress.publish('done')
+    metrics.count('pages', progress.pages_processed)
+    return len(ranges)
+
+
+# Image transforms
+def _decode(content: bytes) -> Image.Image:
+    """Open and fully decode an image"""
+    with metrics.stage('decode'):
+        image = Image.open(io.BytesIO(content))
+        image.load()
+    metrics.count('pixels', image.width * image.height)
+    return image
+
+
+ROTATE_MODES = ('exact', 'exif', 'lossless')
+JPEGTRAN_TIMEOUT = 60
+
+# Clockwise right-angle turns done by moving pixels instead of resampling
+_RIGHT_ANGLES = {
+    90: Image.Transpose.ROTATE_270,
+    180: Image.Transpose.ROTATE_180,
+    270: Image.Transpose.ROTATE_90,
+}
+
+
+def _rotate(image: Image.Image, degrees: int) -> Image.Image:
+    """Rotate clockwise; exact and fast for multiples of 90 degrees"""
+    degrees %= 360
+    if degrees == 0:
+        return image
+    if degrees in _RIGHT_ANGLES:
+        return image.transpose(_RIGHT_ANGLES[degrees])
+    return image.rotate(-degrees, expand=True)  # Negative for clockwise rotation
+
+
+# EXIF orientations (1-8) as the 2x2 matrix that turns the stored pixels
+# into the displayed image, in x-right / y-down coordinates
+_ORIENTATION_MATRICES = {
+    1: (1, 0, 0, 1),
+    2: (-1, 0, 0, 1),  # Mirrored left-right
+    3: (-1, 0, 0, -1),  # 180
+    4: (1, 0, 0, -1),  # Mirrored top-bottom
+    5: (0, 1, 1, 0),  # Transposed
+    6: (0, -1, 1, 0),  # 90 clockwise
+    7: (0, -1, -1, 0),  # Transversed
+    8: (0, 1, -1, 0),  # 270 clockwise
+}
+_MATRIX_ORIENTATIONS = {matrix: orientation for orientation, matrix in _ORIENTATION_MATRICES.items()}
+_ORIENTATION_TAG = 0x0112
+
+
+def _rotated_orientation(orientation: int, degrees: int) -> int:
+    """The orientation that shows an image with ``orientation`` turned ``degrees`` clockwise"""
+    a, b, c, d = _ORIENTATION_MATRICES[6]
+    m = _ORIENTATION_MATRICES[orientation]
+    for _ in range(degrees // 90):
+        m = (a * m[0] + b * m[2], a * m[1] + b * m[3], c * m[0] + d * m[2], c * m[1] + d * m[3])
+    return _MATRIX_ORIENTATIONS[m]
+
+
+class _JpegExif(NamedTuple):
+    orientation: Optional[int]  # None when the JPEG has no EXIF block at all
+    value_offset: Optional[int]  # Of the orientation value; None when IFD0 has no orientation entry
+    byte_order: str
+    insert_at: int  # Where a new APP1 segment goes
+    segment: int  # Offset of the EXIF APP1 marker, when there is one
+    tiff: int  # Offset of the TIFF header inside it
+    ifd: int  # Offset of IFD0
+    entries: int  # Number of IFD0 entries
+
+
+def _jpeg_exif(content: bytes) -> Optional[_JpegExif]:
+    """Locate the EXIF orientation of a JPEG without decoding it; None if its EXIF block is unreadable"""
+    if content[:2] != b'\xff\xd8':
+        raise ProcessingError("Not a JPEG file")
+    position = insert_at = 2
+    while position + 4 <= len(content) and content[position] == 0xFF:
+        marker = content[position + 1]
+        if marker in (0xDA, 0xD9):  # Start of scan / end of image: no more metadata
+            break
+        length = int.from_bytes(content[position + 2:position + 4], 'big')
+        segment_end = position + 2 + length
+        if marker == 0xE0:
+            insert_at = segment_end  # New EXIF goes after the JFIF header
+        elif marker == 0xE1 and content[position + 4:position + 10] == b'Exif\x00\x00':
+            tiff = position + 10
+            byte_order = {b'II': 'little', b'MM': 'big'}.get(content[tiff:tiff + 2])
+            if byte_order is None:
+                return None
+            ifd = tiff + int.from_bytes(content[tiff + 4:tiff + 8], byte_order)
+            entries = int.from_bytes(content[ifd:ifd + 2], byte_order)
+            # The whole of IFD0, entries and next-IFD pointer, must lie inside the segment
+            if ifd < tiff + 8 or ifd + 2 + 12 * entries + 4 > segment_end:
+                return None
+            for entry in range(ifd + 2, ifd + 2 + 12 * entries, 12):
+                if int.from_bytes(content[entry:entry + 2], byte_order) == _ORIENTATION_TAG:
+                    value = int.from_bytes(content[entry + 8:entry + 10], byte_order)
+                    orientation = value if value in _ORIENTATION_MATRICES else 1
+                    return _JpegExif(orientation, entry + 8, byte_order, insert_at, position, tiff, ifd, entries)
+            return _JpegExif(1, None, byte_order, insert_at, position, tiff, ifd, entries)
+        position = segment_end
+    return _JpegExif(None, None, 'big', insert_at, 0, 0, 0, 0)
+
+
+def _orientation_entry(orientation: int, byte_order: str) -> bytes:
+    return (
+        _ORIENTATION_TAG.to_bytes(2, byte_order) + (3).to_bytes(2, byte_order)  # SHORT
+        + (1).to_bytes(4, byte_order) + orientation.to_bytes(2, byte_order) + b'\x00\x00'
+    )
+
+
+def _exif_rotate(content: bytes, degrees: int) -> Optional[bytes]:
+    """Rotate a JPEG by rewriting its EXIF orientation; None if its EXIF block is unreadable
+
+    A JPEG without EXIF gets a minimal EXIF block holding just the
+    orientation. One whose IFD0 has no orientation entry gets a copy of
+    IFD0 with the entry added, appended to the EXIF block with the header
+    pointing at it: everything else stays where it was, so every offset in
+    the block (sub-IFDs, values, maker notes) remains valid.
+    """
+    exif = _jpeg_exif(content)
+    if exif is None:
+        return None
+    if exif.orientation is None:
+        tiff = b'MM\x00\x2a\x00\x00\x00\x08' + b'\x00\x01'
+        tiff += _orientation_entry(_rotated_orientation(1, degrees), 'big')
+        tiff += b'\x00\x00\x00\x00'  # No further IFDs
+        segment = b'Exif\x00\x00' + tiff
+        insert_at = exif.insert_at
+        return content[:insert_at] + b'\xff\xe1' + (len(segment) + 2).to_bytes(2, 'big') + segment + content[insert_at:]
+
+    new_orientation = _rotated_orientation(exif.orientation, degrees)
+    if exif.value_offset is not None:
+        offset = exif.value_offset
+        return content[:offset] + new_orientation.to_bytes(2, exif.byte_order) + content[offset + 2:]
+
+    byte_order = exif.byte_order
+    segment_end = exif.segment + 2 + int.from_bytes(content[exif.segment + 2:exif.segment + 4], 'big')
+    entries = [content[entry:entry + 12] for entry in range(exif.ifd + 2, exif.ifd + 2 + 12 * exif.entries, 12)]
+    entries.append(_orientation_entry(new_orientation, byte_order))
+    entries.sort(key=lambda entry: int.from_bytes(entry[:2], byte_order))  # IFD entries are sorted by tag
+    next_ifd = content[exif.ifd + 2 + 12 * exif.entries:exif.ifd + 2 + 12 * exif.entries + 4]
+
+    padding = b'\x00' * ((segment_end - exif.tiff) % 2)  # IFDs start on a word boundary
+    new_ifd = segment_end + len(padding) - exif.tiff
+    appended = padding + len(entries).to_bytes(2, byte_order) + b''.join(entries) + next_ifd
+    length = segment_end + len(appended) - exif.segment - 2
+    if length > 0xFFFF:
+        return None
+
+    header = content[exif.tiff:exif.tiff + 4] + new_ifd.to_bytes(4, byte_order)
+    return (
+        content[:exif.segment + 2] + length.to_bytes(2, 'big') + content[exif.segment + 4:exif.tiff]
+        + header + content[exif.tiff + 8:segment_end] + appended + content[segment_end:]
+    )
+
+
+def _jpegtran_rotate(content: bytes, degrees: int) -> Optional[bytes]:
+    """Rotate a JPEG in the DCT domain with jpegtran; None if unavailable or not exactly possible"""
+    jpegtran = shutil.which('jpegtran')
+    if jpegtran is None:
+        return None
+    # -perfect refuses images whose size is not a whole number of MCUs
+    # rather than trimming their edges
+    result = subprocess.run(
+        [jpegtran, '-rotate', str(degrees), '-perfect', '-copy', 'all', '-optimize'],
+        input=content, capture_output=True, timeout=JPEGTRAN_TIMEOUT,
+    )
+    if result.returncode != 0 or not result.stdout:
+        return None
+    return result.stdout
+
+
+def _preserving_options(image: Image.Image) -> Dict[str, Any]:
+    """Save options that keep an image's EXIF (orientation reset) and, for JPEGs, its quantization"""
+    options: Dict[str, Any] = {}
+    exif = image.getexif()
+    if exif:
+        exif = Image.Exif()
+        exif.load(image.getexif().tobytes())  # A copy: the image's own is what exif_transpose reads
+        exif[_ORIENTATION_TAG] = 1
+        options['exif'] = exif.tobytes()
+    if image.format == 'JPEG':
+        # The source's own tables, so re-encoding costs as little quality as possible
+        options['qtables'] = image.quantization
+        subsampling = JpegImagePlugin.get_sampling(image)
+        if subsampling != -1:
+            options['subsampling'] = subsampling
+    return options
+
+
+def rotate_image(content: bytes, rotation: int, mode: str = 'exact') -> Tuple[bytes, str, str]:
+    """Rotate an image clockwise; returns the encoded image, its format and the path taken
+
+    Right angles are done with Image.transpose ('transpose'), other angles
+    by resampling ('resample'). For JPEGs turned by a right angle, mode
+    'exif' only rewrites the EXIF orientation tag, so viewers that honour
+    it show the image turned without any pixel being decoded ('exif').
+    Mode 'lossless' rotates the compressed data itself with jpegtran when
+    it is installed ('jpegtran'), and otherwise, or when the image already
+    carries a non-default orientation, rewrites the tag like 'exif'. Either
+    falls back to 'transpose' when neither applies. A turn by a multiple of
+    360 degrees returns the image unchanged ('none').
+
+    The decoding paths turn the image as displayed, applying any EXIF
+    orientation first, keep the other EXIF tags, and re-encode JPEGs with
+    their original quantization tables.
+    """
+    degrees = rotation % 360
+    if degrees == 0:
+        with Image.open(io.BytesIO(content)) as image:
+            return content, image.format or 'PNG', 'none'
+
+    if mode != 'exact' and degrees in _RIGHT_ANGLES and content[:2] == b'\xff\xd8':
+        with metrics.stage('transform'):
+            rotated = None
+            exif = _jpeg_exif(content)
+            if mode == 'lossless' and exif is not None and exif.orientation in (None, 1):
+                # Only when there is no orientation to preserve, since jpegtran
+                # keeps the tag and it would then apply to the turned pixels
+                rotated = _jpegtran_rotate(content, degrees)
+                path = 'jpegtran'
+            if rotated is None:
+                rotated = _exif_rotate(content, degrees)
+                path = 'exif'
+        if rotated is not None:
+            return rotated, 'JPEG', path
+
+    image = _decode(content)
+    image_format = image.format or 'PNG'
+    save_options = _preserving_options(image)
+    with metrics.stage('transform'):
+        # Turn what the viewer sees, not the stored pixels: apply the EXIF
+        # orientation first (the saved EXIF then has none)
+        rotated_image = _rotate(ImageOps.exif_transpose(image), degrees)
+
+    output_stream = io.BytesIO()
+    with metrics.stage('encode'):
+        rotated_image.save(output_stream, format=image_format, **save_options)
+    return output_stream.getvalue(), image_format, 'transpose' if degrees in _RIGHT_ANGLES else 'resample'
+
+
+# Fast resizes let Image.resize first shrink by an integer factor with
+# Image.reduce until the image is at most this many times the target size
+REDUCING_GAP = 3.0
+
+# Largest resize result, the same bound Pillow puts on decoded images;
+# one 4-byte pixel each, a result this size already takes about 360 MB
+MAX_OUTPUT_PIXELS = Image.MAX_IMAGE_PIXELS or 89_478_485
+
+
+def output_size_error(width: int, height: int) -> Optional[str]:
+    """Why a resize to width x height is not allowed, or None if it is"""
+    if width < 1 or height < 1:
+        return "Width and height must be at least 1"
+    if width * height > MAX_OUTPUT_PIXELS:
+        return f"Resized image must have at most {MAX_OUTPUT_PIXELS} pixels, got {width}x{height}"
+    return None
+
+
+def resize_image(content: bytes, width: int, height: int, mode: str = 'exact') -> Tuple[bytes, str, str]:
+    """Resize an image; returns the encoded image, its format and the path taken
+
+    mode 'exact' resamples the full-resolution image with LANCZOS. mode
+    'fast' trades a little quality for speed on large downscales: JPEGs
+    are decoded at a reduced DCT scale (1/2, 1/4 or 1/8) via draft mode,
+    and what remains is shrunk with Image.reduce before the final LANCZOS
+    pass. The path is 'exact', or a '+'-joined subset of 'draft' and
+    'reduce' ('lanczos' if the fast path found nothing to skip).
+    """
+    image = Image.open(io.BytesIO(content))
+    image_format = image.format or 'PNG'
+    steps = []
+
+    with metrics.stage('decode'):
+        if mode == 'fast' and image.format == 'JPEG' and width * 2 <= image.width and height * 2 <= image.height:
+            original_size = image.size
+            # Decode no smaller than the target, so LANCZOS still has the last word
+            image.draft(image.mode, (width, height))
+            if image.size != original_size:
+                steps.append('draft')
+        image.load()
+    metrics.count('pixels', image.width * image.height)
+
+    with metrics.stage('transform'):
+        if mode == 'fast':
+            if image.width >= width * REDUCING_GAP * 2 or image.height >= height * REDUCING_GAP * 2:
+                steps.append('reduce')
+            resized_image = image.resize((width, height), Image.Resampling.LANCZOS, reducing_gap=REDUCING_GAP)
+        else:
+            resized_image = image.resize((width, height), Image.Resampling.LANCZOS)
+
+    output_stream = io.BytesIO()
+    with metrics.stage('encode'):
+        resized_image.save(output_stream, format=image_format)
+    if mode != 'fast':
+        return output_stream.getvalue(), image_format, 'exact'
+    return output_stream.getvalue(), image_format, '+'.join(steps) or 'lanczos'
+
+
+
+# Compression
+COMPRESS_FORMATS = ('JPEG', 'WEBP', 'PNG')
+MIN_QUALITY = 5
+MAX_QUALITY = 95
+
+
+class _SizeCounter:
+    """Write-only sink that only counts bytes, for trial encodes"""
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+def _encode_options(image_format: str, quality: Optional[int], final: bool) -> Dict[str, Any]:
+    # Trial encodes skip the expensive passes: Huffman optimisation for JPEG,
+    # the slower compression methods for WebP. Those passes almost always
+    # shrink the output further, so the trial size is an upper bound in practice.
+    if image_format == 'JPEG':
+        return {'quality': quality, 'optimize': final}
+    if image_format == 'WEBP':
+        return {'quality': quality, 'method': 6 if final else 0}
+    return {'optimize': True}
+
+
+def compress_image(
+    content: bytes,
+    image_format: Optional[str] = None,
+    quality: int = 85,
+    target_bytes: Optional[int] = None,
+) -> Tuple[bytes, str, Optional[int]]:
+    """Re-encode an image smaller; returns the encoded image, its format and the quality used
+
+    ``image_format`` defaults to the input's format if it is one of
+    COMPRESS_FORMATS, otherwise JPEG. With ``target_bytes`` the quality is
+    binary-searched (between MIN_QUALITY and ``quality``) for the highest
+    setting whose output fits; trial encodes only count bytes and skip the
+    expensive encoder passes, and the image is decoded once. If even
+    MIN_QUALITY does not fit, that smallest result is returned. PNG is
+    lossless, so it is only optimised and the quality is None. EXIF and ICC
+    profile are carried over.
+    """
+    image = _decode(content)
+    image_format = image_format or (image.format if image.format in COMPRESS_FORMATS else 'JPEG')
+    metadata = {key: image.info[key] for key in ('exif', 'icc_profile') if image.info.get(key)}
+    if image_format == 'JPEG' and image.mode not in ('RGB', 'L', 'CMYK'):
+        image = image.convert('RGB')
+
+    if image_format == 'PNG':
+        quality = None
+    elif target_bytes is not None:
+        def fits(trial_quality: int) -> bool:
+            counter = _SizeCounter()
+            image.save(counter, format=image_format, **_encode_options(image_format, trial_quality, False), **metadata)
+            return counter.size <= target_bytes
+
+        # Trial encodes are the search, so they count as the transform
+        with metrics.stage('transform'):
+            if not fits(quality):
+                low, high = MIN_QUALITY, quality - 1
+                quality = MIN_QUALITY
+                while low <= high:
+                    middle = (low + high) // 2
+                    if fits(middle):
+                        quality, low = middle, middle + 1
+                    else:
+                        high = middle - 1
+
+    with metrics.stage('encode'):
+        output_stream = io.BytesIO()
+        image.save(output_stream, format=image_format, **_encode_options(image_format, quality, True), **metadata)
+        if target_bytes is not None and quality is not None and output_stream.tell() > target_bytes:
+            # The rare case where the slow encoder did worse than the trial
+            output_stream = io.BytesIO()
+            image.save(output_stream, format=image_format, **_encode_options(image_format, quality, False), **metadata)
+    return output_stream.getvalue(), image_format, quality
+
+# Image pipeline: several operations applied between one decode and one encode
+SEPIA_MATRIX = (
+    0.393, 0.769, 0.189, 0,
+    0.349, 0.686, 0.168, 0,
+    0.272, 0.534, 0.131, 0,
+)
+PIPELINE_FORMATS = ('JPEG', 'PNG', 'WEBP')
+MAX_PIPELINE_STEPS = 20
+
+
+def _int_param(step: Dict[str, Any], name: str, low: int, high: int, default=None) -> int:
+    value = step.get(name, default)
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not low <= value <= high:
+        raise ProcessingError(f"'{step['op']}' needs '{name}' between {low} and {high}")
+    return int(value)
+
+
+def validate_pipeline(operations: Any) -> List[Dict[str, Any]]:
+    """Check a list of pipeline steps and return them with defaults filled in"""
+    if not isinstance(operations, list) or not operations:
+        raise ProcessingError("Operations must be a non-empty list")
+    if len(operations) > MAX_PIPELINE_STEPS:
+        raise ProcessingError(f"At most {MAX_PIPELINE_STEPS} operations are allowed")
+
+    steps = []
+    for step in operations:
+        if not isinstance(step, dict) or 'op' not in step:
+            raise ProcessingError("Each operation must be an object with an 'op' field")
+        op = step['op']
+        if op == 'rotate':
+            steps.append({'op': op, 'degrees': _int_param(step, 'degrees', -360, 360)})
+        elif op == 'resize':
+            width = _int_param(step, 'width', 1, MAX_OUTPUT_PIXELS)
+            height = _int_param(step, 'height', 1, MAX_OUTPUT_PIXELS)
+            error = output_size_error(width, height)
+            if error:
+                raise ProcessingError(f"'resize': {error}")
+            steps.append({'op': op, 'width': width, 'height': height})
+        elif op == 'crop':
+            box = {name: _int_param(step, name, 0, 100000) for name in ('left', 'top', 'right', 'bottom')}
+            if box['left'] >= box['right'] or box['top'] >= box['bottom']:
+                raise ProcessingError("'crop' needs left < right and top < bottom")
+            steps.append({'op': op, **box})
+        elif op in ('grayscale', 'sepia'):
+            steps.append({'op': op})
+        elif op == 'brightness':
+            steps.append({'op': op, 'amount': _int_param(step, 'amount', -255, 255, default=50)})
+        elif op == 'compress':
+            image_format = str(step.get('format', '')).upper() or None
+            if image_format == 'JPG':
+                image_format = 'JPEG'
+            if image_format is not None and image_format not in PIPELINE_FORMATS:
+                raise ProcessingError(f"'compress' format must be one of {', '.join(PIPELINE_FORMATS)}")
+            quality = _int_param(step, 'quality', MIN_QUALITY, MAX_QUALITY, default=85)
+            steps.append({'op': op, 'quality': quality, 'format': image_format})
+        else:
+            raise ProcessingError(f"Unknown operation '{op}'")
+    return steps
+
+
+def _color(image: Image.Image) -> Image.Image:
+    """Bring palette/other modes to L, LA, RGB or RGBA so per-band operations apply"""
+    if image.mode in ('L', 'LA', 'RGB', 'RGBA'):
+        return image
+    has_alpha = 'A' in image.getbands() or 'transparency' in image.info
+    return image.convert('RGBA' if has_alpha else 'RGB')
+
+
+def run_image_pipeline(content: bytes, operations: List[Dict[str, Any]]) -> Tuple[bytes, str]:
+    """Apply validated pipeline steps in order; returns the encoded image and its format"""
+    image = _decode(content)
+    image_format = image.format or 'PNG'
+    save_options: Dict[str, Any] = {}
+
+    with metrics.stage('transform'):
+        for step in operations:
+            op = step['op']
+            if op == 'rotate':
+                image = _rotate(image, step['degrees'])
+            elif op == 'resize':
+                image = image.resize((step['width'], step['height']), Image.Resampling.LANCZOS)
+            elif op == 'crop':
+                box = (step['left'], step['top'], step['right'], step['bottom'])
+                if box[2] > image.width or box[3] > image.height:
+                    raise ProcessingError(f"Crop box {box} lies outside the {image.width}x{image.height} image")
+                image = image.crop(box)
+            elif op == 'grayscale':
+                # ITU-R 601 luma, the same weights the browser editor uses
+                image = _color(image)
+                image = image.convert('LA' if 'A' in image.getbands() else 'L')
+            elif op == 'sepia':
+                image = _color(image)
+                sepia = image.convert('RGB').convert('RGB', SEPIA_MATRIX)
+                if 'A' in image.getbands():
+                    sepia.putalpha(image.getchannel('A'))
+                image = sepia
+            elif op == 'brightness':
+                # Add a constant to every colour band through a lookup table
+                image = _color(image)
+                shifted = [min(255, max(0, value + step['amount'])) for value in range(256)]
+                identity = list(range(256))
+                table = []
+                for band in image.getbands():
+                    table += identity if band == 'A' else shifted
+                image = image.point(table)
+            elif op == 'compress':
+                image_format = step['format'] or image_format
+                save_options = {'quality': step['quality'], 'optimize': True}
+
+    if image_format == 'JPEG' and image.mode not in ('RGB', 'L', 'CMYK'):
+        image = image.convert('RGB')
+
+    output_stream = io.BytesIO()
+    with metrics.stage('encode'):
+        image.save(output_stream, format=image_format, **save_options)
+    return output_stream.getvalue(), image_format
@@ -1,29 +1,82 @@
-from fastapi import FastAPI, APIRouter, File, UploadFile, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, APIRouter, File, Form, UploadFile, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import asyncio
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional
+from pydantic import BaseModel, Field, ValidationError
+from typing import List, Optional, Union
 import uuid
+import base64
+import hashlib
 from datetime import datetime
 import io
-from PyPDF2 import PdfWriter, PdfReader
-from PIL import Image
+from PIL import UnidentifiedImageError
 import tempfile
 import json
 import zipfile
+import pandas as pd
+
+import conversions
+import expressions
+import finance
+import metrics
+from analytics import OperationCounters
+from audit import AuditLog
+import processing
+from cache import CacheEntry, ResultCache
+from archive import ProjectArchive
+import batch
+import jobs
+from jobs import JobStore, JobLimitReached
+from storage import Storage
+from streams import RequestFiles, iter_file, parse_byte_range, wait_for_output
+from workers import WorkerPool, PoolSaturated, JobTimeout
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# Status checks, operation records and analytics counters live in MongoDB,
+# a local journal file, memory or nowhere, as STORAGE_BACKEND selects
+storage = Storage.from_env(str(ROOT_DIR / 'data'))
+db = storage.database
+
+# Operation records are queued and written in the background, keeping
+# pre-aggregated counters for the analytics endpoints up to date
+operation_counters = OperationCounters()
+audit_log = AuditLog.from_env(lambda: storage.audit_database, operation_counters)
+
+# Process pool for the CPU-bound PDF and image work
+worker_pool = WorkerPool.from_env()
+
+# Content-addressed cache of transform results
+result_cache = ResultCache.from_env()
+
+# Uploads are spooled to disk; MAX_UPLOAD_BYTES caps the total per request
+UPLOAD_TMP_DIR = os.environ.get('UPLOAD_TMP_DIR') or None
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', 512 * 1024 * 1024))
+
+# Batch image jobs: files per batch, and bytes per file unpacked from a ZIP
+MAX_BATCH_FILES = int(os.environ.get('MAX_BATCH_FILES', 1000))
+MAX_BATCH_ENTRY_BYTES = int(os.environ.get('MAX_BATCH_ENTRY_BYTES', 64 * 1024 * 1024))
+
+# Background jobs; results are kept for a while under their own directory
+job_store = JobStore.from_env(
+    os.path.join(tempfile.gettempdir(), "mobile-tools-jobs"), max_running=worker_pool.max_workers
+)
+
+# Cached archive for /api/download/project, kept outside the tree it archives
+project_archive = ProjectArchive(
+    ROOT_DIR,
+    os.environ.get('PROJECT_ARCHIVE_DIR') or os.path.join(tempfile.gettempdir(), 'mobile-tools-archive'),
+    exclude=[path for path in (
+        UPLOAD_TMP_DIR, os.environ.get('RESULT_CACHE_DIR'), job_store.directory,
+        os.path.dirname(storage.settings.get('path', '')),
+    ) if path]
+)
 
 # Create the main app without a prefix
 app = FastAPI(title="Mobile Tools Hub API", version="1.0.0")
@@ -64,6 +117,46 @@ class ConversionOperation(BaseModel):
     country: str
     timestamp: datetime = Field(default_factory=datetime.utcnow)
 
+class ConversionBatchOperation(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    category: str
+    from_unit: str
+    to_unit: str
+    country: str
+    value_count: int
+    timestamp: datetime = Field(default_factory=datetime.utcnow)
+
+class ConversionUsageOperation(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    category: str
+    from_unit: str
+    to_unit: str
+    country: str
+    conversion_count: int  # Conversions a client did locally
+    registry_version: Optional[str] = None
+    timestamp: datetime = Field(default_factory=datetime.utcnow)
+
+class ConversionUsageItem(BaseModel):
+    category: str
+    from_unit: str
+    to_unit: str
+    country: str = "US"
+    count: int = Field(ge=1, le=1000000)
+
+class ConversionUsageReport(BaseModel):
+    registry_version: Optional[str] = None
+    reports: List[ConversionUsageItem] = Field(max_length=10000)
+
+class CompoundGridRequest(BaseModel):
+    principal: List[float]
+    rate: List[float]  # Annual percentage
+    years: List[float]
+    frequency: List[int] = [12]  # Compounding periods per year
+
+class CalculationRequest(BaseModel):
+    expression: str
+    x: Optional[Union[float, List[float]]] = None
+
 # Basic API routes
 @api_router.get("/")
 async def root():
@@ -73,57 +166,180 @@ async def root():
 async def create_status_check(input: StatusCheckCreate):
     status_dict = input.dict()
     status_obj = StatusCheck(**status_dict)
-    await db.status_checks.insert_one(status_obj.dict())
+    try:
+        with metrics.stage("db_write"):
+            await db.status_checks.insert_one(status_obj.dict())
+    except Exception as e:
+        logger.error(f"Error storing status check: {str(e)}")
+        raise HTTPException(status_code=503, detail="Storage is unavailable")
     return status_obj
 
-@api_router.get("/status", response_model=List[StatusCheck])
-async def get_status_checks():
-    status_checks = await db.status_checks.find().to_list(1000)
-    return [StatusCheck(**status_check) for status_check in status_checks]
+STATUS_FIELDS = ("id", "client_name", "timestamp")
+
+def encode_status_cursor(document: dict) -> str:
+    """Opaque cursor pointing just past a status check in (timestamp, id) order"""
+    position = json.dumps([document["timestamp"].isoformat(), document["id"]])
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+def decode_status_cursor(cursor: str) -> dict:
+    """Query filter for the status checks after the cursor position"""
+    try:
+        timestamp, status_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        timestamp = datetime.fromisoformat(timestamp)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return {"$or": [
+        {"timestamp": {"$gt": timestamp}},
+        {"timestamp": timestamp, "id": {"$gt": status_id}}
+    ]}
+
+def status_row(document: dict) -> dict:
+    return {key: value.isoformat() if isinstance(value, datetime) else value for key, value in document.items()}
+
+@api_router.get("/status")
+async def get_status_checks(
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    client_name: Optional[str] = None,
+    fields: Optional[str] = None,
+    format: str = "json"
+):
+    """List status checks, oldest first, one page at a time
+    
+    Pass the ``X-Next-Cursor`` response header back as ``cursor`` to get the
+    next page. ``fields`` is a comma-separated subset of id, client_name and
+    timestamp. With ``format=ndjson`` rows are streamed as they are read and
+    ``limit=0`` returns every remaining row; JSON pages hold at most 1000.
+    """
+    if format not in ("json", "ndjson"):
+        raise HTTPException(status_code=400, detail="Format must be 'json' or 'ndjson'")
+    if limit < 0 or (format == "json" and not 1 <= limit <= 1000):
+        raise HTTPException(status_code=400, detail="Limit must be between 1 and 1000")
+    
+    selected = STATUS_FIELDS
+    if fields:
+        selected = tuple(field.strip() for field in fields.split(",") if field.strip())
+        unknown = set(selected) - set(STATUS_FIELDS)
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    
+    query = {}
+    if client_name is not None:
+        query["client_name"] = client_name
+    if cursor is not None:
+        query.update(decode_status_cursor(cursor))
+    
+    # The cursor needs the sort keys even when they are not selected
+    projection = {"_id": 0, "timestamp": 1, "id": 1, **{field: 1 for field in selected}}
+    rows = db.status_checks.find(query, projection).sort([("timestamp", 1), ("id", 1)]).limit(limit)
+    
+    if format == "ndjson":
+        async def stream_rows():
+            async for document in rows:
+                yield json.dumps(status_row({key: document.get(key) for key in selected})) + "\n"
+        return StreamingResponse(stream_rows(), media_type="application/x-ndjson")
+    
+    try:
+        documents = await rows.to_list(limit)
+    except Exception as e:
+        logger.error(f"Error reading status checks: {str(e)}")
+        raise HTTPException(status_code=503, detail="Storage is unavailable")
+    headers = {}
+    if len(documents) == limit:
+        headers["X-Next-Cursor"] = encode_status_cursor(documents[-1])
+    return JSONResponse(
+        [status_row({key: document.get(key) for key in selected}) for document in documents],
+        headers=headers
+    )
+
+async def run_in_worker(fn, *args):
+    """Run a CPU-bound job in the worker pool, mapping pool errors to HTTP errors"""
+    try:
+        return await worker_pool.run(fn, *args)
+    except PoolSaturated as e:
+        raise HTTPException(
+            status_code=429,
+            detail="Server is busy processing other files, please retry shortly",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except JobTimeout:
+        raise HTTPException(status_code=504, detail="Processing took too long and was abandoned")
+    except processing.ProcessingError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def cached_response(entry: CacheEntry, filename: str) -> Response:
+    """Build the response for a result served from the result cache"""
+    headers = {**entry.headers, "Content-Disposition": f"attachment; filename={filename}", "X-Cache": "HIT"}
+    if entry.data is not None:
+        return Response(entry.data, media_type=entry.media_type, headers=headers)
+    return FileResponse(entry.path, media_type=entry.media_type, headers=headers)
+
+@api_router.get("/audit/stats")
+async def get_audit_stats():
+    """Get queue depth and write/drop counters of the audit log writer"""
+    return audit_log.stats()
+
+@api_router.get("/storage/stats")
+async def get_storage_stats():
+    """Get the storage backend in use and its settings"""
+    return storage.stats()
+
+@api_router.get("/cache/stats")
+async def get_cache_stats():
+    """Get hit/miss counters and occupancy of the result cache"""
+    return result_cache.stats()
 
 # PDF Processing Routes
 @api_router.post("/pdf/merge")
-async def merge_pdfs(files: List[UploadFile] = File(...)):
-    """Merge multiple PDF files into one"""
+async def merge_pdfs(dedupe: bool = False, compress: bool = False, files: List[UploadFile] = File(...)):
+    """Merge multiple PDF files into one
+    
+    ``dedupe`` writes fonts, images and other resources shared by several
+    inputs only once; ``compress`` deflates streams stored uncompressed.
+    X-Bytes-Saved reports what they saved.
+    """
     try:
         if len(files) < 2:
             raise HTTPException(status_code=400, detail="At least 2 PDF files required for merging")
         
-        # Create a PDF writer object
-        pdf_writer = PdfWriter()
-        
-        # Process each uploaded file
         for file in files:
             if not file.filename.lower().endswith('.pdf'):
                 raise HTTPException(status_code=400, detail=f"File {file.filename} is not a PDF")
+        
+        with RequestFiles(UPLOAD_TMP_DIR, MAX_UPLOAD_BYTES) as request_files:
+            # Spool each upload to disk instead of holding it in memory
+            input_paths = [await request_files.spool(file, '.pdf') for file in files]
+            cache_key = ResultCache.key(
+                "merge", [request_files.digests[path] for path in input_paths], {"dedupe": dedupe, "compress": compress}
+            )
+            cached = await run_in_threadpool(result_cache.get, cache_key)
             
-            # Read the PDF file
-            pdf_content = await file.read()
-            pdf_reader = PdfReader(io.BytesIO(pdf_content))
+            if cached is None:
+                # Merge in a worker process so the event loop stays responsive
+                output_path = request_files.new_path('.pdf')
+                merged = await run_in_worker(processing.merge_pdfs, input_paths, output_path, None, dedupe, compress)
+                headers = {
+                    "X-Result-Key": cache_key,
+                    "X-Bytes-Saved": str(merged["bytes_saved"]),
+                    "X-Objects-Shared": str(merged["objects_shared"]),
+                }
+                await run_in_threadpool(result_cache.put, cache_key, "application/pdf", None, output_path, headers)
             
-            # Add all pages to the writer
-            for page in pdf_reader.pages:
-                pdf_writer.add_page(page)
-        
-        # Create output stream
-        output_stream = io.BytesIO()
-        pdf_writer.write(output_stream)
-        output_stream.seek(0)
-        
-        # Log the operation
-        operation = PDFOperation(
-            operation_type="merge",
-            file_count=len(files)
-        )
-        await db.pdf_operations.insert_one(operation.dict())
-        
-        # Return the merged PDF
-        return StreamingResponse(
-            io.BytesIO(output_stream.read()),
-            media_type="application/pdf",
-            headers={"Content-Disposition": "attachment; filename=merged_document.pdf"}
-        )
+            # Log the operation
+            operation = PDFOperation(
+                operation_type="merge",
+                file_count=len(files)
+            )
+            audit_log.record("pdf_operations", operation)
+            
+            if cached is not None:
+                return cached_response(cached, "merged_document.pdf")
+            
+            # Stream the merged PDF back from disk
+            return request_files.response(output_path, "application/pdf", "merged_document.pdf", headers)
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error merging PDFs: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error merging PDFs: {str(e)}")
@@ -135,39 +351,89 @@ async def split_pdf(page_number: int, file: UploadFile = File(...)):
         if not file.filename.lower().endswith('.pdf'):
             raise HTTPException(status_code=400, detail="File must be a PDF")
         
-        # Read the PDF file
-        pdf_content = await file.read()
-        pdf_reader = PdfReader(io.BytesIO(pdf_content))
-        
-        # Check if page number is valid
-        if page_number < 1 or page_number > len(pdf_reader.pages):
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Page number {page_number} is invalid. PDF has {len(pdf_reader.pages)} pages."
+        with RequestFiles(UPLOAD_TMP_DIR, MAX_UPLOAD_BYTES) as request_files:
+            input_path = await request_files.spool(file, '.pdf')
+            cache_key = ResultCache.key(
+                "split_page", [request_files.digests[input_path]], {"page_number": page_number}
+            )
+            cached = await run_in_threadpool(result_cache.get, cache_key)
+            
+            if cached is None:
+                # Extract the page in a worker process (validates the page number)
+                output_path = request_files.new_path('.pdf')
+                await run_in_worker(processing.extract_pdf_page, input_path, page_number, output_path)
+                await run_in_threadpool(
+                    result_cache.put, cache_key, "application/pdf", None, output_path, {"X-Result-Key": cache_key}
+                )
+            
+            # Log the operation
+            operation = PDFOperation(
+                operation_type="split",
+                file_count=1
+            )
+            audit_log.record("pdf_operations", operation)
+            
+            if cached is not None:
+                return cached_response(cached, f"page_{page_number}.pdf")
+            
+            # Return the page as PDF
+            return request_files.response(
+                output_path, "application/pdf", f"page_{page_number}.pdf", {"X-Result-Key": cache_key}
             )
         
-        # Create a new PDF with just the specified page
-        pdf_writer = PdfWriter()
-        pdf_writer.add_page(pdf_reader.pages[page_number - 1])  # Convert to 0-based index
-        
-        # Create output stream
-        output_stream = io.BytesIO()
-        pdf_writer.write(output_stream)
-        output_stream.seek(0)
-        
-        # Log the operation
-        operation = PDFOperation(
-            operation_type="split",
-            file_count=1
-        )
-        await db.pdf_operations.insert_one(operation.dict())
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error splitting PDF: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error splitting PDF: {str(e)}")
+
+@api_router.post("/pdf/split")
+async def split_pdf_ranges(pages: str = "all", mode: str = "pages", file: UploadFile = File(...)):
+    """Split a PDF into several parts and return them as a ZIP archive
+    
+    ``pages`` selects pages as ranges such as "1-3,7,10-" (default: all).
+    With mode "pages" every selected page becomes its own PDF; with mode
+    "ranges" every range becomes one PDF.
+    """
+    try:
+        if not file.filename.lower().endswith('.pdf'):
+            raise HTTPException(status_code=400, detail="File must be a PDF")
+        if mode not in ("pages", "ranges"):
+            raise HTTPException(status_code=400, detail="Mode must be 'pages' or 'ranges'")
         
-        # Return the page as PDF
-        return StreamingResponse(
-            io.BytesIO(output_stream.read()),
-            media_type="application/pdf",
-            headers={"Content-Disposition": f"attachment; filename=page_{page_number}.pdf"}
-        )
+        with RequestFiles(UPLOAD_TMP_DIR, MAX_UPLOAD_BYTES) as request_files:
+            input_path = await request_files.spool(file, '.pdf')
+            filename = f"{Path(file.filename).stem}_pages.zip"
+            cache_key = ResultCache.key(
+                "split", [request_files.digests[input_path]], {"pages": pages, "mode": mode}
+            )
+            cached = await run_in_threadpool(result_cache.get, cache_key)
+            
+            if cached is None:
+                # The worker parses the PDF once and appends each part to the ZIP
+                # as it is produced; start streaming as soon as the first one lands
+                output_path = request_files.new_path('.zip')
+                job = asyncio.ensure_future(
+                    run_in_worker(processing.split_pdf, input_path, pages, mode, output_path)
+                )
+                await wait_for_output(output_path, job)
+                if job.done():
+                    job.result()  # Surfaces invalid page ranges and pool errors
+            
+            # Log the operation
+            operation = PDFOperation(
+                operation_type="split",
+                file_count=1
+            )
+            audit_log.record("pdf_operations", operation)
+            
+            if cached is not None:
+                return cached_response(cached, filename)
+            
+            return request_files.follow(
+                output_path, job, "application/zip", filename,
+                on_complete=lambda: result_cache.put(cache_key, "application/zip", path=output_path)
+            )
         
     except HTTPException:
         raise
@@ -175,103 +441,579 @@ async def split_pdf(page_number: int, file: UploadFile = File(...)):
         logger.error(f"Error splitting PDF: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error splitting PDF: {str(e)}")
 
+@api_router.post("/pdf/info")
 @api_router.get("/pdf/info")
-async def get_pdf_info(file: UploadFile = File(...)):
-    """Get information about a PDF file"""
+async def get_pdf_info(
+    job_id: Optional[str] = None,
+    result_key: Optional[str] = None,
+    file: Optional[UploadFile] = File(None)
+):
+    """Get information about a PDF file
+    
+    The PDF is either uploaded (POST; GET with a body still works) or
+    referenced without uploading it again: ``job_id`` for the result of a
+    finished job, ``result_key`` for a result the server still caches (the
+    X-Result-Key header of merge and page split responses). Only the
+    trailer, cross-reference table and catalog are read, so large files
+    take about as long as small ones.
+    """
     try:
-        if not file.filename.lower().endswith('.pdf'):
-            raise HTTPException(status_code=400, detail="File must be a PDF")
+        if sum(source is not None for source in (job_id, result_key, file)) != 1:
+            raise HTTPException(status_code=400, detail="Provide exactly one of file, job_id or result_key")
         
-        # Read the PDF file
-        pdf_content = await file.read()
-        pdf_reader = PdfReader(io.BytesIO(pdf_content))
+        with RequestFiles(UPLOAD_TMP_DIR, MAX_UPLOAD_BYTES) as request_files:
+            if file is not None:
+                if not file.filename.lower().endswith('.pdf'):
+                    raise HTTPException(status_code=400, detail="File must be a PDF")
+                filename = file.filename
+                # Spooled to disk; the worker then only reads the end of the file
+                source = await request_files.spool(file, '.pdf')
+            elif job_id is not None:
+                job = job_store.get(job_id)
+                if job is None or job.status != jobs.SUCCEEDED:
+                    raise HTTPException(status_code=404, detail="No finished job with that id")
+                if job.media_type != "application/pdf":
+                    raise HTTPException(status_code=400, detail="Job result is not a PDF")
+                filename, source = job.filename, job.result_path
+            else:
+                cached = await run_in_threadpool(result_cache.get, result_key)
+                if cached is None:
+                    raise HTTPException(status_code=404, detail="No cached result with that key")
+                if cached.media_type != "application/pdf":
+                    raise HTTPException(status_code=400, detail="Cached result is not a PDF")
+                filename = None
+                source = cached.data if cached.data is not None else cached.path
+            
+            info = await run_in_worker(processing.pdf_info, source)
         
-        return {
-            "filename": file.filename,
-            "page_count": len(pdf_reader.pages),
-            "file_size": len(pdf_content),
-            "metadata": pdf_reader.metadata if pdf_reader.metadata else {}
-        }
+        return {"filename": filename, **info}
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error getting PDF info: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error getting PDF info: {str(e)}")
 
 # Image Processing Routes
 @api_router.post("/image/rotate")
-async def rotate_image(rotation: int, file: UploadFile = File(...)):
-    """Rotate an image by specified degrees"""
+async def rotate_image(rotation: int, mode: str = "exact", file: UploadFile = File(...)):
+    """Rotate an image by specified degrees (mode: exact, exif or lossless)
+    
+    Right angles are done without resampling. For JPEGs, ``exif`` only
+    rewrites the orientation tag and ``lossless`` rotates with jpegtran when
+    installed; see processing.rotate_image. The X-Rotate-Path header tells
+    which of transpose, exif, jpegtran, resample or none was used.
+    """
     try:
         if not file.content_type.startswith('image/'):
             raise HTTPException(status_code=400, detail="File must be an image")
+        if mode not in processing.ROTATE_MODES:
+            raise HTTPException(status_code=400, detail="Mode must be 'exact', 'exif' or 'lossless'")
         
         # Read and process the image
-        image_content = await file.read()
-        image = Image.open(io.BytesIO(image_content))
-        
-        # Rotate the image
-        rotated_image = image.rotate(-rotation, expand=True)  # Negative for clockwise rotation
+        with metrics.stage("upload"):
+            image_content = await file.read()
+        cache_key = ResultCache.key(
+            "rotate", [hashlib.sha256(image_content).hexdigest()], {"rotation": rotation, "mode": mode}
+        )
+        cached = await run_in_threadpool(result_cache.get, cache_key)
         
-        # Save to output stream
-        output_stream = io.BytesIO()
-        image_format = image.format or 'PNG'
-        rotated_image.save(output_stream, format=image_format)
-        output_stream.seek(0)
+        if cached is None:
+            # Rotate the image in a worker process
+            rotated_image, image_format, rotate_path = await run_in_worker(
+                processing.rotate_image, image_content, rotation, mode
+            )
+            media_type = f"image/{image_format.lower()}"
+            headers = {"X-Rotate-Path": rotate_path}
+            await run_in_threadpool(result_cache.put, cache_key, media_type, rotated_image, None, headers)
         
         # Log the operation
         operation = ImageOperation(
             operation_type="rotate"
         )
-        await db.image_operations.insert_one(operation.dict())
+        audit_log.record("image_operations", operation)
+        
+        if cached is not None:
+            return cached_response(cached, f"rotated_{file.filename}")
         
         # Return the rotated image
         return StreamingResponse(
-            io.BytesIO(output_stream.read()),
-            media_type=f"image/{image_format.lower()}",
-            headers={"Content-Disposition": f"attachment; filename=rotated_{file.filename}"}
+            io.BytesIO(rotated_image),
+            media_type=media_type,
+            headers={**headers, "Content-Disposition": f"attachment; filename=rotated_{file.filename}"}
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error rotating image: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error rotating image: {str(e)}")
 
 @api_router.post("/image/resize")
-async def resize_image(width: int, height: int, file: UploadFile = File(...)):
-    """Resize an image to specified dimensions"""
+async def resize_image(width: int, height: int, mode: str = "exact", file: UploadFile = File(...)):
+    """Resize an image to specified dimensions (mode: exact or fast)"""
     try:
         if not file.content_type.startswith('image/'):
             raise HTTPException(status_code=400, detail="File must be an image")
+        if mode not in ("exact", "fast"):
+            raise HTTPException(status_code=400, detail="Mode must be 'exact' or 'fast'")
+        size_error = processing.output_size_error(width, height)
+        if size_error:
+            raise HTTPException(status_code=400, detail=size_error)
         
         # Read and process the image
-        image_content = await file.read()
-        image = Image.open(io.BytesIO(image_content))
-        
-        # Resize the image
-        resized_image = image.resize((width, height), Image.Resampling.LANCZOS)
+        with metrics.stage("upload"):
+            image_content = await file.read()
+        cache_key = ResultCache.key(
+            "resize", [hashlib.sha256(image_content).hexdigest()], {"width": width, "height": height, "mode": mode}
+        )
+        cached = await run_in_threadpool(result_cache.get, cache_key)
         
-        # Save to output stream
-        output_stream = io.BytesIO()
-        image_format = image.format or 'PNG'
-        resized_image.save(output_stream, format=image_format)
-        output_stream.seek(0)
+        if cached is None:
+            # Resize the image in a worker process
+            resized_image, image_format, resize_path = await run_in_worker(
+                processing.resize_image, image_content, width, height, mode
+            )
+            media_type = f"image/{image_format.lower()}"
+            headers = {"X-Resize-Path": resize_path}
+            await run_in_threadpool(result_cache.put, cache_key, media_type, resized_image, None, headers)
         
         # Log the operation
         operation = ImageOperation(
             operation_type="resize"
         )
-        await db.image_operations.insert_one(operation.dict())
+        audit_log.record("image_operations", operation)
+        
+        if cached is not None:
+            return cached_response(cached, f"resized_{file.filename}")
         
         # Return the resized image
         return StreamingResponse(
-            io.BytesIO(output_stream.read()),
-            media_type=f"image/{image_format.lower()}",
-            headers={"Content-Disposition": f"attachment; filename=resized_{file.filename}"}
+            io.BytesIO(resized_image),
+            media_type=media_type,
+            headers={**headers, "Content-Disposition": f"attachment; filename=resized_{file.filename}"}
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error resizing image: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error resizing image: {str(e)}")
 
+@api_router.post("/image/compress")
+async def compress_image(
+    format: Optional[str] = None,
+    quality: int = 85,
+    target_kb: Optional[int] = None,
+    file: UploadFile = File(...),
+):
+    """Compress an image, optionally to fit under target_kb kilobytes"""
+    try:
+        if not file.content_type.startswith('image/'):
+            raise HTTPException(status_code=400, detail="File must be an image")
+        image_format = format.upper() if format else None
+        if image_format == "JPG":
+            image_format = "JPEG"
+        if image_format is not None and image_format not in processing.COMPRESS_FORMATS:
+            raise HTTPException(status_code=400, detail="Format must be jpeg, webp or png")
+        if not processing.MIN_QUALITY <= quality <= processing.MAX_QUALITY:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Quality must be between {processing.MIN_QUALITY} and {processing.MAX_QUALITY}"
+            )
+        if target_kb is not None and target_kb < 1:
+            raise HTTPException(status_code=400, detail="Target size must be at least 1 KB")
+        
+        # Read and process the image
+        with metrics.stage("upload"):
+            image_content = await file.read()
+        cache_key = ResultCache.key(
+            "compress",
+            [hashlib.sha256(image_content).hexdigest()],
+            {"format": image_format, "quality": quality, "target_kb": target_kb},
+        )
+        cached = await run_in_threadpool(result_cache.get, cache_key)
+        
+        if cached is None:
+            # Compress the image in a worker process
+            target_bytes = target_kb * 1024 if target_kb is not None else None
+            compressed_image, image_format, used_quality = await run_in_worker(
+                processing.compress_image, image_content, image_format, quality, target_bytes
+            )
+            media_type = f"image/{image_format.lower()}"
+            headers = {
+                "X-Original-Size": str(len(image_content)),
+                "X-Compressed-Size": str(len(compressed_image)),
+                "X-Compress-Quality": str(used_quality) if used_quality is not None else "lossless",
+            }
+            if target_bytes is not None:
+                headers["X-Target-Met"] = "true" if len(compressed_image) <= target_bytes else "false"
+            await run_in_threadpool(result_cache.put, cache_key, media_type, compressed_image, None, headers)
+        
+        # Log the operation
+        operation = ImageOperation(
+            operation_type="compress"
+        )
+        audit_log.record("image_operations", operation)
+        
+        if cached is not None:
+            return cached_response(cached, f"compressed_{file.filename}")
+        
+        # Return the compressed image
+        return StreamingResponse(
+            io.BytesIO(compressed_image),
+            media_type=media_type,
+            headers={**headers, "Content-Disposition": f"attachment; filename=compressed_{file.filename}"}
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error compressing image: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error compressing image: {str(e)}")
+
+def batch_error_message(error: Exception) -> str:
+    """Describe why one file of a batch failed, for the manifest"""
+    if isinstance(error, JobTimeout):
+        return "Processing took too long and was abandoned"
+    if isinstance(error, PoolSaturated):
+        return "Server is busy processing other files"
+    if isinstance(error, UnidentifiedImageError):
+        return "File is not a supported image"
+    return str(error)
+
+async def image_batch_response(files: List[UploadFile], operation: str, fn, args: tuple, params: dict):
+    """Apply an image transform to every uploaded file (or ZIP member) and stream a ZIP back.
+
+    Results are added to the ZIP in the order they finish. Files that fail
+    are listed with the reason in manifest.json, the archive's last entry.
+    """
+    request_files = RequestFiles(UPLOAD_TMP_DIR, MAX_UPLOAD_BYTES)
+    archive = None
+    try:
+        uploads = [(file.filename, await request_files.spool(file)) for file in files]
+        if len(files) == 1 and batch.is_zip_upload(files[0].filename, files[0].content_type):
+            archive = await run_in_threadpool(zipfile.ZipFile, uploads[0][1])
+        sources = batch.batch_sources(uploads, archive, MAX_BATCH_FILES, MAX_BATCH_ENTRY_BYTES)
+    except (zipfile.BadZipFile, batch.BatchError) as e:
+        if archive is not None:
+            archive.close()
+        request_files.cleanup()
+        detail = "Invalid ZIP file" if isinstance(e, zipfile.BadZipFile) else str(e)
+        raise HTTPException(status_code=400, detail=detail)
+    except BaseException:
+        if archive is not None:
+            archive.close()
+        request_files.cleanup()
+        raise
+    
+    async def process(source: batch.BatchSource) -> bytes:
+        content = await run_in_threadpool(source.load)
+        result = await worker_pool.run_queued(fn, content, *args, max_wait=worker_pool.job_timeout)
+        audit_log.record("image_operations", ImageOperation(operation_type=operation))
+        return result[0]
+    
+    async def stream():
+        zip_stream = batch.ZipStream()
+        manifest_name = zip_stream.unique_name("manifest.json")
+        manifest = []
+        try:
+            async for source, data, error in batch.run_batch(sources, process, worker_pool.max_workers):
+                if error is not None:
+                    manifest.append({"file": source.name, "status": "error", "error": batch_error_message(error)})
+                    continue
+                name, chunk = await run_in_threadpool(zip_stream.add, source.name, data)
+                manifest.append({"file": source.name, "status": "ok", "output": name, "size": len(data)})
+                yield chunk
+            
+            failed = sum(1 for entry in manifest if entry["status"] == "error")
+            summary = {
+                "operation": operation,
+                "params": params,
+                "succeeded": len(manifest) - failed,
+                "failed": failed,
+                "files": manifest,
+            }
+            _, chunk = zip_stream.add(manifest_name, json.dumps(summary, indent=2).encode(), compress=True, reserved=True)
+            yield chunk + zip_stream.close()
+        finally:
+            if archive is not None:
+                archive.close()
+            request_files.cleanup()
+    
+    return StreamingResponse(
+        stream(),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename={operation}d_images.zip"}
+    )
+
+@api_router.post("/image/batch/rotate")
+async def rotate_images(rotation: int, mode: str = "exact", files: List[UploadFile] = File(...)):
+    """Rotate many images, or a ZIP of them, and stream back a ZIP (mode as for /image/rotate)"""
+    try:
+        if mode not in processing.ROTATE_MODES:
+            raise HTTPException(status_code=400, detail="Mode must be 'exact', 'exif' or 'lossless'")
+        return await image_batch_response(
+            files, "rotate", processing.rotate_image, (rotation, mode), {"rotation": rotation, "mode": mode}
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error rotating images: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error rotating images: {str(e)}")
+
+@api_router.post("/image/batch/resize")
+async def resize_images(width: int, height: int, mode: str = "exact", files: List[UploadFile] = File(...)):
+    """Resize many images, or a ZIP of them, and stream back a ZIP"""
+    try:
+        if mode not in ("exact", "fast"):
+            raise HTTPException(status_code=400, detail="Mode must be 'exact' or 'fast'")
+        size_error = processing.output_size_error(width, height)
+        if size_error:
+            raise HTTPException(status_code=400, detail=size_error)
+        return await image_batch_response(
+            files, "resize", processing.resize_image, (width, height, mode),
+            {"width": width, "height": height, "mode": mode}
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error resizing images: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error resizing images: {str(e)}")
+
+@api_router.post("/image/pipeline")
+async def image_pipeline(operations: str = Form(...), file: UploadFile = File(...)):
+    """Apply a chain of operations to an image with one decode and one encode
+    
+    ``operations`` is a JSON list such as ``[{"op": "rotate", "degrees": 90},
+    {"op": "resize", "width": 800, "height": 600}, {"op": "sepia"},
+    {"op": "compress", "quality": 80, "format": "webp"}]``. Supported ops:
+    rotate, resize, crop (left/top/right/bottom), grayscale, sepia,
+    brightness (amount, default 50) and compress (quality, format).
+    """
+    try:
+        if not file.content_type.startswith('image/'):
+            raise HTTPException(status_code=400, detail="File must be an image")
+        
+        try:
+            steps = processing.validate_pipeline(json.loads(operations))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Operations must be valid JSON")
+        except processing.ProcessingError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        with metrics.stage("upload"):
+            image_content = await file.read()
+        cache_key = ResultCache.key(
+            "pipeline", [hashlib.sha256(image_content).hexdigest()], {"operations": steps}
+        )
+        cached = await run_in_threadpool(result_cache.get, cache_key)
+        
+        if cached is None:
+            # Run every step in a worker process on the decoded image
+            edited_image, image_format = await run_in_worker(
+                processing.run_image_pipeline, image_content, steps
+            )
+            media_type = f"image/{image_format.lower()}"
+            await run_in_threadpool(result_cache.put, cache_key, media_type, edited_image)
+        
+        # Log the operation
+        operation = ImageOperation(
+            operation_type="pipeline",
+            filter_type=",".join(step["op"] for step in steps)
+        )
+        audit_log.record("image_operations", operation)
+        
+        if cached is not None:
+            return cached_response(cached, f"edited_{file.filename}")
+        
+        # Return the edited image
+        return StreamingResponse(
+            io.BytesIO(edited_image),
+            media_type=media_type,
+            headers={"Content-Disposition": f"attachment; filename=edited_{file.filename}"}
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error running image pipeline: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error running image pipeline: {str(e)}")
+
+# Job Routes
+def job_response(job: jobs.Job, status_code: int = 200) -> JSONResponse:
+    """Current state of a job, with links to follow it"""
+    state = job.to_dict()
+    state["links"] = {
+        "self": f"/api/jobs/{job.id}",
+        "events": f"/api/jobs/{job.id}/events",
+        "result": f"/api/jobs/{job.id}/result",
+    }
+    return JSONResponse(state, status_code=status_code, headers={"Location": state["links"]["self"]})
+
+async def submit_job(kind: str, files: List[UploadFile], suffix: str, work, on_success) -> JSONResponse:
+    """Spool the uploads into a new job's directory and start it; work(job, input_paths) does the rest"""
+    try:
+        job = job_store.create(kind)
+    except JobLimitReached as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(worker_pool.retry_after)})
+    try:
+        with RequestFiles(job.directory, MAX_UPLOAD_BYTES) as request_files:
+            input_paths = [await request_files.spool(file, suffix) for file in files]
+            request_files.detach()  # The job store deletes them with the job
+    except BaseException:
+        job_store.discard(job)
+        raise
+    job_store.start(job, lambda job: work(job, input_paths), on_success)
+    return job_response(job, status_code=202)
+
+@api_router.post("/jobs/pdf/merge", status_code=202)
+async def submit_merge_job(dedupe: bool = False, compress: bool = False, files: List[UploadFile] = File(...)):
+    """Start merging PDF files in the background (options as for /pdf/merge); returns the job to poll"""
+    try:
+        if len(files) < 2:
+            raise HTTPException(status_code=400, detail="At least 2 PDF files required for merging")
+        
+        for file in files:
+            if not file.filename.lower().endswith('.pdf'):
+                raise HTTPException(status_code=400, detail=f"File {file.filename} is not a PDF")
+        
+        async def work(job, input_paths):
+            job.output_path = job.path("merged_document.pdf")
+            job.details = await worker_pool.run_queued(
+                processing.merge_pdfs, input_paths, job.output_path, job.progress_path, dedupe, compress,
+                timeout=job_store.job_timeout
+            )
+            return job.output_path, "application/pdf", "merged_document.pdf"
+        
+        def on_success(job):
+            audit_log.record("pdf_operations", PDFOperation(operation_type="merge", file_count=len(files)))
+        
+        return await submit_job("pdf.merge", files, '.pdf', work, on_success)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error submitting merge job: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error submitting merge job: {str(e)}")
+
+@api_router.post("/jobs/pdf/split", status_code=202)
+async def submit_split_job(pages: str = "all", mode: str = "pages", file: UploadFile = File(...)):
+    """Start splitting a PDF into a ZIP of parts in the background; returns the job to poll"""
+    try:
+        if not file.filename.lower().endswith('.pdf'):
+            raise HTTPException(status_code=400, detail="File must be a PDF")
+        if mode not in ("pages", "ranges"):
+            raise HTTPException(status_code=400, detail="Mode must be 'pages' or 'ranges'")
+        filename = f"{Path(file.filename).stem}_pages.zip"
+        
+        async def work(job, input_paths):
+            job.output_path = job.path(filename)
+            await worker_pool.run_queued(
+                processing.split_pdf, input_paths[0], pages, mode, job.output_path, job.progress_path,
+                timeout=job_store.job_timeout
+            )
+            return job.output_path, "application/zip", filename
+        
+        def on_success(job):
+            audit_log.record("pdf_operations", PDFOperation(operation_type="split", file_count=1))
+        
+        return await submit_job("pdf.split", [file], '.pdf', work, on_success)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error submitting split job: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error submitting split job: {str(e)}")
+
+@api_router.post("/jobs/image/pipeline", status_code=202)
+async def submit_pipeline_job(operations: str = Form(...), file: UploadFile = File(...)):
+    """Start an image pipeline (see /image/pipeline) in the background; returns the job to poll"""
+    try:
+        if not file.content_type.startswith('image/'):
+            raise HTTPException(status_code=400, detail="File must be an image")
+        
+        try:
+            steps = processing.validate_pipeline(json.loads(operations))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Operations must be valid JSON")
+        except processing.ProcessingError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        async def work(job, input_paths):
+            image_content = await run_in_threadpool(Path(input_paths[0]).read_bytes)
+            edited_image, image_format = await worker_pool.run_queued(
+                processing.run_image_pipeline, image_content, steps, timeout=job_store.job_timeout
+            )
+            job.output_path = job.path(f"edited_{Path(file.filename).name}")
+            await run_in_threadpool(Path(job.output_path).write_bytes, edited_image)
+            return job.output_path, f"image/{image_format.lower()}", f"edited_{file.filename}"
+        
+        def on_success(job):
+            audit_log.record("image_operations", ImageOperation(
+                operation_type="pipeline",
+                filter_type=",".join(step["op"] for step in steps)
+            ))
+        
+        return await submit_job("image.pipeline", [file], Path(file.filename).suffix, work, on_success)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error submitting pipeline job: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error submitting pipeline job: {str(e)}")
+
+@api_router.get("/jobs/stats")
+async def get_job_stats():
+    """Get job counts by status and the disk used by kept results"""
+    return job_store.stats()
+
+def get_job_or_404(job_id: str) -> jobs.Job:
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return job
+
+@api_router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Get a job's status and progress (pages processed, bytes written)"""
+    return job_response(get_job_or_404(job_id))
+
+@api_router.get("/jobs/{job_id}/events")
+async def get_job_events(job_id: str):
+    """Follow a job as server-sent events; one event per state change until it finishes"""
+    job = get_job_or_404(job_id)
+    
+    async def events():
+        async for state in job_store.watch(job):
+            yield f"data: {json.dumps(state)}\n\n"
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@api_router.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    """Download a finished job's result"""
+    job = get_job_or_404(job_id)
+    if job.status in (jobs.QUEUED, jobs.RUNNING):
+        raise HTTPException(status_code=409, detail=f"Job is still {job.status}")
+    if job.status != jobs.SUCCEEDED:
+        raise HTTPException(status_code=410, detail=f"Job {job.status}: {job.error or 'result no longer available'}")
+    return FileResponse(
+        job.result_path,
+        media_type=job.media_type,
+        headers={"Content-Disposition": f"attachment; filename={job.filename}"}
+    )
+
+@api_router.delete("/jobs/{job_id}", status_code=204)
+async def delete_job(job_id: str):
+    """Cancel a job, or delete its result if it has finished"""
+    await job_store.cancel(get_job_or_404(job_id))
+    return Response(status_code=204)
+
 # Unit Conversion Routes
 @api_router.post("/convert", response_model=ConversionOperation)
 async def convert_units(
@@ -283,50 +1025,8 @@ async def convert_units(
 ):
     """Convert between different units"""
     try:
-        # Define conversion factors (base unit: meter for length, kilogram for weight, celsius for temperature)
-        conversions = {
-            "length": {
-                "US": {"meter": 1, "feet": 3.28084, "inch": 39.3701, "yard": 1.09361, "mile": 0.000621371},
-                "IN": {"meter": 1, "feet": 3.28084, "inch": 39.3701, "centimeter": 100, "kilometer": 0.001},
-                "CA": {"meter": 1, "feet": 3.28084, "inch": 39.3701, "kilometer": 0.001, "centimeter": 100},
-                "AU": {"meter": 1, "feet": 3.28084, "inch": 39.3701, "mile": 0.000621371, "kilometer": 0.001}
-            },
-            "weight": {
-                "US": {"kilogram": 1, "pound": 2.20462, "ounce": 35.274, "ton": 0.001},
-                "IN": {"kilogram": 1, "pound": 2.20462, "gram": 1000, "tonne": 0.001},
-                "CA": {"kilogram": 1, "pound": 2.20462, "gram": 1000, "tonne": 0.001},
-                "AU": {"kilogram": 1, "pound": 2.20462, "gram": 1000, "tonne": 0.001}
-            }
-        }
-        
-        # Special handling for temperature
-        if category == "temperature":
-            if from_unit == "fahrenheit" and to_unit == "celsius":
-                converted_value = (value - 32) * 5/9
-            elif from_unit == "celsius" and to_unit == "fahrenheit":
-                converted_value = value * 9/5 + 32
-            elif from_unit == "celsius" and to_unit == "kelvin":
-                converted_value = value + 273.15
-            elif from_unit == "kelvin" and to_unit == "celsius":
-                converted_value = value - 273.15
-            elif from_unit == "fahrenheit" and to_unit == "kelvin":
-                converted_value = (value - 32) * 5/9 + 273.15
-            elif from_unit == "kelvin" and to_unit == "fahrenheit":
-                converted_value = (value - 273.15) * 9/5 + 32
-            else:
-                converted_value = value  # Same unit
-        else:
-            if category not in conversions or country not in conversions[category]:
-                raise HTTPException(status_code=400, detail="Invalid category or country")
-            
-            unit_set = conversions[category][country]
-            
-            if from_unit not in unit_set or to_unit not in unit_set:
-                raise HTTPException(status_code=400, detail="Invalid units for this category/country")
-            
-            # Convert to base unit, then to target unit
-            base_value = value / unit_set[from_unit]
-            converted_value = base_value * unit_set[to_unit]
+        # A single lookup in the precompiled conversion table
+        converted_value = conversions.convert(category, from_unit, to_unit, value, country)
         
         # Create and save the conversion record
         conversion_operation = ConversionOperation(
@@ -338,96 +1038,437 @@ async def convert_units(
             country=country
         )
         
-        await db.conversion_operations.insert_one(conversion_operation.dict())
+        audit_log.record("conversion_operations", conversion_operation)
         
         return conversion_operation
         
-    except HTTPException:
-        raise
+    except conversions.ConversionError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error converting units: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error converting units: {str(e)}")
 
+BATCH_FIELDS = ("category", "from_unit", "to_unit", "country")
+
+def convert_batch_body(body: bytes, content_type: str, defaults: dict):
+    """Parse and convert a batch request body; returns (media_type, payload, groups)"""
+    if "csv" in content_type or "ndjson" in content_type or "jsonl" in content_type:
+        if "csv" in content_type:
+            frame = pd.read_csv(io.BytesIO(body))
+        else:
+            frame = pd.read_json(io.BytesIO(body), lines=True, dtype=False)
+        for column, value in defaults.items():
+            if column not in frame.columns and value is not None:
+                frame[column] = value
+        converted, groups = conversions.convert_table(frame)
+        
+        # One converted value per input row, in row order; echoing the input
+        # columns back would triple the response and its formatting time
+        lines = "\n".join(map(repr, converted.tolist()))
+        if "csv" in content_type:
+            return "text/csv", f"converted_value\n{lines}\n".encode(), groups
+        return "application/x-ndjson", f"{lines}\n".encode(), groups
+    
+    data = json.loads(body)
+    items = data.get("conversions", [data]) if isinstance(data, dict) else data
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        raise conversions.ConversionError("Body must be a conversion object or a list of them")
+    results = []
+    groups = []
+    for item in items:
+        params = {**defaults, **{field: item[field] for field in BATCH_FIELDS if field in item}}
+        if any(params.get(field) is None for field in BATCH_FIELDS):
+            raise conversions.ConversionError(f"Each conversion needs {', '.join(BATCH_FIELDS)}")
+        converted = conversions.convert_values(
+            params["category"], params["from_unit"], params["to_unit"], item.get("values", []), params["country"]
+        )
+        results.append({**params, "count": len(converted), "values": converted.tolist()})
+        groups.append((params["category"], params["from_unit"], params["to_unit"], params["country"], len(converted)))
+    return "application/json", json.dumps({"results": results}).encode(), groups
+
+@api_router.post("/convert/batch")
+async def convert_units_batch(
+    request: Request,
+    category: Optional[str] = None,
+    from_unit: Optional[str] = None,
+    to_unit: Optional[str] = None,
+    country: str = "US"
+):
+    """Convert many values in one vectorized pass
+    
+    Accepts a JSON body ``{"conversions": [{"category", "from_unit", "to_unit",
+    "country", "values": [...]}]}``, or CSV / NDJSON rows with category,
+    from_unit, to_unit, country and value columns. Query parameters fill in
+    any of those fields a group or row leaves out. CSV and NDJSON requests
+    get back one converted value per line, in row order. One operation is
+    logged per (category, from_unit, to_unit, country) group, not per value.
+    """
+    try:
+        body = await request.body()
+        content_type = request.headers.get("content-type", "application/json").lower()
+        defaults = {"category": category, "from_unit": from_unit, "to_unit": to_unit, "country": country}
+        
+        # Parsing a large body is slow enough that it should not block the loop
+        media_type, payload, groups = await run_in_threadpool(
+            convert_batch_body, body, content_type, defaults
+        )
+        
+        # Log one aggregated record per conversion group
+        for group_category, group_from_unit, group_to_unit, group_country, value_count in groups:
+            audit_log.record("conversion_operations", ConversionBatchOperation(
+                category=group_category,
+                from_unit=group_from_unit,
+                to_unit=group_to_unit,
+                country=group_country,
+                value_count=value_count
+            ))
+        
+        return Response(payload, media_type=media_type)
+        
+    except (conversions.ConversionError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid batch: {str(e)}")
+    except Exception as e:
+        logger.error(f"Error converting batch: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error converting batch: {str(e)}")
+
+def accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    """Whether an Accept-Encoding header allows gzip"""
+    for coding in (accept_encoding or "").lower().split(","):
+        name, _, params = coding.partition(";")
+        if name.strip() in ("gzip", "*"):
+            return params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+    return False
+
+@api_router.get("/convert/units")
+async def get_unit_registry(request: Request, v: Optional[str] = None):
+    """Get the unit registry, for converting on the client
+    
+    The document lists every unit as [offset, units per base unit] and the
+    units offered per country, with the formula that applies them; it only
+    changes when its ``version`` does. It is sent pre-gzipped when the
+    client accepts that, with a strong ETag and a day of max-age, or a year
+    and ``immutable`` when requested with ``v`` set to the current version.
+    """
+    gzipped = accepts_gzip(request.headers.get("accept-encoding"))
+    etag = f'"{conversions.REGISTRY_VERSION}-gzip"' if gzipped else f'"{conversions.REGISTRY_VERSION}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "public, max-age=31536000, immutable" if v == conversions.REGISTRY_VERSION
+        else "public, max-age=86400",
+        "Vary": "Accept-Encoding",
+        "X-Registry-Version": conversions.REGISTRY_VERSION,
+    }
+    
+    # Either encoding of the current version is still current
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        if "*" in tags or any(tag.strip('"').removesuffix("-gzip") == conversions.REGISTRY_VERSION for tag in tags):
+            return Response(status_code=304, headers=headers)
+    
+    if gzipped:
+        headers["Content-Encoding"] = "gzip"
+        return Response(conversions.REGISTRY_GZIP, media_type="application/json", headers=headers)
+    return Response(conversions.REGISTRY_JSON, media_type="application/json", headers=headers)
+
+@api_router.post("/convert/usage")
+async def report_conversion_usage(request: Request):
+    """Record conversions clients did locally, in bulk
+    
+    The body is ``{"registry_version", "reports": [{"category", "from_unit",
+    "to_unit", "country", "count"}]}``; it is read as JSON whatever its
+    content type, so browsers can send it with navigator.sendBeacon. Each
+    report counts ``count`` conversions; reports for the same conversion
+    are added up and logged as one record. Reports naming units the
+    registry does not offer are skipped and counted as rejected rather
+    than failing the batch.
+    """
+    try:
+        try:
+            report = ConversionUsageReport.model_validate_json(await request.body())
+        except ValidationError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid usage report: {str(e)}")
+        
+        totals = {}
+        rejected = 0
+        for item in report.reports:
+            key = (item.category, item.from_unit, item.to_unit, item.country)
+            try:
+                conversions.resolve(*key)
+            except conversions.ConversionError:
+                rejected += 1
+                continue
+            totals[key] = totals.get(key, 0) + item.count
+        
+        for (category, from_unit, to_unit, country), count in totals.items():
+            audit_log.record("conversion_operations", ConversionUsageOperation(
+                category=category,
+                from_unit=from_unit,
+                to_unit=to_unit,
+                country=country,
+                conversion_count=count,
+                registry_version=report.registry_version
+            ))
+        
+        return {
+            "accepted": len(report.reports) - rejected,
+            "rejected": rejected,
+            "conversions": sum(totals.values()),
+            "registry_version": conversions.REGISTRY_VERSION
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error recording conversion usage: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error recording conversion usage: {str(e)}")
+
+# Finance Routes
+FINANCE_FORMATS = {"json": "application/json", "ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+def finance_format(format: str) -> str:
+    if format not in FINANCE_FORMATS:
+        raise HTTPException(status_code=400, detail="Format must be 'json', 'ndjson' or 'csv'")
+    return format
+
+@api_router.post("/finance/compound")
+async def compound_interest_grid(grid_request: CompoundGridRequest, format: str = "json"):
+    """Compound interest for every combination of principal, rate, term and frequency
+    
+    Evaluates ``principal * (1 + rate/frequency) ** (frequency * years)`` for
+    the whole grid at once; rates are annual percentages. JSON responses hold
+    the axes and ``amount`` / ``interest`` arrays indexed [principal][rate]
+    [years][frequency]; ``format=ndjson`` or ``csv`` streams one row per
+    scenario instead. Results are memoized on the parameters.
+    """
+    format = finance_format(format)
+    try:
+        grid = await run_in_threadpool(
+            finance.compound_grid,
+            grid_request.principal, grid_request.rate, grid_request.years, grid_request.frequency
+        )
+        if format == "json":
+            return JSONResponse(grid)
+        rows = finance.grid_rows(grid)
+        return StreamingResponse(
+            finance.format_rows(rows, finance.GRID_COLUMNS, format), media_type=FINANCE_FORMATS[format]
+        )
+        
+    except finance.FinanceError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error computing compound interest: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error computing compound interest: {str(e)}")
+
+@api_router.get("/finance/amortization")
+async def amortization_schedule(
+    principal: float,
+    rate: float,
+    years: float,
+    frequency: int = 12,
+    format: str = "json"
+):
+    """Payment schedule of a fixed-payment loan
+    
+    ``rate`` is the annual percentage and ``frequency`` the payments per
+    year. JSON responses include the payment, totals and every row;
+    ``format=ndjson`` or ``csv`` streams just the rows (period, payment,
+    interest, principal, balance), with the payment and totals in
+    X-Payment, X-Total-Paid and X-Total-Interest headers.
+    """
+    format = finance_format(format)
+    try:
+        schedule = await run_in_threadpool(finance.amortization_schedule, principal, rate, years, frequency)
+        if format == "json":
+            return JSONResponse(finance.schedule_document(schedule))
+        filename = f"amortization.{format}"
+        return StreamingResponse(
+            finance.format_rows(schedule["rows"], finance.SCHEDULE_COLUMNS, format),
+            media_type=FINANCE_FORMATS[format],
+            headers={
+                "Content-Disposition": f"inline; filename={filename}",
+                "X-Payment": f"{schedule['payment']:.2f}",
+                "X-Total-Paid": f"{schedule['total_paid']:.2f}",
+                "X-Total-Interest": f"{schedule['total_interest']:.2f}",
+            }
+        )
+        
+    except finance.FinanceError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error computing amortization schedule: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error computing amortization schedule: {str(e)}")
+
+@api_router.get("/finance/stats")
+async def get_finance_stats():
+    """Get hit/miss counters of the memoized interest grids and schedules"""
+    return finance.stats()
+
+# Calculator Routes
+@api_router.post("/calc/evaluate")
+async def evaluate_expression(calculation: CalculationRequest):
+    """Evaluate a calculator expression, optionally for one or many values of x
+    
+    Expressions use numbers, ``x``, + - * / % // and ^ (power), the
+    constants pi, e and tau and functions such as sin, sqrt, log (base 10)
+    and ln. With a list of ``x`` values the whole list is evaluated in one
+    vectorized pass and ``result`` is a list. Undefined or infinite results
+    (1/0, log(-1)) are returned as null.
+    """
+    try:
+        compiled = expressions.compile_expression(calculation.expression)
+        if isinstance(calculation.x, list):
+            values = await run_in_threadpool(compiled.evaluate, calculation.x)
+            result = await run_in_threadpool(expressions.finite_or_none, values)
+        else:
+            result = expressions.finite_or_none([compiled.evaluate(calculation.x)])[0]
+        return JSONResponse({"expression": calculation.expression, "result": result})
+        
+    except expressions.ExpressionError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error evaluating expression: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error evaluating expression: {str(e)}")
+
+@api_router.get("/calc/plot")
+async def plot_expression(expression: str, start: float = -10.0, stop: float = 10.0, points: int = 1000):
+    """Evaluate an expression of x at evenly spaced points, for plotting
+    
+    Returns ``x`` and ``y`` lists of ``points`` values from ``start`` to
+    ``stop`` inclusive, computed in a single vectorized evaluation; points
+    where the expression is undefined are null in ``y``.
+    """
+    try:
+        return JSONResponse(await run_in_threadpool(expressions.plot, expression, start, stop, points))
+    except expressions.ExpressionError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error plotting expression: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error plotting expression: {str(e)}")
+
+@api_router.get("/calc/stats")
+async def get_calc_stats():
+    """Get hit/miss counters of the compiled-expression cache"""
+    return expressions.stats()
+
 # Analytics Routes
+async def analytics_buckets(collection: str, bucket: Optional[str], limit: int):
+    """Per-minute or per-hour breakdown of a collection's operations, if requested"""
+    if bucket is None:
+        return None
+    if bucket not in ("minute", "hour"):
+        raise HTTPException(status_code=400, detail="Bucket must be 'minute' or 'hour'")
+    return await operation_counters.buckets(db, collection, bucket, min(max(limit, 1), 1440))
+
 @api_router.get("/analytics/pdf")
-async def get_pdf_analytics():
+async def get_pdf_analytics(bucket: Optional[str] = None, limit: int = 60):
     """Get PDF operation analytics"""
     try:
-        total_operations = await db.pdf_operations.count_documents({})
-        merge_operations = await db.pdf_operations.count_documents({"operation_type": "merge"})
-        split_operations = await db.pdf_operations.count_documents({"operation_type": "split"})
-        
-        return {
-            "total_operations": total_operations,
-            "merge_operations": merge_operations,
-            "split_operations": split_operations
+        summary = await operation_counters.summary(db, "pdf_operations")
+        result = {
+            "total_operations": summary["total"],
+            "merge_operations": summary["by"].get("merge", 0),
+            "split_operations": summary["by"].get("split", 0)
         }
+        buckets = await analytics_buckets("pdf_operations", bucket, limit)
+        if buckets is not None:
+            result["buckets"] = buckets
+        return result
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error getting PDF analytics: {str(e)}")
         raise HTTPException(status_code=500, detail="Error getting analytics")
 
 @api_router.get("/analytics/image")
-async def get_image_analytics():
+async def get_image_analytics(bucket: Optional[str] = None, limit: int = 60):
     """Get image operation analytics"""
     try:
-        total_operations = await db.image_operations.count_documents({})
-        rotate_operations = await db.image_operations.count_documents({"operation_type": "rotate"})
-        resize_operations = await db.image_operations.count_documents({"operation_type": "resize"})
-        
-        return {
-            "total_operations": total_operations,
-            "rotate_operations": rotate_operations,
-            "resize_operations": resize_operations
+        summary = await operation_counters.summary(db, "image_operations")
+        result = {
+            "total_operations": summary["total"],
+            "rotate_operations": summary["by"].get("rotate", 0),
+            "resize_operations": summary["by"].get("resize", 0)
         }
+        buckets = await analytics_buckets("image_operations", bucket, limit)
+        if buckets is not None:
+            result["buckets"] = buckets
+        return result
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error getting image analytics: {str(e)}")
         raise HTTPException(status_code=500, detail="Error getting analytics")
 
 @api_router.get("/download/project")
-async def download_project():
-    """Download the entire project as a zip file"""
-    try:
-        # Create a temporary file to store the zip archive
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".zip") as tmp_zip:
-            # Create a ZipFile object
-            with zipfile.ZipFile(tmp_zip, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                # Walk through the project directory and add files to the zip
-                for root, dirs, files in os.walk(ROOT_DIR):
-                    for file in files:
-                        # Create a relative path for the files in the zip
-                        file_path = os.path.join(root, file)
-                        arcname = os.path.relpath(file_path, ROOT_DIR)
-                        zipf.write(file_path, arcname)
-
-            # Go to the beginning of the file
-            tmp_zip.seek(0)
-
-            # Stream the zip file as a response
-            return StreamingResponse(
-                iter([tmp_zip.read()]),
-                media_type="application/zip",
-                headers={"Content-Disposition": "attachment; filename=project.zip"}
-            )
-
+async def download_project(request: Request):
+    """Download the entire project as a zip file
+    
+    The archive is cached and only rebuilt (recompressing just the changed
+    files) when the tree changes. Supports If-None-Match and byte ranges.
+    """
+    try:
+        archive_path, archive_etag = await run_in_threadpool(project_archive.current)
+        etag = f'"{archive_etag}"'
+        headers = {
+            "ETag": etag,
+            "Accept-Ranges": "bytes",
+            "Cache-Control": "no-cache",
+            "Content-Disposition": "attachment; filename=project.zip"
+        }
+        
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and (if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]):
+            return Response(status_code=304, headers=headers)
+        
+        # Open now: a rebuild may replace the file, but this handle stays valid
+        source = open(archive_path, 'rb')
+        size = os.fstat(source.fileno()).st_size
+        byte_range = None
+        if request.headers.get("if-range") in (None, etag):
+            try:
+                byte_range = parse_byte_range(request.headers.get("range"), size)
+            except HTTPException:
+                source.close()
+                raise
+        
+        if byte_range is None:
+            headers["Content-Length"] = str(size)
+            return StreamingResponse(iter_file(source, 0, size), media_type="application/zip", headers=headers)
+        
+        start, end = byte_range
+        headers["Content-Length"] = str(end - start + 1)
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        return StreamingResponse(
+            iter_file(source, start, end - start + 1),
+            status_code=206,
+            media_type="application/zip",
+            headers=headers
+        )
+        
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error creating project zip: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error creating project zip: {str(e)}")
 
 @api_router.get("/analytics/conversions")
-async def get_conversion_analytics():
+async def get_conversion_analytics(bucket: Optional[str] = None, limit: int = 60):
     """Get unit conversion analytics"""
     try:
-        total_conversions = await db.conversion_operations.count_documents({})
-        length_conversions = await db.conversion_operations.count_documents({"category": "length"})
-        weight_conversions = await db.conversion_operations.count_documents({"category": "weight"})
-        temp_conversions = await db.conversion_operations.count_documents({"category": "temperature"})
-        
-        return {
-            "total_conversions": total_conversions,
-            "length_conversions": length_conversions,
-            "weight_conversions": weight_conversions,
-            "temperature_conversions": temp_conversions
+        summary = await operation_counters.summary(db, "conversion_operations")
+        result = {
+            "total_conversions": summary["total"],
+            "length_conversions": summary["by"].get("length", 0),
+            "weight_conversions": summary["by"].get("weight", 0),
+            "temperature_conversions": summary["by"].get("temperature", 0)
         }
+        buckets = await analytics_buckets("conversion_operations", bucket, limit)
+        if buckets is not None:
+            result["buckets"] = buckets
+        return result
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error getting conversion analytics: {str(e)}")
         raise HTTPException(status_code=500, detail="Error getting analytics")
@@ -435,6 +1476,33 @@ async def get_conversion_analytics():
 # Include the router in the main app
 app.include_router(api_router)
 
+# Sampling profiler for the server process, only when METRICS_PROFILE_INTERVAL is set
+profiler = metrics.SamplingProfiler.from_env()
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Request, stage and component metrics in the Prometheus text format"""
+    body = metrics.REGISTRY.render({
+        "worker_pool": worker_pool.stats(),
+        "result_cache": result_cache.stats(),
+        "audit": audit_log.stats(),
+        "jobs": job_store.stats(),
+        "storage": storage.stats(),
+        "finance": finance.stats(),
+        "expressions": expressions.stats(),
+    })
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/metrics/profile", include_in_schema=False)
+async def get_profile(reset: bool = False):
+    """Folded stacks sampled so far by the profiler (see METRICS_PROFILE_INTERVAL)"""
+    if profiler is None:
+        raise HTTPException(status_code=404, detail="Profiling is disabled; set METRICS_PROFILE_INTERVAL to enable it")
+    return PlainTextResponse(profiler.folded(reset), headers={
+        "X-Profile-Samples": str(profiler.samples),
+        "X-Profile-Dropped": str(profiler.dropped),
+    })
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -443,6 +1511,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Outermost, so its timings include everything the app does
+app.add_middleware(metrics.MetricsMiddleware)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -450,9 +1521,55 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Indexes the queries above rely on; create_index is a no-op if one exists
+INDEXES = {
+    "status_checks": [[("timestamp", 1), ("id", 1)], [("client_name", 1), ("timestamp", 1), ("id", 1)]],
+    "pdf_operations": [[("operation_type", 1)], [("timestamp", 1)]],
+    "image_operations": [[("operation_type", 1)], [("timestamp", 1)]],
+    "conversion_operations": [[("category", 1)], [("timestamp", 1)]],
+    "analytics_buckets": [[("collection", 1), ("granularity", 1), ("start", -1)]],
+}
+
+async def create_index(collection: str, keys) -> None:
+    try:
+        await db[collection].create_index(keys)
+    except Exception as e:
+        logger.error(f"Error creating index {keys} on {collection}: {str(e)}")
+
+@app.on_event("startup")
+async def create_indexes():
+    # Concurrently, so an unreachable database delays startup by one timeout, not one per index
+    await asyncio.gather(*(
+        create_index(collection, keys) for collection, index_keys in INDEXES.items() for keys in index_keys
+    ))
+
+@app.on_event("startup")
+async def start_audit_log():
+    try:
+        # Seed the analytics counters from existing records on first run
+        await operation_counters.bootstrap(db)
+    except Exception as e:
+        logger.error(f"Error bootstrapping analytics counters: {str(e)}")
+    audit_log.start()
+
+@app.on_event("startup")
+async def start_job_store():
+    job_store.start_sweeper()
+
+@app.on_event("startup")
+async def start_profiler():
+    if profiler is not None:
+        profiler.start()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
+    await job_store.stop()
+    if profiler is not None:
+        profiler.stop()
+    worker_pool.shutdown()
+    # Write any queued operation records before the connection goes away
+    await audit_log.stop()
+    await storage.close()
 
 if __name__ == "__main__":
     import uvicorn
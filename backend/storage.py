@@ -0,0 +1,428 @@
+"""Storage backends for status checks, operation records and analytics.
+
+The server only uses a small part of the Motor API: ``insert_one`` /
+``insert_many``, ``find`` with ``sort`` / ``limit`` / ``to_list`` or
+async iteration, ``find_one``, ``update_one`` with ``$inc`` / ``$set`` /
+``$setOnInsert`` and ``upsert``, a ``$group`` count (after an optional
+``$match``) through ``aggregate``, and ``create_index``. Every backend here offers that
+subset, so handlers, the audit log and the analytics counters work the
+same whichever one ``STORAGE_BACKEND`` selects:
+
+* ``mongo``: MongoDB through Motor, with pool size, timeouts and the
+  write concern of audit writes taken from the MONGO_* variables.
+* ``file``: in-memory collections whose writes are appended to a JSONL
+  journal and replayed at startup, for a single server process without
+  MongoDB.
+* ``memory``: in-memory collections, lost on restart.
+* ``none``: writes are discarded and reads come back empty, for running
+  the file and conversion tools with analytics switched off.
+
+Without STORAGE_BACKEND the backend is ``mongo`` if MONGO_URL is set and
+``memory`` otherwise. The in-memory backends keep at most
+``max_documents`` per collection (oldest dropped first), since operation
+records would otherwise grow without limit.
+"""
+import copy
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("mongo", "file", "memory", "none")
+
+# A journal is not compacted before it holds this many entries
+COMPACT_MIN_ENTRIES = 1000
+
+
+# Query evaluation for the in-memory collections
+def _matches(document, query):
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(_matches(document, branch) for branch in condition):
+                return False
+            continue
+        value = document.get(key)
+        if isinstance(condition, dict) and condition and all(op.startswith("$") for op in condition):
+            for op, operand in condition.items():
+                if op == "$exists":
+                    if (key in document) != operand:
+                        return False
+                elif value is None:
+                    return False
+                elif op == "$gt" and not value > operand:
+                    return False
+                elif op == "$gte" and not value >= operand:
+                    return False
+                elif op == "$lt" and not value < operand:
+                    return False
+                elif op == "$lte" and not value <= operand:
+                    return False
+        elif value != condition:
+            return False
+    return True
+
+
+def _project(document, projection):
+    if not projection:
+        return document
+    included = [key for key, flag in projection.items() if flag and key != "_id"]
+    result = {key: document[key] for key in included if key in document} if included else dict(document)
+    if projection.get("_id", 1) and "_id" in document:
+        result["_id"] = document["_id"]
+    else:
+        result.pop("_id", None)
+    return result
+
+
+def _summand(document, expression):
+    # A constant, or {"$ifNull": ["$field", default]}
+    if isinstance(expression, dict):
+        field, default = expression["$ifNull"]
+        value = document.get(field[1:])
+        return default if value is None else value
+    return expression
+
+
+class InMemoryCursor:
+    def __init__(self, documents, projection=None):
+        self._documents = documents
+        self._projection = projection
+        self._limit = 0
+
+    def sort(self, key_or_list, direction=1):
+        keys = key_or_list if isinstance(key_or_list, list) else [(key_or_list, direction)]
+        for key, key_direction in reversed(keys):
+            # Missing values sort first, as in MongoDB, instead of failing to compare with None
+            self._documents.sort(
+                key=lambda document: (document.get(key) is not None, document.get(key)), reverse=key_direction < 0
+            )
+        return self
+
+    def limit(self, limit):
+        self._limit = limit
+        return self
+
+    def _selected(self):
+        documents = self._documents[:self._limit] if self._limit else self._documents
+        return [_project(document, self._projection) for document in documents]
+
+    async def to_list(self, length=None):
+        documents = self._selected()
+        return documents[:length] if length else documents
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self._selected():
+            yield document
+
+
+class InMemoryCollection:
+    def __init__(self, max_documents: Optional[int] = None, journal: Optional[Callable[[Dict[str, Any]], None]] = None):
+        self.documents: List[Dict[str, Any]] = []
+        self.max_documents = max_documents
+        self._journal = journal
+
+    # Writes go through these, which are also what a journal replay calls
+    def _insert(self, documents) -> None:
+        self.documents.extend(copy.deepcopy(dict(document)) for document in documents)
+        self._trim()
+
+    def _trim(self) -> None:
+        # Oldest first, the same for inserted records and upserted counters
+        if self.max_documents is not None and len(self.documents) > self.max_documents:
+            del self.documents[:len(self.documents) - self.max_documents]
+
+    def _update(self, query, update, upsert) -> None:
+        target = next((document for document in self.documents if _matches(document, query)), None)
+        if target is None:
+            if not upsert:
+                return
+            target = {key: value for key, value in query.items() if not isinstance(value, dict)}
+            target.update(copy.deepcopy(update.get("$setOnInsert", {})))
+            self.documents.append(target)
+            self._trim()
+        for path, delta in update.get("$inc", {}).items():
+            *parents, leaf = path.split(".")
+            node = target
+            for parent in parents:
+                node = node.setdefault(parent, {})
+            node[leaf] = node.get(leaf, 0) + delta
+        for key, value in update.get("$set", {}).items():
+            target[key] = copy.deepcopy(value)
+
+    async def insert_one(self, document):
+        if "_id" in document and any(existing.get("_id") == document["_id"] for existing in self.documents):
+            raise ValueError(f"Duplicate _id {document['_id']!r}")
+        self._insert([document])
+        if self._journal is not None:
+            self._journal({"op": "insert", "documents": [document]})
+
+    async def insert_many(self, documents, ordered=True):
+        documents = list(documents)
+        self._insert(documents)
+        if self._journal is not None:
+            self._journal({"op": "insert", "documents": documents})
+
+    async def find_one(self, query, projection=None):
+        for document in self.documents:
+            if _matches(document, query):
+                return _project(copy.deepcopy(document), projection)
+        return None
+
+    def find(self, query=None, projection=None):
+        matching = [copy.deepcopy(document) for document in self.documents if _matches(document, query or {})]
+        return InMemoryCursor(matching, projection)
+
+    async def count_documents(self, query):
+        return sum(1 for document in self.documents if _matches(document, query))
+
+    async def update_one(self, query, update, upsert=False):
+        self._update(query, update, upsert)
+        if self._journal is not None:
+            self._journal({"op": "update", "query": query, "update": update, "upsert": upsert})
+
+    def aggregate(self, pipeline):
+        # Only a {"$group": {"_id": "$field", "n": {"$sum": ...}}} stage, optionally
+        # after a $match, is needed
+        documents = self.documents
+        if "$match" in pipeline[0]:
+            documents = [document for document in documents if _matches(document, pipeline[0]["$match"])]
+            pipeline = pipeline[1:]
+        group = pipeline[0]["$group"]
+        field = group["_id"][1:]
+        counts = {}
+        for document in documents:
+            counts[document.get(field)] = counts.get(document.get(field), 0) + _summand(document, group["n"]["$sum"])
+        return InMemoryCursor([{"_id": value, "n": count} for value, count in counts.items()])
+
+    async def create_index(self, keys, **kwargs):
+        return "_".join(f"{key}_{direction}" for key, direction in keys)
+
+
+class NullCollection(InMemoryCollection):
+    """Accepts every write and keeps nothing"""
+
+    def _insert(self, documents) -> None:
+        pass
+
+    def _update(self, query, update, upsert) -> None:
+        pass
+
+
+class InMemoryDatabase:
+    collection_class = InMemoryCollection
+
+    def __init__(self, max_documents: Optional[int] = None):
+        self.max_documents = max_documents
+        self._collections: Dict[str, InMemoryCollection] = {}
+
+    def _create(self, name: str) -> InMemoryCollection:
+        return self.collection_class(self.max_documents)
+
+    def __getitem__(self, name):
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._collections[name] = self._create(name)
+        return collection
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"documents": sum(len(collection.documents) for collection in self._collections.values())}
+
+
+class NullDatabase(InMemoryDatabase):
+    collection_class = NullCollection
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return {"$date": value.isoformat()}
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _decode(value):
+    if len(value) == 1 and "$date" in value:
+        return datetime.fromisoformat(value["$date"])
+    return value
+
+
+class JournalDatabase(InMemoryDatabase):
+    """In-memory collections backed by an append-only JSONL journal.
+
+    Each write is appended as one line and flushed; opening the database
+    replays the journal. Whenever the journal holds more than twice as many
+    entries (inserted documents and updates) as there are live documents,
+    because of repeated upserts and records dropped by the cap, it is
+    rewritten as one insert per collection, at open and while running.
+    """
+
+    def __init__(self, path: str, max_documents: Optional[int] = None):
+        super().__init__(max_documents)
+        self.path = path
+        self._file = None
+        self._lines = 0
+        self._entries = 0  # Documents inserted plus updates applied, since the last compaction
+        self._compactions = 0
+        self._replaying = False
+
+    def _create(self, name: str) -> InMemoryCollection:
+        return self.collection_class(self.max_documents, lambda entry: self._append(name, entry))
+
+    def _append(self, collection: str, entry: Dict[str, Any]) -> None:
+        if self._replaying:
+            return
+        self._file.write(json.dumps({"collection": collection, **entry}, default=_encode) + "\n")
+        self._file.flush()
+        self._lines += 1
+        self._entries += len(entry["documents"]) if entry["op"] == "insert" else 1
+        if self._needs_compaction():
+            self._file.close()
+            self._compact()
+            self._file = open(self.path, "a", encoding="utf-8")
+
+    def _needs_compaction(self) -> bool:
+        return self._entries > 2 * max(self.stats()["documents"], COMPACT_MIN_ENTRIES)
+
+    def open(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self.path):
+            self._replay()
+        if self._needs_compaction():
+            self._compact()
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def _replay(self) -> None:
+        self._replaying = True
+        try:
+            with open(self.path, encoding="utf-8") as journal:
+                for number, line in enumerate(journal, 1):
+                    try:
+                        entry = json.loads(line, object_hook=_decode)
+                    except ValueError:
+                        # A crash can leave a torn last line; skip it rather than refuse to start
+                        logger.error(f"Skipping unreadable line {number} of storage journal {self.path}")
+                        continue
+                    collection = self[entry["collection"]]
+                    if entry["op"] == "insert":
+                        collection._insert(entry["documents"])
+                        self._entries += len(entry["documents"])
+                    elif entry["op"] == "update":
+                        collection._update(entry["query"], entry["update"], entry["upsert"])
+                        self._entries += 1
+                    self._lines += 1
+        finally:
+            self._replaying = False
+
+    def _compact(self) -> None:
+        partial = f"{self.path}.partial"
+        with open(partial, "w", encoding="utf-8") as journal:
+            for name, collection in self._collections.items():
+                if collection.documents:
+                    line = {"collection": name, "op": "insert", "documents": collection.documents}
+                    journal.write(json.dumps(line, default=_encode) + "\n")
+        os.replace(partial, self.path)
+        self._lines = sum(1 for collection in self._collections.values() if collection.documents)
+        self._entries = self.stats()["documents"]
+        self._compactions += 1
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {**super().stats(), "journal_lines": self._lines, "journal_compactions": self._compactions}
+
+
+def _write_concern(value: str):
+    from pymongo import WriteConcern
+
+    w = int(value) if value.isdigit() else value
+    timeout = os.environ.get('MONGO_AUDIT_WTIMEOUT_MS')
+    return WriteConcern(w=w, wtimeout=int(timeout) if timeout else None)
+
+
+class Storage:
+    """The database the server uses, plus the one audit records are written through.
+
+    ``audit_database`` is the same database, except that with MongoDB it
+    may carry a weaker write concern (MONGO_AUDIT_WRITE_CONCERN, e.g. 0 for
+    unacknowledged writes) so audit flushes do not wait on the server.
+    """
+
+    def __init__(self, backend: str, database: Any, audit_database: Any = None, client: Any = None,
+                 settings: Optional[Dict[str, Any]] = None):
+        self.backend = backend
+        self.database = database
+        self.audit_database = database if audit_database is None else audit_database
+        self.settings = settings or {}
+        self._client = client
+
+    @classmethod
+    def from_env(cls, default_dir: str) -> "Storage":
+        """Build the storage selected by STORAGE_BACKEND (see the module docstring)"""
+        backend = os.environ.get('STORAGE_BACKEND') or ('mongo' if os.environ.get('MONGO_URL') else 'memory')
+        if backend not in BACKENDS:
+            raise ValueError(f"STORAGE_BACKEND must be one of {', '.join(BACKENDS)}, not '{backend}'")
+        max_documents = int(os.environ.get('STORAGE_MAX_DOCUMENTS', 100000))
+
+        if backend == 'mongo':
+            return cls.mongo(os.environ['MONGO_URL'], os.environ.get('DB_NAME', 'mobile_tools'))
+        if backend == 'file':
+            path = os.environ.get('STORAGE_FILE') or os.path.join(default_dir, 'storage.jsonl')
+            database = JournalDatabase(path, max_documents)
+            database.open()
+            return cls(backend, database, settings={"path": path, "max_documents": max_documents})
+        if backend == 'memory':
+            if not os.environ.get('STORAGE_BACKEND'):
+                logger.warning("MONGO_URL is not set; status checks and analytics are kept in memory only")
+            return cls(backend, InMemoryDatabase(max_documents), settings={"max_documents": max_documents})
+        return cls(backend, NullDatabase())
+
+    @classmethod
+    def mongo(cls, url: str, name: str) -> "Storage":
+        """MongoDB through Motor, with pool and timeout settings from the MONGO_* variables"""
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        settings = {
+            "maxPoolSize": int(os.environ.get('MONGO_MAX_POOL_SIZE', 100)),
+            "minPoolSize": int(os.environ.get('MONGO_MIN_POOL_SIZE', 0)),
+            # Fail fast when the server is unreachable instead of pymongo's default 30s
+            "serverSelectionTimeoutMS": int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000)),
+            "connectTimeoutMS": int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', 5000)),
+            "waitQueueTimeoutMS": int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', 5000)),
+        }
+        socket_timeout = os.environ.get('MONGO_SOCKET_TIMEOUT_MS')
+        if socket_timeout:
+            settings["socketTimeoutMS"] = int(socket_timeout)
+        client = AsyncIOMotorClient(url, **settings)
+
+        audit_database = None
+        write_concern = os.environ.get('MONGO_AUDIT_WRITE_CONCERN')
+        if write_concern:
+            audit_database = client.get_database(name, write_concern=_write_concern(write_concern))
+            settings["auditWriteConcern"] = write_concern
+        return cls("mongo", client[name], audit_database, client=client, settings=settings)
+
+    async def close(self) -> None:
+        if self._client is not None:
+            self._client.close()
+        if isinstance(self.database, JournalDatabase):
+            self.database.close()
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {"backend": self.backend, **self.settings}
+        if isinstance(self.database, InMemoryDatabase):
+            stats.update(self.database.stats())
+        return stats
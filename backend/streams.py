@@ -0,0 +1,195 @@
+"""Disk-backed handling of uploaded and generated files.
+
+Request bodies are copied to named temporary files in fixed-size chunks
+rather than read into memory, so the memory a request needs does not grow
+with the size of its uploads. The worker processes read those files by
+path and write their output next to them, and the output is streamed back
+from disk. ``RequestFiles`` owns every temporary file of one request and
+removes them once the response has been sent (or the request failed).
+"""
+import asyncio
+import hashlib
+import os
+import tempfile
+from typing import BinaryIO, Callable, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.background import BackgroundTask
+
+import metrics
+
+CHUNK_SIZE = 1024 * 1024
+FOLLOW_INTERVAL = 0.05
+
+
+def parse_byte_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single-range ``Range: bytes=...`` header into (start, end) inclusive.
+
+    Returns None when the whole file should be sent (no header, or a
+    multi-range request, which we answer in full).
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start, _, end = header[len("bytes="):].strip().partition("-")
+    try:
+        if start:
+            first = int(start)
+            last = int(end) if end else size - 1
+        else:
+            # Suffix range: the last N bytes
+            first = max(size - int(end), 0)
+            last = size - 1
+    except ValueError:
+        return None
+    if first >= size or first > last:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"},
+        )
+    return first, min(last, size - 1)
+
+
+async def iter_file(source: BinaryIO, start: int, length: int):
+    """Yield ``length`` bytes of an open file from ``start``, then close it"""
+    try:
+        source.seek(start)
+        while length > 0:
+            chunk = await run_in_threadpool(source.read, min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        source.close()
+
+
+async def wait_for_output(path: str, job: asyncio.Future) -> None:
+    """Wait until a job has written its first bytes to path, or has finished"""
+    while not job.done() and os.path.getsize(path) == 0:
+        await asyncio.sleep(FOLLOW_INTERVAL)
+
+
+class RequestFiles:
+    def __init__(self, directory: Optional[str] = None, max_bytes: Optional[int] = None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.paths: List[str] = []
+        self.digests: Dict[str, str] = {}  # SHA-256 of each spooled upload
+        self._handed_off = False
+
+    def __enter__(self) -> "RequestFiles":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        # Once a response owns the files it cleans them up after sending
+        if not self._handed_off:
+            self.cleanup()
+
+    def new_path(self, suffix: str = "") -> str:
+        """Reserve a new, empty temporary file owned by this request"""
+        fd, path = tempfile.mkstemp(suffix=suffix, dir=self.directory)
+        os.close(fd)
+        self.paths.append(path)
+        return path
+
+    async def spool(self, upload: UploadFile, suffix: str = "") -> str:
+        """Copy an upload to a temporary file in chunks and return its path"""
+        path = self.new_path(suffix)
+        with metrics.stage("upload"):
+            self.total_bytes += await run_in_threadpool(self._copy, upload.file, path)
+        return path
+
+    def _copy(self, source, path: str) -> int:
+        source.seek(0)
+        remaining = None if self.max_bytes is None else self.max_bytes - self.total_bytes
+        written = 0
+        digest = hashlib.sha256()
+        with open(path, "wb") as target:
+            while True:
+                chunk = source.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if remaining is not None and written > remaining:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"Upload exceeds the limit of {self.max_bytes} bytes"
+                    )
+                target.write(chunk)
+                digest.update(chunk)
+        self.digests[path] = digest.hexdigest()
+        return written
+
+    def detach(self) -> List[str]:
+        """Hand the files over to a new owner, which becomes responsible for deleting them"""
+        self._handed_off = True
+        return list(self.paths)
+
+    def response(
+        self, path: str, media_type: str, filename: str, headers: Optional[Dict[str, str]] = None
+    ) -> FileResponse:
+        """Stream a file back from disk and delete this request's files afterwards"""
+        self._handed_off = True
+        return FileResponse(
+            path,
+            media_type=media_type,
+            headers={**(headers or {}), "Content-Disposition": f"attachment; filename={filename}"},
+            background=BackgroundTask(self.cleanup),
+        )
+
+    def follow(
+        self,
+        path: str,
+        job: asyncio.Future,
+        media_type: str,
+        filename: str,
+        on_complete: Optional[Callable[[], None]] = None,
+    ) -> StreamingResponse:
+        """Stream a file that a running job is still appending to.
+
+        The job must only ever append to the file. If it fails after
+        streaming has started the connection is aborted, so the client sees
+        a truncated download rather than a corrupt one passed off as whole.
+        ``on_complete`` runs once the whole file has been sent.
+        """
+        self._handed_off = True
+        return StreamingResponse(
+            self._follow(path, job, on_complete),
+            media_type=media_type,
+            headers={"Content-Disposition": f"attachment; filename={filename}"},
+        )
+
+    async def _follow(self, path: str, job: asyncio.Future, on_complete: Optional[Callable[[], None]]):
+        try:
+            with open(path, "rb") as source:
+                while True:
+                    # Check before reading so bytes written just before the
+                    # job finished are never missed
+                    finished = job.done()
+                    chunk = await run_in_threadpool(source.read, CHUNK_SIZE)
+                    if chunk:
+                        yield chunk
+                    elif finished:
+                        job.result()
+                        if on_complete is not None:
+                            await run_in_threadpool(on_complete)
+                        break
+                    else:
+                        await asyncio.sleep(FOLLOW_INTERVAL)
+        finally:
+            if job.done():
+                self.cleanup()
+            else:
+                job.add_done_callback(lambda _: self.cleanup())
+
+    def cleanup(self) -> None:
+        for path in self.paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self.paths = []
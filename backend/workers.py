@@ -0,0 +1,192 @@
+"""Bounded process pool for CPU-bound request work.
+
+PyPDF2 and Pillow hold the GIL for most of their work, so running them on
+the event loop (or in the default thread pool) stalls every other request
+served by the same uvicorn worker. ``WorkerPool`` pushes that work into a
+``ProcessPoolExecutor`` and bounds how much of it may be outstanding at
+once: at most ``max_workers`` jobs run and ``queue_size`` more wait. Any
+submission beyond that is rejected immediately with ``PoolSaturated`` so
+the API can answer 429 instead of queueing without limit.
+
+Jobs run through ``metrics.measured``, so the stage timings and page/pixel
+counts a transform records in its worker process come back with its
+result and are added to the server's metrics.
+"""
+import asyncio
+import multiprocessing
+import os
+import threading
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional
+
+import metrics
+
+
+class PoolSaturated(Exception):
+    """Raised when the pool already holds as many jobs as it may queue."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Worker pool is saturated, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class JobTimeout(Exception):
+    """Raised when a job does not finish within its timeout."""
+
+
+class WorkerPool:
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        queue_size: Optional[int] = None,
+        job_timeout: float = 120.0,
+        retry_after: int = 5,
+        start_method: str = "spawn",
+    ):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.queue_size = self.max_workers * 2 if queue_size is None else queue_size
+        self.job_timeout = job_timeout
+        self.retry_after = retry_after
+        self.start_method = start_method
+
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._killed: "weakref.WeakSet[ProcessPoolExecutor]" = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self._outstanding = 0
+        self._rejected = 0
+        self._timed_out = 0
+        self._completed = 0
+
+    @classmethod
+    def from_env(cls) -> "WorkerPool":
+        """Build a pool from the WORKER_* environment variables"""
+        max_workers = os.environ.get('WORKER_PROCESSES')
+        queue_size = os.environ.get('WORKER_QUEUE_SIZE')
+        return cls(
+            max_workers=int(max_workers) if max_workers else None,
+            queue_size=int(queue_size) if queue_size else None,
+            job_timeout=float(os.environ.get('WORKER_JOB_TIMEOUT', 120)),
+            retry_after=int(os.environ.get('WORKER_RETRY_AFTER', 5)),
+            start_method=os.environ.get('WORKER_START_METHOD', 'spawn'),
+        )
+
+    @property
+    def capacity(self) -> int:
+        return self.max_workers + self.queue_size
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # Created lazily so importing the app never forks worker processes
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context(self.start_method),
+            )
+        return self._executor
+
+    def _release(self, future) -> None:
+        # Runs on the executor's management thread once the job has really
+        # finished (or its process was killed), so a timed-out job keeps its
+        # slot until the process is free
+        with self._lock:
+            self._outstanding -= 1
+            self._completed += 1
+
+    def _submit(self, fn: Callable, args: tuple):
+        with self._lock:
+            if self._outstanding >= self.capacity:
+                self._rejected += 1
+                raise PoolSaturated(self.retry_after)
+            self._outstanding += 1
+
+        try:
+            executor = self._get_executor()
+            future = executor.submit(metrics.measured, fn, *args)
+        except Exception:
+            with self._lock:
+                self._outstanding -= 1
+            raise
+        future.add_done_callback(self._release)
+        return executor, future
+
+    def _discard(self, executor: ProcessPoolExecutor, kill: bool = False) -> None:
+        """Stop using an executor; with ``kill``, also end its processes
+
+        Killing the processes breaks the executor, which fails every job it
+        still holds with BrokenProcessPool, so their slots are released.
+        """
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+            if kill:
+                self._killed.add(executor)
+        # Taken before shutdown(), which forgets the processes
+        processes = list((executor._processes or {}).values()) if kill else []
+        executor.shutdown(wait=False)
+        for process in processes:
+            process.kill()
+
+    async def run(self, fn: Callable, *args, timeout: Optional[float] = None) -> Any:
+        """Run ``fn(*args)`` in a worker process and await its result
+
+        A running job cannot be cancelled, so one that times out is stopped
+        by killing the pool's processes and starting a new pool. Other jobs
+        lost with those processes are resubmitted once.
+        """
+        timeout = timeout or self.job_timeout
+        for attempt in range(2):
+            executor, future = self._submit(fn, args)
+            try:
+                with metrics.stage("worker"):
+                    result, collected = await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+            except asyncio.TimeoutError:
+                if not future.cancel():  # Only succeeds if the job has not started yet
+                    self._discard(executor, kill=True)
+                with self._lock:
+                    self._timed_out += 1
+                raise JobTimeout(f"Job did not finish within {timeout}s")
+            except BrokenProcessPool:
+                # A worker died (e.g. OOM-killed, or killed over another
+                # job's timeout); start a fresh pool for later jobs
+                self._discard(executor)
+                if attempt == 0 and executor in self._killed:
+                    continue
+                raise
+            metrics.record_worker(fn.__name__, collected)
+            return result
+
+    async def run_queued(
+        self,
+        fn: Callable,
+        *args,
+        timeout: Optional[float] = None,
+        max_wait: Optional[float] = None,
+        poll_interval: float = 0.1,
+    ) -> Any:
+        """Like run(), but wait up to ``max_wait`` seconds for room instead of failing at once"""
+        loop = asyncio.get_running_loop()
+        deadline = None if max_wait is None else loop.time() + max_wait
+        while True:
+            try:
+                return await self.run(fn, *args, timeout=timeout)
+            except PoolSaturated:
+                if deadline is not None and loop.time() > deadline:
+                    raise
+                await asyncio.sleep(poll_interval)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "queue_size": self.queue_size,
+                "outstanding": self._outstanding,
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "timed_out": self._timed_out,
+            }
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
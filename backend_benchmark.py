@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+"""Offline load benchmark for the backend API.
+
+Runs the FastAPI app in-process (httpx's ASGI transport, no network, no
+uvicorn) against the in-memory storage backend, drives concurrent
+requests at each endpoint with synthetic PDFs and images, and prints the
+results as JSON: throughput, latency percentiles and peak RSS of the server
+process and its worker processes.
+
+    python backend_benchmark.py --output results.json
+    python backend_benchmark.py --baseline results.json --fail-on-regression
+
+Every request gets its own generated input, so the result cache is cold and
+the numbers measure the real work; ``--warm-cache`` reuses one input per
+scenario to measure cache hits instead. Throughput and latency cover
+successful responses; errors such as 429 from a saturated worker pool are
+reported per status code.
+"""
+import argparse
+import asyncio
+import io
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).parent / "backend"
+
+
+# Synthetic inputs
+def synthetic_pdf(pages, seed):
+    from PyPDF2 import PageObject, PdfWriter
+    from PyPDF2.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+    pdf_writer = PdfWriter()
+    font = pdf_writer._add_object(DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject("/Helvetica"),
+    }))
+    for number in range(pages):
+        page = PageObject.create_blank_page(pdf_writer, 612, 792)
+        lines = "".join(
+            f"BT /F1 11 Tf 72 {720 - 14 * line} Td (Document {seed} page {number + 1} line {line}) Tj ET\n"
+            for line in range(40)
+        )
+        content = DecodedStreamObject()
+        content._data = lines.encode()
+        page[NameObject("/Contents")] = pdf_writer._add_object(content)
+        page[NameObject("/Resources")] = DictionaryObject({
+            NameObject("/Font"): DictionaryObject({NameObject("/F1"): font})
+        })
+        pdf_writer.add_page(page)
+    output = io.BytesIO()
+    pdf_writer.write(output)
+    return output.getvalue()
+
+
+def synthetic_image(width, height, seed, image_format="JPEG"):
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    # A smooth gradient plus noise compresses roughly like a photo
+    gradient = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+    noise = rng.normal(0, 24, (height, width, 3)).astype(np.float32)
+    pixels = np.clip(gradient + noise + seed % 64, 0, 255).astype(np.uint8)
+    output = io.BytesIO()
+    Image.fromarray(pixels, "RGB").save(output, image_format, quality=90)
+    return output.getvalue()
+
+
+# Scenarios: name -> builder(inputs, index) returning (method, url, request kwargs)
+def _pdf_files(inputs, index, count):
+    return [("files", (f"doc{n}.pdf", inputs.pdf(index * count + n), "application/pdf")) for n in range(count)]
+
+
+SCENARIOS = {
+    "status_list": lambda inputs, i: ("GET", "/api/status?limit=100", {}),
+    "convert": lambda inputs, i: (
+        "POST", f"/api/convert?category=length&from_unit=meter&to_unit=feet&value={i + 1}", {}
+    ),
+    "convert_batch": lambda inputs, i: ("POST", "/api/convert/batch", {"json": {"conversions": [{
+        "category": "temperature", "from_unit": "celsius", "to_unit": "fahrenheit", "country": "US",
+        "values": inputs.values(i),
+    }]}}),
+    "analytics_pdf": lambda inputs, i: ("GET", "/api/analytics/pdf", {}),
+    "pdf_merge": lambda inputs, i: ("POST", "/api/pdf/merge", {"files": _pdf_files(inputs, i, 2)}),
+    "pdf_merge_dedupe": lambda inputs, i: ("POST", "/api/pdf/merge?dedupe=true", {"files": _pdf_files(inputs, i, 2)}),
+    "pdf_split": lambda inputs, i: ("POST", "/api/pdf/split?pages=all", {"files": {"file": ("doc.pdf", inputs.pdf(i), "application/pdf")}}),
+    "pdf_info": lambda inputs, i: ("POST", "/api/pdf/info", {"files": {"file": ("doc.pdf", inputs.pdf(i), "application/pdf")}}),
+    "image_rotate": lambda inputs, i: ("POST", "/api/image/rotate?rotation=90", {"files": inputs.image_upload(i)}),
+    "image_resize": lambda inputs, i: ("POST", "/api/image/resize?width=640&height=480", {"files": inputs.image_upload(i)}),
+    "image_resize_fast": lambda inputs, i: (
+        "POST", "/api/image/resize?width=640&height=480&mode=fast", {"files": inputs.image_upload(i)}
+    ),
+    "image_compress": lambda inputs, i: ("POST", "/api/image/compress?target_kb=100", {"files": inputs.image_upload(i)}),
+    "image_pipeline": lambda inputs, i: ("POST", "/api/image/pipeline", {
+        "data": {"operations": json.dumps([{"op": "rotate", "degrees": 90}, {"op": "sepia"}])},
+        "files": inputs.image_upload(i),
+    }),
+}
+
+
+class Inputs:
+    """Generates inputs on first use; with ``reuse`` every index maps to the same one"""
+
+    def __init__(self, pdf_pages, image_size, batch_values, reuse):
+        self.pdf_pages = pdf_pages
+        self.image_size = image_size
+        self.batch_values = batch_values
+        self.reuse = reuse
+        self._pdfs = {}
+        self._images = {}
+
+    def pdf(self, index):
+        index = 0 if self.reuse else index
+        if index not in self._pdfs:
+            self._pdfs[index] = synthetic_pdf(self.pdf_pages, index)
+        return self._pdfs[index]
+
+    def image_upload(self, index):
+        index = 0 if self.reuse else index
+        if index not in self._images:
+            self._images[index] = synthetic_image(*self.image_size, seed=index)
+        return {"file": ("photo.jpg", self._images[index], "image/jpeg")}
+
+    def values(self, index):
+        offset = 0 if self.reuse else index
+        return [float(value + offset) for value in range(self.batch_values)]
+
+
+# Measurement
+class RssSampler:
+    """Samples the resident memory of this process and its children (Linux /proc)"""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak_server = 0
+        self.peak_workers = 0
+        self.peak_total = 0
+        self._task = None
+
+    @staticmethod
+    def _rss(pid):
+        try:
+            with open(f"/proc/{pid}/status") as status:
+                for line in status:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return 0
+
+    @staticmethod
+    def _children(pid):
+        try:
+            with open(f"/proc/{pid}/task/{pid}/children") as children:
+                return [int(child) for child in children.read().split()]
+        except OSError:
+            return []
+
+    def sample(self):
+        pid = os.getpid()
+        server = self._rss(pid)
+        workers = sum(self._rss(child) for child in self._children(pid))
+        self.peak_server = max(self.peak_server, server)
+        self.peak_workers = max(self.peak_workers, workers)
+        self.peak_total = max(self.peak_total, server + workers)
+
+    async def _run(self):
+        while True:
+            self.sample()
+            await asyncio.sleep(self.interval)
+
+    def __enter__(self):
+        self._task = asyncio.ensure_future(self._run())
+        return self
+
+    def __exit__(self, *exc):
+        self._task.cancel()
+        self.sample()
+
+    def result(self):
+        if not os.path.exists("/proc/self/status"):
+            # No /proc: fall back to the peak the kernel reports for this process
+            return {"server": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}
+        return {"server": self.peak_server, "workers": self.peak_workers, "total": self.peak_total}
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+async def run_scenario(client, name, inputs, requests, concurrency, warmup):
+    build = SCENARIOS[name]
+
+    async def send(index):
+        method, url, kwargs = build(inputs, index)
+        started = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        return time.perf_counter() - started, response.status_code
+
+    # Warm-up requests start the worker processes and are not counted
+    for index in range(warmup):
+        await send(requests + index)
+
+    # Build every input before the clock starts
+    for index in range(requests):
+        build(inputs, index)
+
+    latencies = []
+    statuses = {}
+    queue = iter(range(requests))
+
+    async def user():
+        for index in queue:
+            latency, status = await send(index)
+            statuses[status] = statuses.get(status, 0) + 1
+            # Rejections (e.g. 429 from a saturated worker pool) are fast and
+            # would flatter the percentiles; they are counted as errors instead
+            if status < 400:
+                latencies.append(latency)
+
+    with RssSampler() as rss:
+        started = time.perf_counter()
+        await asyncio.gather(*(user() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    errors = sum(count for status, count in statuses.items() if status >= 400)
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "status_codes": {str(status): count for status, count in sorted(statuses.items())},
+        "elapsed_s": round(elapsed, 4),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "latency_ms": {
+            "mean": round(1000 * sum(latencies) / len(latencies), 2) if latencies else None,
+            "p50": round(1000 * percentile(latencies, 0.50), 2) if latencies else None,
+            "p95": round(1000 * percentile(latencies, 0.95), 2) if latencies else None,
+            "p99": round(1000 * percentile(latencies, 0.99), 2) if latencies else None,
+            "max": round(1000 * latencies[-1], 2) if latencies else None,
+        },
+        "peak_rss_bytes": rss.result(),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Scenarios whose p95 latency or throughput got worse than baseline by more than tolerance"""
+    regressions = []
+    for name, current in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if previous is None:
+            continue
+        checks = [
+            ("p95_ms", previous["latency_ms"]["p95"], current["latency_ms"]["p95"], 1),
+            ("throughput_rps", previous["throughput_rps"], current["throughput_rps"], -1),
+        ]
+        for metric, before, after, worse in checks:
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            current.setdefault("baseline", {})[metric] = {"before": before, "after": after, "change": round(change, 4)}
+            if change * worse > tolerance:
+                regressions.append(f"{name} {metric}: {before} -> {after} ({change:+.1%})")
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).parent,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def benchmark(args):
+    os.environ["STORAGE_BACKEND"] = "memory"
+    os.environ["STORAGE_MAX_DOCUMENTS"] = str(max(args.status_rows, 100000))
+    if args.workers:
+        os.environ["WORKER_PROCESSES"] = str(args.workers)
+    sys.path.insert(0, str(BACKEND_DIR))
+    import httpx
+    import server
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    await server.db.status_checks.insert_many([
+        {"id": f"{n:08d}", "client_name": f"client-{n % 10}", "timestamp": datetime(2024, 1, 1, n // 3600 % 24, n // 60 % 60, n % 60)}
+        for n in range(args.status_rows)
+    ])
+
+    inputs = Inputs(args.pdf_pages, args.image_size, args.batch_values, args.warm_cache)
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "started_at": datetime.utcnow().isoformat() + "Z",
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "worker_processes": server.worker_pool.max_workers,
+            "params": {
+                "requests": args.requests,
+                "concurrency": args.concurrency,
+                "warmup": args.warmup,
+                "pdf_pages": args.pdf_pages,
+                "image_size": list(args.image_size),
+                "batch_values": args.batch_values,
+                "warm_cache": args.warm_cache,
+            },
+        },
+        "scenarios": {},
+    }
+
+    await server.app.router.startup()
+    try:
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+            for name in args.scenarios:
+                print(f"Running {name}...", file=sys.stderr)
+                results["scenarios"][name] = await run_scenario(
+                    client, name, inputs, args.requests, args.concurrency, args.warmup
+                )
+    finally:
+        await server.app.router.shutdown()
+    return results
+
+
+def parse_size(value):
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"comma-separated subset of: {', '.join(SCENARIOS)}")
+    parser.add_argument("--requests", type=int, default=40, help="timed requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=8, help="requests in flight at once")
+    parser.add_argument("--warmup", type=int, default=2, help="untimed requests before each scenario")
+    parser.add_argument("--workers", type=int, help="worker processes (default: WORKER_PROCESSES or CPU count)")
+    parser.add_argument("--pdf-pages", type=int, default=20, help="pages per synthetic PDF")
+    parser.add_argument("--image-size", type=parse_size, default=(1600, 1200), help="synthetic image size, WxH")
+    parser.add_argument("--batch-values", type=int, default=10000, help="values per conversion batch")
+    parser.add_argument("--status-rows", type=int, default=5000, help="status checks seeded into the database")
+    parser.add_argument("--warm-cache", action="store_true", help="reuse one input per scenario (measures cache hits)")
+    parser.add_argument("--output", help="write the JSON results here instead of stdout")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative regression (default 0.15)")
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit with status 1 on a regression")
+    args = parser.parse_args()
+
+    args.scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+    results = asyncio.run(benchmark(args))
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        results["regressions"] = regressions
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
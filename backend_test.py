@@ -2,6 +2,7 @@
 
 import requests
 import sys
+import time
 import json
 from datetime import datetime
 import io
@@ -152,7 +153,7 @@ startxref
 %%EOF"""
             return pdf_content
 
-    def create_test_image(self):
+    def create_test_image(self, image_format='PNG'):
         """Create a simple test image"""
         try:
             from PIL import Image
@@ -160,7 +161,7 @@ startxref
             # Create a simple 100x100 red image
             img = Image.new('RGB', (100, 100), color='red')
             buffer = io.BytesIO()
-            img.save(buffer, format='PNG')
+            img.save(buffer, format=image_format)
             buffer.seek(0)
             return buffer.getvalue()
         except ImportError:
@@ -225,6 +226,34 @@ startxref
         # Test PDF split
         files = {'file': ('test.pdf', pdf_content, 'application/pdf')}
         self.run_post_test("PDF Split", "pdf/split/1", files=files, expected_status=200)
+        
+        # Test PDF split into a ZIP of pages
+        files = {'file': ('test.pdf', pdf_content, 'application/pdf')}
+        self.run_post_test("PDF Split All Pages", "pdf/split?pages=all", files=files, expected_status=200)
+
+        # Test PDF merge as a background job, polling until it finishes
+        files = [
+            ('files', ('test1.pdf', pdf_content, 'application/pdf')),
+            ('files', ('test2.pdf', pdf_content, 'application/pdf'))
+        ]
+        url = f"{self.base_url}/api/jobs/pdf/merge"
+        try:
+            print(f"\n🔍 Testing PDF Merge Job...")
+            print(f"   URL: {url}")
+            response = requests.post(url, files=files, timeout=10)
+            success = response.status_code == 202
+            if success:
+                job_url = f"{self.base_url}/api/jobs/{response.json()['id']}"
+                for _ in range(30):
+                    job = requests.get(job_url, timeout=10).json()
+                    if job['status'] not in ('queued', 'running'):
+                        break
+                    time.sleep(1)
+                print(f"   Job: {job['status']}, progress {job['progress']}")
+                success = job['status'] == 'succeeded' and requests.get(f"{job_url}/result", timeout=10).status_code == 200
+            self.log_test("PDF Merge Job", success, f"Expected a succeeded job, got {response.status_code}")
+        except Exception as e:
+            self.log_test("PDF Merge Job", False, f"Exception: {str(e)}")
 
     def test_image_endpoints(self):
         """Test image processing endpoints"""
@@ -247,6 +276,19 @@ startxref
         except Exception as e:
             self.log_test("Image Rotate", False, f"Exception: {str(e)}")
         
+        # Right-angle JPEG rotation by rewriting the EXIF orientation
+        files = {'file': ('test.jpg', self.create_test_image('JPEG'), 'image/jpeg')}
+        url = f"{self.base_url}/api/image/rotate?rotation=90&mode=exif"
+        try:
+            print(f"\n🔍 Testing Image Rotate EXIF...")
+            print(f"   URL: {url}")
+            response = requests.post(url, files=files, timeout=30)
+            path = response.headers.get("X-Rotate-Path")
+            success = response.status_code == 200 and path == "exif"
+            self.log_test("Image Rotate EXIF", success, f"Expected 200 via exif, got {response.status_code} via {path}")
+        except Exception as e:
+            self.log_test("Image Rotate EXIF", False, f"Exception: {str(e)}")
+        
         # Test image resize - use query parameters
         files = {'file': ('test.png', image_content, 'image/png')}
         url = f"{self.base_url}/api/image/resize?width=50&height=50"
@@ -306,6 +348,42 @@ startxref
             self.log_test("Temperature Conversion", success, f"Expected 200, got {response.status_code}")
         except Exception as e:
             self.log_test("Temperature Conversion", False, f"Exception: {str(e)}")
+        
+        # Unit registry, then a revalidation with its ETag
+        success, response = self.run_get_test("Unit Registry", "convert/units")
+        if success:
+            etag = response.headers.get("ETag")
+            revalidated = requests.get(f"{self.base_url}/api/convert/units", headers={"If-None-Match": etag}, timeout=10)
+            self.log_test("Unit Registry Revalidation", revalidated.status_code == 304,
+                          f"Expected 304, got {revalidated.status_code}")
+        
+        self.run_post_test("Conversion Usage Report", "convert/usage", data={"reports": [
+            {"category": "length", "from_unit": "meter", "to_unit": "feet", "country": "US", "count": 3}
+        ]})
+
+    def test_finance_endpoints(self):
+        """Test interest grid and amortization endpoints"""
+        print("\n" + "="*50)
+        print("TESTING FINANCE ENDPOINTS")
+        print("="*50)
+        
+        self.run_post_test("Compound Interest Grid", "finance/compound", data={
+            "principal": [1000, 5000], "rate": [3, 5, 7], "years": [1, 5, 10], "frequency": [1, 12]
+        })
+        self.run_get_test("Amortization Schedule", "finance/amortization?principal=12000&rate=6&years=1")
+        self.run_get_test("Amortization Schedule CSV", "finance/amortization?principal=10000&rate=5&years=1&format=csv")
+
+    def test_calculator_endpoints(self):
+        """Test expression evaluation endpoints"""
+        print("\n" + "="*50)
+        print("TESTING CALCULATOR ENDPOINTS")
+        print("="*50)
+        
+        self.run_post_test("Evaluate Expression", "calc/evaluate", data={"expression": "sin(pi/4)^2 + log(100)"})
+        self.run_post_test("Evaluate Over X", "calc/evaluate", data={"expression": "x^2 - 1", "x": [0, 1, 2, 3]})
+        self.run_post_test("Reject Unsafe Expression", "calc/evaluate",
+                           data={"expression": "__import__('os').getcwd()"}, expected_status=400)
+        self.run_get_test("Plot Expression", "calc/plot?expression=sin(x)&start=0&stop=6.28&points=5")
 
     def run_all_tests(self):
         """Run all API tests"""
@@ -318,6 +396,8 @@ startxref
             self.test_pdf_endpoints()
             self.test_image_endpoints()
             self.test_conversion_endpoints()
+            self.test_finance_endpoints()
+            self.test_calculator_endpoints()
         except KeyboardInterrupt:
             print("\n⚠️ Tests interrupted by user")
         except Exception as e:
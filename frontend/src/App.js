@@ -1,4 +1,4 @@
-import React, { useState, useRef } from "react";
+import React, { useState, useRef, useEffect } from "react";
 import "./App.css";
 import { BrowserRouter, Routes, Route, useNavigate, Link } from "react-router-dom";
 import { 
@@ -354,58 +354,37 @@ const ImageEditor = () => {
     setRotation(prev => (prev + 90) % 360);
   };
 
-  const applyFilter = (filterType) => {
+  const applyFilter = async (filterType) => {
     if (!selectedImage || !canvasRef.current) return;
     
     setIsProcessing(true);
-    const canvas = canvasRef.current;
-    const ctx = canvas.getContext('2d');
-    const img = new Image();
     
-    img.onload = () => {
-      canvas.width = img.width;
-      canvas.height = img.height;
-      
-      // Apply rotation
-      ctx.save();
-      ctx.translate(canvas.width / 2, canvas.height / 2);
-      ctx.rotate((rotation * Math.PI) / 180);
-      ctx.drawImage(img, -img.width / 2, -img.height / 2);
-      ctx.restore();
-      
-      // Apply filter
-      const imageData = ctx.getImageData(0, 0, canvas.width, canvas.height);
-      const data = imageData.data;
-      
-      switch (filterType) {
-        case 'grayscale':
-          for (let i = 0; i < data.length; i += 4) {
-            const gray = data[i] * 0.299 + data[i + 1] * 0.587 + data[i + 2] * 0.114;
-            data[i] = data[i + 1] = data[i + 2] = gray;
-          }
-          break;
-        case 'sepia':
-          for (let i = 0; i < data.length; i += 4) {
-            const r = data[i], g = data[i + 1], b = data[i + 2];
-            data[i] = Math.min(255, r * 0.393 + g * 0.769 + b * 0.189);
-            data[i + 1] = Math.min(255, r * 0.349 + g * 0.686 + b * 0.168);
-            data[i + 2] = Math.min(255, r * 0.272 + g * 0.534 + b * 0.131);
-          }
-          break;
-        case 'brightness':
-          for (let i = 0; i < data.length; i += 4) {
-            data[i] = Math.min(255, data[i] + 50);
-            data[i + 1] = Math.min(255, data[i + 1] + 50);
-            data[i + 2] = Math.min(255, data[i + 2] + 50);
-          }
-          break;
-      }
+    // Rotation and filter run server-side in one decode/encode pass
+    const operations = [];
+    if (rotation) operations.push({ op: 'rotate', degrees: rotation });
+    operations.push({ op: filterType });
+    
+    const formData = new FormData();
+    formData.append('operations', JSON.stringify(operations));
+    formData.append('file', selectedImage);
+    
+    try {
+      const response = await fetch(`${BACKEND_URL}/api/image/pipeline`, {
+        method: 'POST',
+        body: formData
+      });
+      if (!response.ok) throw new Error(`Request failed with status ${response.status}`);
+      const bitmap = await createImageBitmap(await response.blob());
       
-      ctx.putImageData(imageData, 0, 0);
+      const canvas = canvasRef.current;
+      canvas.width = bitmap.width;
+      canvas.height = bitmap.height;
+      canvas.getContext('2d').drawImage(bitmap, 0, 0);
+    } catch (error) {
+      alert('Error applying filter: ' + error.message);
+    } finally {
       setIsProcessing(false);
-    };
-    
-    img.src = imagePreview;
+    }
   };
 
   const downloadImage = () => {
@@ -532,8 +511,67 @@ const ImageEditor = () => {
   );
 };
 
+// Unit registry, fetched once from the backend; conversions then run locally
+let unitRegistryRequest = null;
+
+const loadUnitRegistry = () => {
+  if (!unitRegistryRequest) {
+    unitRegistryRequest = fetch(`${BACKEND_URL}/api/convert/units`)
+      .then((response) => {
+        if (!response.ok) throw new Error(`Request failed with status ${response.status}`);
+        return response.json();
+      })
+      .catch((error) => {
+        unitRegistryRequest = null; // Retry on the next visit
+        throw error;
+      });
+  }
+  return unitRegistryRequest;
+};
+
+const unitsFor = (registry, category, country) => {
+  const spec = registry.categories[category];
+  return spec.countries ? spec.countries[country] || [] : Object.keys(spec.units);
+};
+
+// The formula the backend publishes with the registry, so results match /api/convert exactly
+const convertUnits = (registry, category, fromUnit, toUnit, value) => {
+  if (fromUnit === toUnit) return value;
+  const units = registry.categories[category].units;
+  const [fromOffset, fromPerBase] = units[fromUnit];
+  const [toOffset, toPerBase] = units[toUnit];
+  return (value + fromOffset) * (toPerBase / fromPerBase) - toOffset;
+};
+
+// Conversions are counted here and reported in bulk instead of one request each
+const USAGE_FLUSH_INTERVAL = 30000;
+const pendingUsage = {};
+
+const countUsage = (category, fromUnit, toUnit, country) => {
+  const key = [category, fromUnit, toUnit, country].join('|');
+  pendingUsage[key] = (pendingUsage[key] || 0) + 1;
+};
+
+const flushUsage = (registryVersion) => {
+  const reports = Object.entries(pendingUsage).map(([key, count]) => {
+    delete pendingUsage[key];
+    const [category, from_unit, to_unit, country] = key.split('|');
+    return { category, from_unit, to_unit, country, count };
+  });
+  if (!reports.length) return;
+  
+  // Sent as text/plain, which needs no CORS preflight, so sendBeacon also works while the page unloads
+  const url = `${BACKEND_URL}/api/convert/usage`;
+  const body = JSON.stringify({ registry_version: registryVersion, reports });
+  if (!(navigator.sendBeacon && navigator.sendBeacon(url, body))) {
+    fetch(url, { method: 'POST', body, keepalive: true }).catch(() => {});
+  }
+};
+
 // Unit Converter Component
 const UnitConverter = () => {
+  const [registry, setRegistry] = useState(null);
+  const [registryError, setRegistryError] = useState('');
   const [country, setCountry] = useState('US');
   const [category, setCategory] = useState('length');
   const [fromUnit, setFromUnit] = useState('');
@@ -548,46 +586,40 @@ const UnitConverter = () => {
     'AU': 'Australia'
   };
 
-  const units = {
-    length: {
-      US: { meter: 1, feet: 3.28084, inch: 39.3701, yard: 1.09361 },
-      IN: { meter: 1, feet: 3.28084, inch: 39.3701, centimeter: 100 },
-      CA: { meter: 1, feet: 3.28084, inch: 39.3701, kilometer: 0.001 },
-      AU: { meter: 1, feet: 3.28084, inch: 39.3701, mile: 0.000621371 }
-    },
-    weight: {
-      US: { kilogram: 1, pound: 2.20462, ounce: 35.274 },
-      IN: { kilogram: 1, pound: 2.20462, gram: 1000 },
-      CA: { kilogram: 1, pound: 2.20462, gram: 1000 },
-      AU: { kilogram: 1, pound: 2.20462, gram: 1000 }
-    },
-    temperature: {
-      US: { celsius: 1, fahrenheit: (c) => c * 9/5 + 32 },
-      IN: { celsius: 1, fahrenheit: (c) => c * 9/5 + 32 },
-      CA: { celsius: 1, fahrenheit: (c) => c * 9/5 + 32 },
-      AU: { celsius: 1, fahrenheit: (c) => c * 9/5 + 32 }
-    }
-  };
+  useEffect(() => {
+    let active = true;
+    loadUnitRegistry()
+      .then((loaded) => active && setRegistry(loaded))
+      .catch((error) => active && setRegistryError(error.message));
+    return () => { active = false; };
+  }, []);
+
+  useEffect(() => {
+    if (!registry) return undefined;
+    const flush = () => flushUsage(registry.version);
+    const flushWhenHidden = () => {
+      if (document.visibilityState === 'hidden') flush();
+    };
+    const timer = setInterval(flush, USAGE_FLUSH_INTERVAL);
+    document.addEventListener('visibilitychange', flushWhenHidden);
+    return () => {
+      clearInterval(timer);
+      document.removeEventListener('visibilitychange', flushWhenHidden);
+      flush();
+    };
+  }, [registry]);
+
+  const categories = registry ? Object.keys(registry.categories) : [];
+  const availableUnits = registry ? unitsFor(registry, category, country) : [];
 
   const convert = () => {
-    if (!inputValue || !fromUnit || !toUnit) return;
+    if (!registry || !inputValue || !fromUnit || !toUnit) return;
+    if (!availableUnits.includes(fromUnit) || !availableUnits.includes(toUnit)) return;
     
     const value = parseFloat(inputValue);
-    const unitSet = units[category][country];
-    
-    if (category === 'temperature') {
-      if (fromUnit === 'fahrenheit' && toUnit === 'celsius') {
-        setResult(((value - 32) * 5/9).toFixed(2));
-      } else if (fromUnit === 'celsius' && toUnit === 'fahrenheit') {
-        setResult((value * 9/5 + 32).toFixed(2));
-      } else {
-        setResult(value.toString());
-      }
-    } else {
-      const baseValue = value / unitSet[fromUnit];
-      const convertedValue = baseValue * unitSet[toUnit];
-      setResult(convertedValue.toFixed(4));
-    }
+    const convertedValue = convertUnits(registry, category, fromUnit, toUnit, value);
+    setResult(convertedValue.toFixed(category === 'temperature' ? 2 : 4));
+    countUsage(category, fromUnit, toUnit, country);
   };
 
   return (
@@ -604,6 +636,12 @@ const UnitConverter = () => {
             </Link>
           </div>
 
+          {registryError && (
+            <div className="mb-6 p-3 rounded-lg bg-red-50 text-red-700">
+              Could not load units: {registryError}
+            </div>
+          )}
+
           {/* Country Selector */}
           <div className="mb-6">
             <h3 className="font-semibold text-gray-800 mb-3">Select Country</h3>
@@ -629,7 +667,7 @@ const UnitConverter = () => {
           <div className="mb-6">
             <h3 className="font-semibold text-gray-800 mb-3">Category</h3>
             <div className="flex space-x-3">
-              {Object.keys(units).map((cat) => (
+              {categories.map((cat) => (
                 <button
                   key={cat}
                   onClick={() => setCategory(cat)}
@@ -655,7 +693,7 @@ const UnitConverter = () => {
                 className="w-full p-3 border border-gray-300 rounded-lg focus:ring-2 focus:ring-green-500 focus:border-transparent"
               >
                 <option value="">Select unit</option>
-                {Object.keys(units[category][country]).map(unit => (
+                {availableUnits.map(unit => (
                   <option key={unit} value={unit}>{unit}</option>
                 ))}
               </select>
@@ -676,7 +714,7 @@ const UnitConverter = () => {
                 className="w-full p-3 border border-gray-300 rounded-lg focus:ring-2 focus:ring-green-500 focus:border-transparent"
               >
                 <option value="">Select unit</option>
-                {Object.keys(units[category][country]).map(unit => (
+                {availableUnits.map(unit => (
                   <option key={unit} value={unit}>{unit}</option>
                 ))}
               </select>
@@ -688,7 +726,7 @@ const UnitConverter = () => {
 
           <button
             onClick={convert}
-            disabled={!inputValue || !fromUnit || !toUnit}
+            disabled={!registry || !inputValue || !fromUnit || !toUnit}
             className="w-full bg-green-500 text-white py-4 rounded-xl font-medium hover:bg-green-600 transition-colors disabled:bg-gray-400 disabled:cursor-not-allowed"
           >
             Convert
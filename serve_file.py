@@ -1,10 +1,371 @@
+"""Static file server for index.html, calctools and img.comp.html.
+
+    python serve_file.py [--port 8080] [--directory .] [--max-age 0]
+
+Each request is handled on its own thread, so a slow client no longer
+holds up everyone else, and connections are kept alive (HTTP/1.1).
+
+Text assets are compressed once, gzip and (if the ``brotli`` package is
+installed) brotli, at startup for the files already there and on first
+request for anything else, and the variant matching the request's
+Accept-Encoding is sent. Every response carries a strong ETag and
+Last-Modified, and If-None-Match / If-Modified-Since are answered with
+304. Single byte ranges (with If-Range) are served from the uncompressed
+file.
+
+File metadata, compressed variants and the contents of small files are
+kept in an in-memory cache that is checked against the file's mtime and
+size on every request, so edits show up immediately. Larger files are
+sent straight from disk with ``socket.sendfile`` (zero-copy ``sendfile``
+where the OS supports it).
+"""
+import argparse
+import email.utils
+import gzip
 import http.server
-import socketserver
+import os
+import posixpath
+import threading
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:  # Optional; gzip alone is served without it
+    brotli = None
 
 PORT = 8080
 
-Handler = http.server.SimpleHTTPRequestHandler
+# Files at most this large are kept in memory uncompressed as well
+HOT_FILE_MAX_BYTES = 256 * 1024
+# Total memory for cached file contents and compressed variants
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+# Larger files are not compressed at all
+COMPRESS_MAX_BYTES = 8 * 1024 * 1024
+COMPRESS_MIN_BYTES = 256
+
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "application/xml", "image/svg+xml")
+SKIP_DIRECTORIES = (".git", "node_modules", "__pycache__")
+
+
+class Asset(NamedTuple):
+    path: str
+    mtime_ns: int
+    size: int
+    content_type: str
+    etag: str
+    last_modified: str
+    content: Optional[bytes]  # Only for hot files
+    variants: Dict[str, bytes]  # Content-Encoding -> compressed body
+
+    @property
+    def cost(self) -> int:
+        return len(self.content or b"") + sum(len(body) for body in self.variants.values())
+
+
+def _encodings() -> Tuple[str, ...]:
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def _compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=11)
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def _sniff_type(path: str, content_type: str) -> str:
+    # calctools has no extension but is an HTML page
+    if content_type == "application/octet-stream" and not posixpath.splitext(path)[1]:
+        with open(path, "rb") as f:
+            head = f.read(64).lstrip().lower()
+        if head.startswith((b"<!doctype html", b"<html")):
+            return "text/html"
+    return content_type
+
+
+class AssetCache:
+    """Per-file metadata and bodies, rebuilt when the file's mtime or size changes"""
+
+    def __init__(self, guess_type, max_bytes: int = CACHE_MAX_BYTES):
+        self.guess_type = guess_type
+        self.max_bytes = max_bytes
+        self._assets: "OrderedDict[str, Asset]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, path: str, stat: os.stat_result) -> Asset:
+        with self._lock:
+            asset = self._assets.get(path)
+            if asset is not None and asset.mtime_ns == stat.st_mtime_ns and asset.size == stat.st_size:
+                self._assets.move_to_end(path)
+                return asset
+        # Built outside the lock; two threads may both build a changed file, which is harmless
+        asset = self._build(path, stat)
+        with self._lock:
+            previous = self._assets.pop(path, None)
+            if previous is not None:
+                self._bytes -= previous.cost
+            if asset.cost <= self.max_bytes:
+                self._assets[path] = asset
+                self._bytes += asset.cost
+                while self._bytes > self.max_bytes:
+                    _, evicted = self._assets.popitem(last=False)
+                    self._bytes -= evicted.cost
+        return asset
+
+    def _build(self, path: str, stat: os.stat_result) -> Asset:
+        content_type = _sniff_type(path, self.guess_type(path))
+        content = None
+        variants = {}
+        compressible = content_type.startswith(COMPRESSIBLE_TYPES)
+        if stat.st_size <= HOT_FILE_MAX_BYTES or (compressible and stat.st_size <= COMPRESS_MAX_BYTES):
+            with open(path, "rb") as f:
+                data = f.read()
+            if len(data) != stat.st_size:
+                # Changed while being read; rebuilt against the new stat next time
+                return self._asset(path, os.stat(path), content_type, None, {})
+            if stat.st_size <= HOT_FILE_MAX_BYTES:
+                content = data
+            if compressible and len(data) >= COMPRESS_MIN_BYTES:
+                for encoding in _encodings():
+                    compressed = _compress(data, encoding)
+                    if len(compressed) < len(data):
+                        variants[encoding] = compressed
+        return self._asset(path, stat, content_type, content, variants)
+
+    @staticmethod
+    def _asset(path, stat, content_type, content, variants) -> Asset:
+        return Asset(
+            path, stat.st_mtime_ns, stat.st_size, content_type,
+            f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"',
+            email.utils.formatdate(stat.st_mtime, usegmt=True),
+            content, variants,
+        )
+
+    def warm(self, directory: str) -> int:
+        """Load and compress every file under directory that fits the cache; returns the count"""
+        count = 0
+        for root, directories, files in os.walk(directory):
+            directories[:] = [name for name in directories if name not in SKIP_DIRECTORIES and not name.startswith(".")]
+            for name in files:
+                if name.startswith("."):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    self.get(path, os.stat(path))
+                    count += 1
+                except OSError:
+                    pass
+        return count
+
+
+def parse_accept_encoding(header: Optional[str]) -> Dict[str, float]:
+    """Content codings and their q-values; '*' stands for any coding not listed"""
+    accepted = {}
+    for part in (header or "").split(","):
+        name, *params = [piece.strip() for piece in part.split(";")]
+        if not name:
+            continue
+        quality = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        accepted[name.lower()] = quality
+    return accepted
+
+
+def choose_encoding(asset: Asset, header: Optional[str]) -> Optional[str]:
+    accepted = parse_accept_encoding(header)
+    best, best_quality = None, 0.0
+    for encoding in _encodings():  # Preferred first, so ties go to brotli
+        quality = accepted.get(encoding, accepted.get("*", 0.0))
+        if encoding in asset.variants and quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """The inclusive (start, end) of a single byte range, None to send the whole file.
+
+    Raises ValueError for a range that cannot be satisfied. Multiple ranges
+    are answered with the whole file, which the RFC allows.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start, dash, end = header[len("bytes="):].strip().partition("-")
+    if not dash or not (start + end).isdigit():
+        return None  # Malformed ranges are ignored
+    if not start:
+        length = int(end)
+        if length == 0 or size == 0:
+            raise ValueError("Range not satisfiable")
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = int(end) if end else size - 1
+    if start >= size or start > end:
+        raise ValueError("Range not satisfiable")
+    return start, min(end, size - 1)
+
+
+class StaticHandler(http.server.SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    cache: AssetCache = None  # Set by serve()
+    max_age = 0
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def _serve(self, send_body: bool):
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            if not self.path.split("?", 1)[0].endswith("/"):
+                # Same redirect SimpleHTTPRequestHandler does, so relative links resolve
+                self.send_response(301)
+                self.send_header("Location", self.path.split("?", 1)[0] + "/")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            index = os.path.join(path, "index.html")
+            if not os.path.isfile(index):
+                # Directory listing, as before
+                return super().do_GET() if send_body else super().do_HEAD()
+            path = index
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self.send_error(404, "File not found")
+            return
+        if not os.path.isfile(path):
+            self.send_error(404, "File not found")
+            return
+        asset = self.cache.get(path, stat)
+
+        encoding = choose_encoding(asset, self.headers.get("Accept-Encoding"))
+        etag = asset.etag if encoding is None else f'{asset.etag[:-1]}-{encoding}"'
+        headers = {
+            "ETag": etag,
+            "Last-Modified": asset.last_modified,
+            "Cache-Control": f"public, max-age={self.max_age}" if self.max_age else "no-cache",
+            "Accept-Ranges": "bytes",
+        }
+        if asset.variants:
+            headers["Vary"] = "Accept-Encoding"
+
+        if self._not_modified(asset):
+            self._send_headers(304, headers)
+            return
+
+        byte_range = None
+        if self._range_applies(asset):
+            try:
+                byte_range = parse_range(self.headers.get("Range"), asset.size)
+            except ValueError:
+                self._send_headers(416, {**headers, "Content-Range": f"bytes */{asset.size}", "Content-Length": "0"})
+                return
+
+        headers["Content-Type"] = asset.content_type
+        if byte_range is not None:
+            # Ranges always refer to the uncompressed file
+            start, end = byte_range
+            headers["ETag"] = asset.etag
+            headers["Content-Range"] = f"bytes {start}-{end}/{asset.size}"
+            headers["Content-Length"] = str(end - start + 1)
+            self._send_headers(206, headers)
+            if send_body:
+                self._send_file(asset, start, end - start + 1)
+            return
+
+        if encoding is not None:
+            body = asset.variants[encoding]
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(body))
+            self._send_headers(200, headers)
+            if send_body:
+                self.wfile.write(body)
+            return
+
+        headers["Content-Length"] = str(asset.size)
+        self._send_headers(200, headers)
+        if send_body:
+            self._send_file(asset, 0, asset.size)
+
+    def _not_modified(self, asset: Asset) -> bool:
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            # Weak comparison, and any encoding's tag of the current version matches
+            tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+            base = asset.etag[:-1]
+            return any(tag == "*" or tag == asset.etag or (tag.startswith(base + "-") and tag.endswith('"'))
+                       for tag in tags)
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return int(asset.mtime_ns // 1_000_000_000) <= since
+        return False
+
+    def _range_applies(self, asset: Asset) -> bool:
+        if self.headers.get("Range") is None:
+            return False
+        if_range = self.headers.get("If-Range")
+        # A stale If-Range means the client's partial copy is outdated: send it all
+        return if_range is None or if_range.strip() in (asset.etag, asset.last_modified)
+
+    def _send_headers(self, status: int, headers: Dict[str, str]) -> None:
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if status == 304:
+            self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def _send_file(self, asset: Asset, offset: int, count: int) -> None:
+        if asset.content is not None:
+            self.wfile.write(asset.content[offset:offset + count])
+            return
+        with open(asset.path, "rb") as f:
+            self.connection.sendfile(f, offset, count)
+
+    def log_message(self, format, *args):
+        # Logging per request costs more than serving a cached file
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def serve(port: int = PORT, directory: str = ".", max_age: int = 0, bind: str = "", verbose: bool = False) -> None:
+    directory = os.path.abspath(directory)
+    handler = type("Handler", (StaticHandler,), {"max_age": max_age})
+    handler.cache = AssetCache(lambda path: http.server.SimpleHTTPRequestHandler.guess_type(handler, path))
+    warmed = handler.cache.warm(directory)
+
+    def factory(*args):
+        return handler(*args, directory=directory)
+
+    with http.server.ThreadingHTTPServer((bind, port), factory) as httpd:
+        httpd.verbose = verbose
+        encodings = "+".join(_encodings())
+        print(f"serving {directory} at port {port} ({warmed} files cached, compressed as {encodings})")
+        httpd.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--bind", default="", help="address to listen on (default: all)")
+    parser.add_argument("--directory", default=".", help="directory to serve (default: current)")
+    parser.add_argument("--max-age", type=int, default=0, help="Cache-Control max-age in seconds (default: revalidate)")
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    args = parser.parse_args()
+    serve(args.port, args.directory, args.max_age, args.bind, args.verbose)
+
 
-with socketserver.TCPServer(("", PORT), Handler) as httpd:
-    print("serving at port", PORT)
-    httpd.serve_forever()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import expressions  # noqa: E402
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("sin(pi/4)^2 + log(100)", 2.5),
+    ("2*3^2", 18),
+    ("2^3^2", 512),
+    ("-2^2", -4),
+    ("(-2)^2", 4),
+    ("2^-1", 0.5),
+    ("2**3", 8),
+])
+def test_caret_is_power_with_power_precedence(text, expected):
+    assert expressions.evaluate(text) == pytest.approx(expected)
+
+
+def test_evaluates_over_array_of_x():
+    result = expressions.compile_expression("x^2 - 1").evaluate([0, 1, 2, 3])
+    assert result.tolist() == [-1, 0, 3, 8]
+
+
+def test_out_of_domain_points_are_none_in_plots():
+    plot = expressions.plot("1/x", -1, 1, 3)
+    assert plot["y"] == [-1.0, None, 1.0]
+
+
+@pytest.mark.parametrize("text", ["__import__('os').getcwd()", "x.real", "(1+", "2 xor 3", "'a'"])
+def test_rejects_invalid_or_unsafe_expressions(text):
+    with pytest.raises(expressions.ExpressionError):
+        expressions.compile_expression(text)
+
+
+def test_division_by_zero_is_infinite():
+    assert expressions.evaluate("1/0") == np.inf
@@ -0,0 +1,84 @@
+import io
+import sys
+from pathlib import Path
+
+import pytest
+from PIL import Image, ImageChops, ImageOps
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import processing  # noqa: E402
+
+ORIENTATION = 0x0112
+MAKE = 0x010F
+
+
+def make_jpeg(exif_tags=None, size=(64, 48)):
+    image = Image.new("RGB", size)
+    image.putdata([(x * 4, y * 5, (x + y) % 256) for y in range(size[1]) for x in range(size[0])])
+    options = {"quality": 95}
+    if exif_tags:
+        exif = Image.Exif()
+        for tag, value in exif_tags.items():
+            exif[tag] = value
+        options["exif"] = exif.tobytes()
+    output = io.BytesIO()
+    image.save(output, format="JPEG", **options)
+    return output.getvalue()
+
+
+def displayed(content):
+    return ImageOps.exif_transpose(Image.open(io.BytesIO(content))).convert("RGB")
+
+
+def assert_close(actual, expected, tolerance=8):
+    assert actual.size == expected.size
+    assert max(high for _, high in ImageChops.difference(actual, expected).getextrema()) <= tolerance
+
+
+@pytest.mark.parametrize("degrees", [90, 180, 270])
+def test_exif_mode_adds_orientation_to_existing_exif(degrees):
+    source = make_jpeg({MAKE: "TestCam"})
+    rotated, image_format, path = processing.rotate_image(source, degrees, "exif")
+
+    assert (image_format, path) == ("JPEG", "exif")
+    exif = Image.open(io.BytesIO(rotated)).getexif()
+    assert exif[MAKE] == "TestCam"
+    assert exif[ORIENTATION] == {90: 6, 180: 3, 270: 8}[degrees]
+    # Only metadata changed: the compressed image data is byte-for-byte the same
+    assert rotated.endswith(source[source.index(b"\xff\xdb"):])
+    assert_close(displayed(rotated), processing._rotate(displayed(source), degrees), tolerance=0)
+
+
+@pytest.mark.parametrize("orientation", range(1, 9))
+@pytest.mark.parametrize("degrees", [90, 180, 270])
+def test_exif_mode_composes_with_existing_orientation(orientation, degrees):
+    source = make_jpeg({ORIENTATION: orientation, MAKE: "TestCam"})
+    rotated, _, path = processing.rotate_image(source, degrees, "exif")
+
+    assert path == "exif"
+    assert_close(displayed(rotated), processing._rotate(displayed(source), degrees), tolerance=0)
+
+
+def test_exif_mode_without_exif_inserts_block():
+    source = make_jpeg()
+    rotated, _, path = processing.rotate_image(source, 90, "exif")
+
+    assert path == "exif"
+    assert Image.open(io.BytesIO(rotated)).getexif()[ORIENTATION] == 6
+
+
+@pytest.mark.parametrize("degrees", [90, 45])
+def test_exact_mode_turns_displayed_image_and_keeps_exif(degrees):
+    source = make_jpeg({ORIENTATION: 6, MAKE: "TestCam"})
+    rotated, image_format, path = processing.rotate_image(source, degrees, "exact")
+
+    assert (image_format, path) == ("JPEG", "transpose" if degrees == 90 else "resample")
+    result = Image.open(io.BytesIO(rotated))
+    exif = result.getexif()
+    assert exif[MAKE] == "TestCam"
+    assert exif.get(ORIENTATION, 1) == 1
+    # Re-encoded with the source's quantization tables, not the default quality
+    assert result.quantization == Image.open(io.BytesIO(source)).quantization
+    if degrees == 90:
+        assert_close(displayed(rotated), processing._rotate(displayed(source), 90))